@@ -0,0 +1,123 @@
+# 列名映射缓存：同一个平台导出的表头很少变，按规范化后的表头算指纹，第一次见到的表头把所有逻辑字段匹配一遍，
+# 结果（每个字段对应第几列）落盘；之后同样的表头直接查表，一次拿到全部字段对应的列名
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+def normalize(col):
+    return str(col).strip().replace('\t', '').replace('\n', '').replace(' ', '').replace('\ufeff', '').lower()
+
+
+def find_column(df_columns, possible_names, fuzzy=True):
+    """按候选名找列：先精确匹配（忽略空白、BOM、大小写），fuzzy=True 时再退到包含匹配"""
+    cleaned = [(col, normalize(col)) for col in df_columns]
+    targets = [p.lower().replace(' ', '') for p in possible_names]
+    # 1. 优先精确匹配
+    for col, clean_col in cleaned:
+        for target in targets:
+            if target == clean_col: return col
+    # 2. 模糊匹配
+    if fuzzy:
+        for col, clean_col in cleaned:
+            for target in targets:
+                if target in clean_col: return col
+    return None
+
+
+def fingerprint(layout, columns):
+    return hashlib.sha1('\x1f'.join([layout] + [normalize(c) for c in columns]).encode('utf-8')).hexdigest()
+
+
+def _spec(fields, fuzzy):
+    # 候选名改了以后旧映射作废，重新匹配
+    return hashlib.sha1(json.dumps([fields, fuzzy], ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class ColumnMapCache:
+    """entries: 指纹 -> {layout, header, spec, mapping: {字段: 列序号或 None}, hits, created, last_used}。
+    path 为 None 时只在内存里用（解析子进程里就是这样，更新通过 drain()/merge() 交回主进程落盘）"""
+    def __init__(self, path=None, entries=None):
+        self.path = path
+        self.entries = dict(entries or {})
+        self.dirty = set()  # 新增或命中过、还没落盘/交回的指纹
+        self.new_hits = {}  # 指纹 -> 上次 drain() 以来的命中次数
+        self.hits = self.misses = 0
+        self.hit_seconds = self.miss_seconds = 0.0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as f: entries = json.load(f)
+        except (OSError, ValueError): entries = {}
+        return cls(path, entries)
+
+    def resolve(self, layout, columns, fields, fuzzy=True):
+        """fields: {逻辑字段: 候选列名列表}，返回 {逻辑字段: 实际列名或 None}"""
+        t = time.perf_counter()
+        columns = list(columns)
+        key, spec = fingerprint(layout, columns), _spec(fields, fuzzy)
+        with self.lock:
+            entry = self.entries.get(key)
+            hit = entry is not None and entry['spec'] == spec
+            if not hit:
+                index = {col: i for i, col in reversed(list(enumerate(columns)))}
+                mapping = {}
+                for name, candidates in fields.items():
+                    col = find_column(columns, candidates, fuzzy)
+                    mapping[name] = None if col is None else index[col]
+                entry = self.entries[key] = {'layout': layout, 'header': [str(c) for c in columns], 'spec': spec, 'mapping': mapping, 'hits': 0, 'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            entry['hits'] += hit
+            if hit: self.new_hits[key] = self.new_hits.get(key, 0) + 1
+            entry['last_used'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.dirty.add(key)
+            elapsed = time.perf_counter() - t
+            if hit: self.hits += 1; self.hit_seconds += elapsed
+            else: self.misses += 1; self.miss_seconds += elapsed
+        return {name: None if i is None else columns[i] for name, i in entry['mapping'].items()}
+
+    def snapshot(self):
+        """交给解析子进程的只读副本"""
+        with self.lock: return {k: dict(v) for k, v in self.entries.items()}
+
+    def drain(self):
+        """取出自上次以来的新增/命中记录和计时，交回主进程 merge()"""
+        with self.lock:
+            changes = {'entries': {k: self.entries[k] for k in self.dirty}, 'new_hits': self.new_hits, 'hits': self.hits, 'misses': self.misses, 'hit_seconds': self.hit_seconds, 'miss_seconds': self.miss_seconds}
+            self.dirty, self.new_hits = set(), {}
+            self.hits = self.misses = 0
+            self.hit_seconds = self.miss_seconds = 0.0
+        return changes
+
+    def merge(self, changes):
+        with self.lock:
+            for key, entry in changes['entries'].items():
+                old, n = self.entries.get(key), changes['new_hits'].get(key, 0)
+                # 子进程拿的是快照，命中次数只累加它新增的部分
+                if old is not None and old['spec'] == entry['spec']: old.update(hits=old['hits'] + n, last_used=entry['last_used'])
+                else: self.entries[key] = dict(entry, hits=n)
+                self.dirty.add(key)
+            self.hits += changes['hits']; self.misses += changes['misses']
+            self.hit_seconds += changes['hit_seconds']; self.miss_seconds += changes['miss_seconds']
+
+    def save(self):
+        if not self.path or not self.dirty: return
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self.dirty = set()
+
+    def stats(self):
+        return {'layouts': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'avg_hit_us': self.hit_seconds / self.hits * 1e6 if self.hits else None,
+                'avg_miss_us': self.miss_seconds / self.misses * 1e6 if self.misses else None}
+
+    def layouts(self):
+        """已知表头，最近用过的在前"""
+        rows = [dict(e, fingerprint=k, matched=sum(i is not None for i in e['mapping'].values()), fields=len(e['mapping'])) for k, e in self.entries.items()]
+        return sorted(rows, key=lambda e: e.get('last_used', ''), reverse=True)
@@ -0,0 +1,139 @@
+# 备货单号解析：WB251016xxxx 这类单号里带着下单日期。整列版先去重，再用一条组合正则取出每个单号里最靠前的
+# WB / WB- / WB_ 日期片段，年月日按整列校验；最靠前的就是不带分隔符的 WB 片段时结果直接确定（绝大多数单号如此），
+# 剩下的少数再逐个用精确正则按原规则的先后顺序判断。单条查询走有上限的 LRU 缓存。
+# 两个系统的规则沿用各自原来的写法：
+#   stock_dates / stock_date  —— settlement-tracker：依次看 WB、WB-、WB_ 后面的 6 位数字（各取第一次出现），
+#                                 月 1-12、日 1-31 即可，都不行再找 YYYY-MM-DD 原样返回；结果是 'YYYY-MM-DD' 字符串或 None
+#   order_dates / order_date  —— weijing_system：只认第一次出现的 WB 加 6 位数字，必须是日历上存在的日期
+#                                 （同 strptime('%y%m%d')，69-99 算 19xx）；结果是 datetime.date，解析不出时整列版填 default、单条版返回 None
+import re
+from datetime import date
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+# 最靠前的 WB 日期片段；pyarrow 在时用它的 C++ 正则整列提取
+LEADING_PATTERN = r'WB(?P<sep>[-_]?)(?P<digits>\d{6})'
+# 原规则的四次 re.search 合成一条：每个前瞻各自从开头找第一次出现的位置
+EXACT_PATTERN = re.compile(r'(?s)^(?=(?:.*?WB(\d{6}))?)(?=(?:.*?WB-(\d{6}))?)(?=(?:.*?WB_(\d{6}))?)(?=(?:.*?(\d{4}-\d{2}-\d{2}))?)')
+CACHE_SIZE = 65536
+_MONTH_DAYS = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def _leading(texts):
+    """每个单号最靠前的 WB 片段 -> (分隔符, 6 位数字串, 对应的整数)；没有片段或数字不是 ASCII 的，整数为 NaN"""
+    if pyarrow is not None:
+        parts = pyarrow.compute.extract_regex(pyarrow.array(texts, type=pyarrow.string()), LEADING_PATTERN)
+        # 没匹配上的行整个 struct 为空，子字段要用 struct_field 取才会带上空值
+        sep = pyarrow.compute.struct_field(parts, 'sep').to_numpy(zero_copy_only=False)
+        digits = pyarrow.compute.struct_field(parts, 'digits')
+        # RE2 的 \d 只认 ASCII 数字，能直接转整数
+        number = pyarrow.compute.cast(digits, pyarrow.int64()).to_numpy(zero_copy_only=False).astype(float)
+        digits = pd.Series(digits, dtype='string[pyarrow]')
+    else:
+        parts = pd.Series(texts, dtype=object).str.extract(LEADING_PATTERN)
+        sep, digits = parts['sep'].to_numpy(dtype=object), parts['digits']
+        number = pd.to_numeric(digits, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return sep, digits, number
+
+
+def _split(number):
+    n = np.where(np.isnan(number), 0, number).astype('int64')
+    return n // 10000, n // 100 % 100, n % 100
+
+
+def _loose_ok(month, day):
+    return (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+
+
+def _full_year(yy):
+    return np.where(yy < 69, 2000 + yy, 1900 + yy)
+
+
+def _calendar_ok(year, month, day):
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return _loose_ok(month, day) & (day <= _MONTH_DAYS[np.clip(month, 0, 12)] + (leap & (month == 2)))
+
+
+def _stock_date_exact(text):
+    if not text or not isinstance(text, str):
+        return None
+    groups = EXACT_PATTERN.match(text).groups()
+    for digits in groups[:3]:
+        if digits is not None:
+            month, day = int(digits[2:4]), int(digits[4:6])
+            if 1 <= month <= 12 and 1 <= day <= 31:
+                return f"{2000 + int(digits[:2]):04d}-{month:02d}-{day:02d}"
+    return groups[3]
+
+
+def _order_date_exact(text):
+    digits = EXACT_PATTERN.match(text).group(1)
+    if digits is None or not digits.isascii():  # strptime 不认全角数字
+        return None
+    yy = int(digits[:2])
+    try:
+        return date(2000 + yy if yy < 69 else 1900 + yy, int(digits[2:4]), int(digits[4:6]))
+    except ValueError:
+        return None
+
+
+def _stock_dates(uniques):
+    text = np.array([isinstance(v, str) and v != '' for v in uniques], dtype=bool)
+    sep, digits, number = _leading(np.where(text, uniques, ''))
+    yy, month, day = _split(number)
+    hit = text & (sep == '') & ~np.isnan(number) & _loose_ok(month, day)
+    out = np.full(len(uniques), None, dtype=object)
+    digits = digits[hit]
+    out[hit] = ('20' + digits.str[:2] + '-' + digits.str[2:4] + '-' + digits.str[4:]).to_numpy(dtype=object)
+    rest = np.flatnonzero(text & ~hit)
+    out[rest] = [_stock_date_exact(uniques[i]) for i in rest]
+    return out
+
+
+def _order_dates(uniques, default):
+    texts = np.array([str(v) for v in uniques], dtype=object)
+    sep, _, number = _leading(texts)
+    yy, month, day = _split(number)
+    year = _full_year(yy)
+    decided = (sep == '') & ~np.isnan(number)  # 最靠前的就是 WB 片段，是否有效整列定
+    hit = decided & _calendar_ok(year, month, day)
+    out = np.full(len(uniques), default, dtype=object)
+    out[hit] = [date(y, m, d) for y, m, d in zip(year[hit].tolist(), month[hit].tolist(), day[hit].tolist())]
+    for i in np.flatnonzero(~decided):
+        parsed = _order_date_exact(texts[i])
+        if parsed is not None: out[i] = parsed
+    return out
+
+
+def _by_unique(values, parse, *args):
+    # 一单多行很常见，去重后只解析一遍
+    values = values.astype(object) if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return pd.Series(parse(np.asarray(uniques, dtype=object), *args)[codes], index=values.index, dtype=object)
+
+
+def stock_dates(values):
+    """整列版 stock_date，返回与 values 同索引的 object Series"""
+    return _by_unique(values, _stock_dates)
+
+
+def order_dates(values, default=None):
+    """整列版 order_date，解析不出的填 default（weijing 原来用当天日期）"""
+    return _by_unique(values, _order_dates, default)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def stock_date(stock_order_id):
+    return _stock_date_exact(stock_order_id)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def order_date(order_no):
+    return _order_date_exact(str(order_no))
@@ -0,0 +1,406 @@
+# 上传文件读取：按文件类型挑最快的可用解析后端，打不开或解析失败就退回下一个，并记录实际用的后端和解析耗时。
+# Excel 按固定行数切块产出 DataFrame，各块拼起来与 pd.read_excel 整表读取一致（列名、空值、类型推断都一样）：
+# 第一遍解析时统计各列在每块里推断出的类型，并把原始行按块暂存到临时文件；第二遍从临时文件读回、按全表类型切块输出。
+# CSV 先从文件开头一小段嗅探编码，再由解析器按块边读边解码，同样是第一遍统计类型并把解析好的块暂存到临时文件、第二遍按全表类型切块输出，
+# 同一时间只有一块在内存里，不留原始字节或解码后的整段文本
+import codecs
+import datetime
+import os
+import pickle
+import re
+import tempfile
+import time
+from openpyxl import load_workbook
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+DEFAULT_CHUNK_ROWS = 50000
+# calamine 会把整张表读进内存，更大的 xlsx 交给 openpyxl 流式读取。bench_readers 实测：calamine 快 5 倍左右，但内存随文件线性涨，
+# 每 MB xlsx 约 +22MB，10MB 时 +245MB、与大文件流式导入的 256MB 上限相当，40MB 时 +878MB；openpyxl 不论大小都在 +110~150MB
+CALAMINE_MAX_BYTES = 10 * 1024 * 1024
+CSV_ENCODINGS = ('utf-8-sig', 'gbk', 'gb18030')  # 平台导出的 CSV 有 UTF-8（可能带 BOM）也有 GBK
+SNIFF_BYTES = 64 * 1024
+# pd.read_csv 默认当作空值的字符串，pyarrow 解析时用同一套
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# 每种文件的后端按速度从快到慢排列，缺依赖的自动跳过
+BACKENDS = {'.xlsx': ['calamine', 'openpyxl'], '.xls': ['calamine', 'xlrd'], '.csv': ['pyarrow', 'pandas']}
+
+
+# ---------- Excel 行来源 ----------
+
+class _OpenpyxlBook:
+    def __init__(self, file):
+        self.wb = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+        self.sheet_names = list(self.wb.sheetnames)
+
+    def rows(self, sheet_name):
+        ws = self.wb.worksheets[sheet_name] if isinstance(sheet_name, int) else self.wb[sheet_name]
+        ws.reset_dimensions()
+        return ws.iter_rows(values_only=True)
+
+    def close(self):
+        self.wb.close()
+
+
+class _CalamineBook:
+    def __init__(self, file):
+        self.wb = python_calamine.load_workbook(file)
+        self.sheet_names = list(self.wb.sheet_names)
+
+    def rows(self, sheet_name):
+        sh = self.wb.get_sheet_by_index(sheet_name) if isinstance(sheet_name, int) else self.wb.get_sheet_by_name(sheet_name)
+        lead = [''] * (sh.start[1] if sh.start else 0)  # iter_rows 会带上表格上方的空行，但不带左侧空列
+        for r in sh.iter_rows():
+            # 纯日期单元格 calamine 给 date，openpyxl 给 datetime，统一成 datetime
+            yield lead + [datetime.datetime(v.year, v.month, v.day) if type(v) is datetime.date else v for v in r]
+
+    def close(self):
+        self.wb.close()
+
+
+def _convert(v):
+    # 同 pandas 的 Excel 读取：空单元格记为 ''，整数值的浮点数转 int
+    if v is None: return ''
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+
+def _trimmed(raw_rows):
+    """逐行产出转换后的单元格，去掉行尾空单元格；文件开头和末尾的空行不产出（同 pandas，表头取第一个非空行；中间的空行照常保留）"""
+    blank, started = 0, False
+    for raw in raw_rows:
+        row = [_convert(v) for v in raw]
+        while row and row[-1] == '': row.pop()
+        if not row: blank += started; continue
+        for _ in range(blank): yield []
+        blank, started = 0, True
+        yield row
+
+
+def _parse(header, rows, width, dtype=None):
+    pad = lambda r: r + [''] * (width - len(r))
+    return TextParser([pad(header)] + [pad(r) for r in rows], header=0, dtype=dtype).read()
+
+
+def _kind(s):
+    return 'na' if s.isna().all() else s.dtype.kind
+
+
+def _merge(ks, i, dtypes):
+    """把各块的类型合并成整列读取时 pandas 会推断的类型：None 表示按 object 原样保留"""
+    real = ks - {'na'}
+    if not real: return 'float64'
+    if real <= set('iuf'): return 'float64' if ('f' in real or 'na' in ks) else 'int64'
+    if real <= set('bf') and ('f' in real or 'na' in ks): return 'float64'  # 布尔列夹空值时 pandas 读成 1.0/0.0
+    if len(real) == 1 and ('na' not in ks or real <= set('MO')):
+        return dtypes[(i, real.pop())]
+    return None
+
+
+class _SpooledSheet:
+    """一个 Sheet 的两遍读取：构造时完成第一遍（统计类型 + 暂存原始行），frames() 做第二遍。
+    usecols 给了列名时只保留这些列（列名按整张表头处理后的名字算），其余列不做类型推断也不暂存"""
+    def __init__(self, raw_rows, chunk_rows, usecols=None):
+        self.spool = tempfile.TemporaryFile()
+        self.chunks, self.col_types, self.names = 0, {}, None
+        try: self._scan(_trimmed(raw_rows), chunk_rows, usecols)
+        except Exception: self.spool.close(); raise
+
+    def _frame(self, rows, width, dtype=None):
+        # 只取部分列时整行全空的行是否跳过要按原表宽度算：pandas 只在单列表里把空行当空白行跳过
+        if self.names is not None: return TextParser(rows, header=None, names=self.names, dtype=dtype, skip_blank_lines=self.single_column).read()
+        return _parse(self.header, rows, width, dtype)
+
+    def _scan(self, rows, chunk_rows, usecols):
+        self.header = next(rows, None)
+        if self.header is None: return
+        self.width = len(self.header)
+        if usecols:
+            names = list(_parse(self.header, [], self.width).columns)
+            self.single_column = len(names) == 1
+            pick = sorted(names.index(c) for c in usecols)
+            self.names, self.width = [names[i] for i in pick], len(pick)
+            rows = ([r[i] if i < len(r) else '' for i in pick] for r in rows)
+        kinds, dtypes, buf = {}, {}, []
+
+        def consume():
+            w = max([self.width] + [len(r) for r in buf])
+            df = self._frame(buf, w) if w else None
+            for i in range(w):
+                s = df.iloc[:, i]; k = _kind(s)
+                # 中途才出现的列，前面各块在这一列上都是空值
+                kinds.setdefault(i, {'na'} if self.chunks else set()).add(k)
+                if k != 'na': dtypes.setdefault((i, k), s.dtype)
+            pickle.dump(buf, self.spool, pickle.HIGHEST_PROTOCOL)
+            buf.clear()
+            self.chunks += 1
+            self.width = max(self.width, w)
+
+        for row in rows:
+            buf.append(row)
+            if len(buf) >= chunk_rows: consume()
+        if buf: consume()
+        self.col_types = {i: _merge(ks, i, dtypes) for i, ks in kinds.items()}
+
+    def frames(self):
+        try:
+            if self.header is None: yield pd.DataFrame(); return
+            columns = self._frame([], self.width).columns
+            as_object = {columns[i]: object for i, t in self.col_types.items() if t is None}
+            self.spool.seek(0); start = 0
+            for _ in range(self.chunks or 1):  # 只有表头时也产出一个空块，保留列名
+                rows = pickle.load(self.spool) if self.chunks else []
+                df = self._frame(rows, self.width, as_object or None)
+                for i, t in self.col_types.items():
+                    if t is not None and df.iloc[:, i].dtype != t: df[columns[i]] = df.iloc[:, i].astype(t)
+                df.index = pd.RangeIndex(start, start + len(df))
+                start += len(df)
+                yield df
+        finally:
+            self.spool.close()
+
+
+# ---------- CSV ----------
+
+def _rewind(file):
+    if hasattr(file, 'seek'): file.seek(0)
+    return file
+
+
+def _sniff_encoding(file, encodings):
+    """取文件开头最多 SNIFF_BYTES 字节，返回第一个能解开这一段的编码；都解不开时返回最后一个，解析时再报错"""
+    if hasattr(file, 'read'): head = _rewind(file).read(SNIFF_BYTES)
+    else:
+        with open(file, 'rb') as f: head = f.read(SNIFF_BYTES)
+    for enc in encodings:
+        # 截断处可能正好落在一个多字节字符中间，没读完整个文件时不要求末尾完整
+        try: codecs.getincrementaldecoder(enc)().decode(head, final=len(head) < SNIFF_BYTES)
+        except UnicodeDecodeError: continue
+        return enc
+    return encodings[-1]
+
+
+class _SpooledFrames:
+    """pd.read_csv 分块读取的两遍读取：构造时读完全部块（解码出错在这里就抛出，好换编码重读），统计各列在每块里推断出的类型并把块暂存到临时文件；
+    frames() 读回时按全表类型统一各块，合并规则同 _SpooledSheet"""
+    def __init__(self, frames):
+        self.spool = tempfile.TemporaryFile()
+        self.chunks, kinds, dtypes = 0, {}, {}
+        try:
+            for df in frames:
+                for i in range(df.shape[1] if len(df) else 0):  # 只有表头时各列保持 read_csv 给的类型
+                    s = df.iloc[:, i]; k = _kind(s)
+                    kinds.setdefault(i, set()).add(k)
+                    if k != 'na': dtypes.setdefault((i, k), s.dtype)
+                pickle.dump(df, self.spool, pickle.HIGHEST_PROTOCOL)
+                self.chunks += 1
+        except Exception: self.spool.close(); raise
+        self.col_types = {i: _merge(ks, i, dtypes) for i, ks in kinds.items()}
+
+    def frames(self):
+        try:
+            self.spool.seek(0)
+            for _ in range(self.chunks):
+                df = pickle.load(self.spool)
+                for i, t in self.col_types.items():
+                    if df.iloc[:, i].dtype != (t or object): df.isetitem(i, df.iloc[:, i].astype(t or object))
+                yield df
+        finally:
+            self.spool.close()
+
+
+def _widen(arrow_type):
+    """pyarrow 按第一块定列类型，后面的块装不下时按整表推断的顺序放宽一级；文本也装不下就是编码不对"""
+    order = [pyarrow.null(), pyarrow.int64(), pyarrow.bool_(), pyarrow.float64(), pyarrow.string()]
+    if arrow_type not in order[:-1]: return None
+    return order[order.index(arrow_type) + 1]
+
+
+def _pyarrow_csv(file, encoding, usecols=None):
+    """pyarrow 用 open_csv 逐块解码、解析 CSV，每块写进临时文件（Arrow IPC 流），返回 (临时文件, schema, 各列空值数)。
+    结果对齐 pd.read_csv：不自动识别日期、空值/布尔取值同 pandas；后面的块装不下第一块定的列类型时放宽这一列从头重读，最终类型同整表推断。
+    表头异常时抛错交给 pandas 后端。pyarrow 遇到不合法的 UTF-8 不报错（表头换成替换符、数据列读成 binary），这里当解码失败处理"""
+    is_utf8 = codecs.lookup(encoding).name in ('utf-8', 'utf-8-sig')  # BOM pyarrow 自己会跳过
+    read_options = pyarrow.csv.ReadOptions(encoding='utf8' if is_utf8 else encoding)
+    names = pyarrow.csv.open_csv(_rewind(file), read_options=read_options).schema.names
+    if is_utf8 and any('\ufffd' in n for n in names): raise UnicodeDecodeError(encoding, b'', 0, 1, '表头不是合法的 UTF-8')
+    if len(set(names)) != len(names) or '' in names: raise ValueError('表头有重名或空列名')
+    if usecols: usecols = [n for n in names if n in usecols]  # 保持文件里的列顺序，同 pandas
+    types = {}
+    while True:
+        spool = tempfile.TemporaryFile()
+        try:
+            # open_csv 时就解析了第一块，放宽过的列在第一块里也可能装不下
+            reader = pyarrow.csv.open_csv(_rewind(file), read_options=read_options, convert_options=pyarrow.csv.ConvertOptions(
+                column_types=types, include_columns=usecols, null_values=NA_VALUES, strings_can_be_null=True,
+                true_values=['True', 'TRUE', 'true'], false_values=['False', 'FALSE', 'false']))
+            temporal = {f.name: pyarrow.string() for f in reader.schema if pyarrow.types.is_temporal(f.type)}
+            if temporal: types.update(temporal); spool.close(); continue
+            if any(pyarrow.types.is_binary(f.type) for f in reader.schema): raise UnicodeDecodeError(encoding, b'', 0, 1, '数据不是合法的 UTF-8')
+            nulls = dict.fromkeys(reader.schema.names, 0)
+            with pyarrow.ipc.new_stream(spool, reader.schema) as sink:
+                for batch in reader:
+                    sink.write_batch(batch)
+                    for name, col in zip(batch.schema.names, batch.columns): nulls[name] += col.null_count
+        except pyarrow.ArrowInvalid as e:
+            spool.close()
+            m = re.search(r'CSV column #(\d+).*conversion error to (\w+)', str(e))
+            if not m: raise
+            name = names[int(m.group(1))]
+            wider = _widen(pyarrow.type_for_alias(m.group(2)))
+            if wider is None: raise UnicodeDecodeError(encoding, b'', 0, 1, f'列「{name}」解不开: {e}')
+            types[name] = wider
+            continue
+        except BaseException:
+            spool.close(); raise
+        spool.seek(0)
+        return spool, reader.schema, nulls
+
+
+def _arrow_frames(spooled, chunk_rows):
+    """从临时文件读回各块，按 chunk_rows 行重新切块转成 DataFrame，同一时间只有一块在 pandas 里；
+    各列类型按全表定（整数、布尔列全表有空值时同 pandas 改用 float / object），与整表 to_pandas 一致"""
+    spool, schema, nulls = spooled
+    as_type = {}
+    for f in schema:
+        if pyarrow.types.is_null(f.type): as_type[f.name] = 'float64'
+        elif nulls[f.name] and pyarrow.types.is_integer(f.type): as_type[f.name] = 'float64'
+        elif nulls[f.name] and pyarrow.types.is_boolean(f.type): as_type[f.name] = object
+
+    def frame(table, start):
+        df = table.to_pandas()
+        for name, t in as_type.items():
+            if df[name].dtype != t: df[name] = df[name].astype(t)
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    try:
+        pending, buffered, start = [], 0, 0
+        for batch in pyarrow.ipc.open_stream(spool):
+            pending.append(batch); buffered += batch.num_rows
+            while buffered >= chunk_rows:
+                table = pyarrow.Table.from_batches(pending, schema)
+                yield frame(table.slice(0, chunk_rows), start)
+                start += chunk_rows
+                rest = table.slice(chunk_rows); pending, buffered = rest.to_batches(), rest.num_rows
+        if buffered or not start: yield frame(pyarrow.Table.from_batches(pending, schema), start)  # 只有表头时也产出一个空块，保留列名
+    finally:
+        spool.close()
+
+
+def _file_size(file):
+    if hasattr(file, 'seek'):
+        file.seek(0, os.SEEK_END); size = file.tell(); file.seek(0)
+        return size
+    return os.path.getsize(file)
+
+
+# ---------- 对外接口 ----------
+
+class UploadReader:
+    """一个上传文件的读取器。backend 是实际用上的后端，parse_seconds 是累计解析耗时（不含调用方处理数据的时间），
+    fallbacks 记录试过但失败的后端及原因。encodings 只对 CSV 有效：候选编码，encoding 是实际用上的编码。
+    backends 指定后端时只按给的来（测速用），大文件也不会跳过 calamine"""
+    def __init__(self, file, filename, chunk_rows=DEFAULT_CHUNK_ROWS, encodings=CSV_ENCODINGS, backends=None):
+        self.file = file
+        self.ext = os.path.splitext(filename.lower())[1]
+        self.chunk_rows = chunk_rows
+        self.encodings = encodings
+        self.candidates = [b for b in (backends or BACKENDS.get(self.ext, BACKENDS['.xlsx'])) if self._usable(b, forced=backends is not None)]
+        self.backend, self.parse_seconds, self.fallbacks = None, 0.0, []
+        self.encoding = None
+
+    def _usable(self, backend, forced=False):
+        if backend == 'calamine':
+            return python_calamine is not None and (forced or self.ext == '.xls' or _file_size(self.file) <= CALAMINE_MAX_BYTES)
+        if backend == 'pyarrow': return pyarrow is not None
+        return True
+
+    def _open_book(self, backend):
+        if hasattr(self.file, 'seek'): self.file.seek(0)
+        return _CalamineBook(self.file) if backend == 'calamine' else _OpenpyxlBook(self.file)
+
+    def _read_csv(self, read):
+        """read(编码) 从嗅探出的编码开始试；开头一段恰好在几种编码下都合法（比如全是 ASCII）、后面才解不开时换下一个编码重读"""
+        if self.encoding is None: self.encoding = _sniff_encoding(self.file, self.encodings)
+        encodings = self.encodings[self.encodings.index(self.encoding):]
+        for enc in encodings:
+            try: result = read(enc)
+            except UnicodeDecodeError:
+                if enc == encodings[-1]: raise
+                continue
+            self.encoding = enc
+            return result
+
+    def _prepare(self, backend, sheet_name, usecols=None):
+        """用指定后端完成所有可能失败的解析工作，返回一个产出 DataFrame 的可迭代对象"""
+        if backend == 'pyarrow': return _arrow_frames(self._read_csv(lambda enc: _pyarrow_csv(self.file, enc, usecols)), self.chunk_rows)
+        if backend == 'pandas': return self._read_csv(lambda enc: _SpooledFrames(pd.read_csv(_rewind(self.file), encoding=enc, usecols=usecols, chunksize=self.chunk_rows))).frames()
+        if backend == 'xlrd':
+            if hasattr(self.file, 'seek'): self.file.seek(0)
+            return [pd.read_excel(self.file, sheet_name=sheet_name, usecols=usecols)]
+        book = self._open_book(backend)
+        try: return _SpooledSheet(book.rows(sheet_name), self.chunk_rows, usecols).frames()
+        finally: book.close()
+
+    def _attempt(self, fn):
+        """按候选顺序逐个后端尝试 fn(backend)，返回第一个成功的结果"""
+        error = None
+        for backend in self.candidates:
+            t = time.perf_counter()
+            try: result = fn(backend)
+            except Exception as e:
+                self.fallbacks.append((backend, str(e))); error = e; continue
+            finally: self.parse_seconds += time.perf_counter() - t
+            self.backend = backend
+            return result
+        raise error or ValueError(f'没有可用的读取后端: {self.ext}')
+
+    def sheet_names(self):
+        if self.ext == '.csv': return [0]
+        def names(backend):
+            if backend == 'xlrd':
+                if hasattr(self.file, 'seek'): self.file.seek(0)
+                return pd.ExcelFile(self.file).sheet_names
+            book = self._open_book(backend)
+            try: return book.sheet_names
+            finally: book.close()
+        return self._attempt(names)
+
+    def columns(self, sheet_name=0):
+        """只读表头行，返回按 pandas 规则处理后的列名（重名加 .1、空表头记 Unnamed: n），用来在整表解析前判断 Sheet 类型"""
+        t = time.perf_counter()
+        try:
+            if self.ext == '.csv': return list(self._read_csv(lambda enc: pd.read_csv(_rewind(self.file), encoding=enc, nrows=0)).columns)
+            if self.ext == '.xls':
+                if hasattr(self.file, 'seek'): self.file.seek(0)
+                return list(pd.read_excel(self.file, sheet_name=sheet_name, nrows=0).columns)
+            # xlsx 不管用哪个后端解析，表头都用 openpyxl 流式读第一行，calamine 取 Sheet 时会把整张表解析一遍
+            book = self._open_book('openpyxl')
+            try: header = next(_trimmed(book.rows(sheet_name)), None)
+            finally: book.close()
+            return list(_parse(header, [], len(header)).columns) if header else []
+        finally:
+            self.parse_seconds += time.perf_counter() - t
+
+    def chunks(self, sheet_name=0, usecols=None):
+        """逐块产出一个 Sheet（CSV 忽略 sheet_name）的 DataFrame；usecols 为 columns() 返回的列名子集时只解析这些列"""
+        frames = iter(self._attempt(lambda backend: self._prepare(backend, sheet_name, usecols)))
+        while True:
+            t = time.perf_counter()
+            df = next(frames, None)
+            self.parse_seconds += time.perf_counter() - t
+            if df is None: return
+            yield df
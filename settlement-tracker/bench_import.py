@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# 交易结算导入测速：在临时目录里建一个空库，按块读取文件并用 insert_transactions 写入（与后台导入任务相同，一个连接、最后统一提交），
+# 然后把同一个文件再导一遍（全部是重复行），分别输出每秒行数。
+# 用法: python bench_import.py [--file 文件路径] [--rows 行数]    不给文件时生成一个指定行数（默认 20 万行）的交易结算 CSV
+import argparse
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+def make_transactions(path, rows):
+    rng = np.random.default_rng(0)
+    days = pd.to_datetime('2025-01-01') + pd.to_timedelta(rng.integers(0, 90, rows), unit='D')
+    df = pd.DataFrame({
+        '订单编号': [f'PO-{i:09d}' for i in range(rows)],
+        '售后单号': '',
+        '备货单号': [f"WB{d.strftime('%y%m%d')}{i % 100000:05d}" for i, d in enumerate(days)],
+        '备货单类型': '定制品',
+        'SKU ID': rng.integers(10 ** 9, 10 ** 9 + 5000, rows),
+        'SKU货号': [f'SKU{i % 5000}' for i in range(rows)],
+        '货品名称': [f'测试商品{i % 800}' for i in range(rows)],
+        'SKU属性': '默认',
+        '数量': rng.integers(1, 4, rows),
+        '单品券金额': rng.choice(['/', '0', '1.5'], rows),
+        '店铺满减券金额': '/',
+        '申报价格折扣金额': 0,
+        '交易类型': rng.choice(['销售回款', '销售冲回'], rows, p=[0.9, 0.1]),
+        '金额': rng.random(rows).round(2) * 100,
+        '币种': 'CNY',
+        '账务时间': [f"{d.strftime('%Y-%m-%d')} {i % 24:02d}:{i % 60:02d}:{i * 7 % 60:02d}" for i, d in enumerate(days)],
+    })
+    df.to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def run_import(database, reader_cls, path, shop_name):
+    reader = reader_cls(path, os.path.basename(path))
+    inserted = skipped = rows = 0
+    start = time.perf_counter()
+    conn = database._connect()
+    try:
+        for df in reader.chunks():
+            chunk_inserted, chunk_skipped = database.insert_transactions(df, shop_name, conn)
+            inserted += chunk_inserted; skipped += chunk_skipped; rows += len(df)
+        conn.commit()
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    write_seconds = elapsed - reader.parse_seconds
+    print(f"  {rows} 行：新增 {inserted}，跳过 {skipped}；总耗时 {elapsed:.2f}s（{reader.backend} 解析 {reader.parse_seconds:.2f}s）")
+    print(f"  总体 {rows / elapsed:,.0f} 行/秒，写库 {rows / write_seconds:,.0f} 行/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='交易结算导入测速：首次导入和重复导入的每秒行数')
+    parser.add_argument('--file', help='要导入的交易结算文件（CSV / Excel），不给时生成一个')
+    parser.add_argument('--rows', type=int, default=200000, help='生成的文件行数（默认 20 万）')
+    args = parser.parse_args()
+    path, rows = (os.path.abspath(args.file) if args.file else None), args.rows
+    work_dir = tempfile.mkdtemp(prefix='bench_import_')
+    db_path = os.environ['SETTLEMENT_DB_PATH'] = os.path.join(work_dir, 'settlement_system.db')
+    if path is None:
+        path = os.path.join(work_dir, 'transactions.csv')
+        print(f"📝 生成 {rows} 行交易结算数据: {path}")
+        make_transactions(path, rows)
+
+    import app as database
+    from readers import UploadReader
+    database.init_database()
+
+    print("📥 首次导入（全部新增）")
+    run_import(database, UploadReader, path, database.SHOP_LIST[0])
+    print("📥 重复导入（全部跳过）")
+    run_import(database, UploadReader, path, database.SHOP_LIST[0])
+    print(f"临时库: {db_path}")
+
+
+if __name__ == '__main__':
+    main()
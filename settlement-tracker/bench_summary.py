@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# 汇总店铺重算测速：在临时目录里建库，给 10 个店铺各造 N 天（默认 1000 天）的日汇总，
+# 分别用原来按 (日期, 店铺) 逐条查询的循环和现在的 update_all_shops_summary 重算"汇总"行，核对结果一致并输出耗时；
+# 再看只重算一天（导入一天的文件后）的耗时。
+# 最后比较日汇总触发器模式：同一个交易结算文件分别导入关/开触发器的空库，输出每行多花的时间，并跑一致性检查。
+# 用法: python bench_summary.py [天数] [导入行数]
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+SHOPS = 10
+
+
+def legacy_update_all_shops_summary(database):
+    """原来的实现：每个日期、每个店铺各查一次，每个日期再查一次汇总店铺 ID"""
+    conn = database._connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, shop_name FROM shops WHERE shop_name != '汇总'")
+    shops = cursor.fetchall()
+    cursor.execute("SELECT DISTINCT settlement_date FROM daily_summary WHERE settlement_date IS NOT NULL ORDER BY settlement_date")
+    for (date,) in cursor.fetchall():
+        totals = [0, 0, 0, 0]
+        for shop_id, _ in shops:
+            cursor.execute("SELECT total_sales, total_refunds, total_subsidies, total_after_sales FROM daily_summary WHERE shop_id = ? AND settlement_date = ?", (shop_id, date))
+            result = cursor.fetchone()
+            if result:
+                totals = [t + (v or 0) for t, v in zip(totals, result)]
+        cursor.execute("SELECT id FROM shops WHERE shop_name = '汇总'")
+        summary_shop_id = cursor.fetchone()[0]
+        cursor.execute("INSERT OR REPLACE INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales) VALUES (?, ?, ?, ?, ?, ?)",
+                       (summary_shop_id, date, *totals))
+    conn.commit()
+    conn.close()
+
+
+def summary_rows(database):
+    conn = database._connect()
+    rows = conn.execute('''
+    SELECT d.settlement_date, d.total_sales, d.total_refunds, d.total_subsidies, d.total_after_sales
+    FROM daily_summary d JOIN shops s ON s.id = d.shop_id
+    WHERE s.shop_name = '汇总' ORDER BY d.settlement_date
+    ''').fetchall()
+    conn.close()
+    return rows
+
+
+def fill_daily_summary(database, days):
+    rng = np.random.default_rng(0)
+    conn = database._connect()
+    missing = SHOPS - conn.execute("SELECT COUNT(*) FROM shops WHERE shop_name != '汇总'").fetchone()[0]
+    conn.executemany("INSERT INTO shops (shop_name) VALUES (?)", [(f'测试店铺{i + 1}',) for i in range(max(missing, 0))])
+    shop_ids = [r[0] for r in conn.execute("SELECT id FROM shops WHERE shop_name != '汇总' ORDER BY id LIMIT ?", (SHOPS,))]
+    dates = pd.date_range('2023-01-01', periods=days).strftime('%Y-%m-%d')
+    rows = [(shop_id, date, *rng.random(4).round(2) * 1000) for shop_id in shop_ids for date in dates]
+    conn.executemany("INSERT INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return list(dates)
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {elapsed:.3f}s")
+    return elapsed
+
+
+def import_with_summary(database, path, shop_name):
+    """与后台导入任务相同：一个连接按块写入，没装触发器时按涉及的日期重算日汇总，最后统一提交；返回 (写入耗时, 总耗时)"""
+    from readers import UploadReader
+    frames = list(UploadReader(path, os.path.basename(path)).chunks())
+    start = time.perf_counter()
+    conn = database._connect()
+    touched = set()
+    try:
+        for df in frames:
+            database.insert_transactions(df, shop_name, conn, touched)
+        written = time.perf_counter() - start
+        if not database.summary_triggers_installed(conn):
+            database.refresh_daily_summary(touched, conn)
+            database.update_all_shops_summary({date for _, date in touched}, conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return written, time.perf_counter() - start
+
+
+def bench_triggers(database, work_dir, rows):
+    from bench_import import make_transactions
+    path = os.path.join(work_dir, 'transactions.csv')
+    make_transactions(path, rows)
+    print(f"⚡ 日汇总触发器：导入 {rows} 行交易结算")
+    results = {}
+    for enabled in (False, True):
+        db_dir = os.path.join(work_dir, 'triggers_on' if enabled else 'triggers_off')
+        os.makedirs(db_dir)
+        database.DB_PATH = os.path.join(db_dir, 'settlement_system.db')
+        database.init_database(summary_triggers=enabled)
+        written, total = results[enabled] = import_with_summary(database, path, database.SHOP_LIST[0])
+        mismatches = database.check_daily_summary()
+        print(f"  触发器{'开' if enabled else '关'}: 写入 {written:.2f}s，含日汇总共 {total:.2f}s，一致性检查不一致 {len(mismatches)} 行")
+    extra = (results[True][0] - results[False][0]) / rows * 1e6
+    print(f"  每插入一行多花 {extra:.1f}µs；导入加日汇总合计 {results[False][1]:.2f}s → {results[True][1]:.2f}s")
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    work_dir = tempfile.mkdtemp(prefix='bench_summary_')
+    os.environ['SETTLEMENT_DB_PATH'] = os.path.join(work_dir, 'settlement_system.db')
+
+    import app as database
+    database.init_database(summary_triggers=False)
+    dates = fill_daily_summary(database, days)
+    print(f"📊 {SHOPS} 个店铺 × {days} 天日汇总")
+
+    legacy = timed("原循环全量重算", legacy_update_all_shops_summary, database)
+    expected = summary_rows(database)
+    current = timed("update_all_shops_summary 全量重算", database.update_all_shops_summary)
+    got = summary_rows(database)
+    same = len(got) == len(expected) and all(a[0] == b[0] and np.allclose(a[1:], b[1:]) for a, b in zip(got, expected))
+    print(f"  结果一致: {'是' if same else '否'}，{legacy / current:.0f} 倍")
+    timed("update_all_shops_summary 只重算一天", database.update_all_shops_summary, {dates[-1]})
+    bench_triggers(database, work_dir, rows)
+    print(f"临时目录: {work_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,33 @@
 # Complete database helper module for settlement-tracker
 # Replace settlement-tracker/database.py with this file.
 import sqlite3
+import numpy as np
 import pandas as pd
 from datetime import datetime
-import re
 import os
+import sys
+import time
+# 两个系统共用的模块（上传文件读取等）放在仓库根目录的 common/ 下，只有一份
+COMMON_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+if COMMON_DIR not in sys.path: sys.path.insert(0, COMMON_DIR)
+from column_map import ColumnMapCache
+from order_numbers import stock_date, stock_dates
+from natural_keys import ensure_natural_keys
 
 DB_PATH = os.getenv('SETTLEMENT_DB_PATH', 'settlement_system.db')
+# 1 = keep daily_summary current with triggers on the detail tables (see set_summary_triggers)
+SUMMARY_TRIGGERS = os.getenv('SETTLEMENT_SUMMARY_TRIGGERS') == '1'
 
 # Shop list used by templates
 SHOP_LIST = ["云企", "鲸画", "知己知彼", "鼎银", "德勤", "淘小铺", "维鲸", "点小饿", "扶风", "汇总"]
 
 def _connect():
-    return sqlite3.connect(DB_PATH)
+    # WAL：后台导入逐块提交期间别的连接照常读，块与块之间任务表、新任务也写得进
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
 
-def init_database():
+def init_database(summary_triggers=None):
     conn = _connect()
     cursor = conn.cursor()
     # shops
@@ -120,31 +133,19 @@ def init_database():
         UNIQUE(shop_id, spu_id, sku_attribute)
     )
     ''')
+    ensure_summary_indexes(conn)
+    ensure_natural_keys(conn)
     conn.commit()
     conn.close()
+    set_summary_triggers(SUMMARY_TRIGGERS if summary_triggers is None else summary_triggers)
 
 def parse_date_from_stock_id(stock_order_id):
-    if not stock_order_id or not isinstance(stock_order_id, str):
-        return None
-    patterns = [r'WB(\d{6})', r'WB-(\d{6})', r'WB_(\d{6})']
-    for p in patterns:
-        m = re.search(p, stock_order_id)
-        if m:
-            ds = m.group(1)
-            try:
-                year = int("20" + ds[:2])
-                month = int(ds[2:4])
-                day = int(ds[4:6])
-                if 1 <= month <= 12 and 1 <= day <= 31:
-                    return f"{year:04d}-{month:02d}-{day:02d}"
-            except:
-                continue
-    m2 = re.search(r'(\d{4})-(\d{2})-(\d{2})', str(stock_order_id))
-    if m2:
-        return f"{m2.group(1)}-{m2.group(2)}-{m2.group(3)}"
-    return None
+    return stock_date(stock_order_id)
 
-def get_shop_id(shop_name):
+def get_shop_id(shop_name, conn=None):
+    if conn is not None:
+        r = conn.execute("SELECT id FROM shops WHERE shop_name = ?", (shop_name,)).fetchone()
+        return r[0] if r else None
     conn = _connect()
     c = conn.cursor()
     c.execute("SELECT id FROM shops WHERE shop_name = ?", (shop_name,))
@@ -152,302 +153,453 @@ def get_shop_id(shop_name):
     conn.close()
     return r[0] if r else None
 
+# 各类导入表在代码里按这些列名取值；上传文件的表头只是空格、BOM、大小写不同时，按表头指纹缓存的映射改回这些名字。
+# 只做精确匹配不做包含匹配，免得 '金额' 对上 '单品券金额'
+IMPORT_COLUMNS = {
+    'after_sales': ['赔付金额', '账务时间', '违规ID', 'SKU ID', '货品名称', '币种'],
+    'transactions': ['备货单号', '账务时间', '数量', '金额', 'SKU ID', '交易类型', '订单编号', '售后单号', '备货单类型', 'SKU货号', '货品名称', 'SKU属性', '单品券金额', '店铺满减券金额', '申报价格折扣金额', '币种'],
+    'shipping': ['备货单', '商品SPU ID', '商品SKC ID', 'SKC ID', '商品SKU ID', '商品名称', '商品属性集', '申报价格', '单价', '价格', '成本单价', '成本价', '成本'],
+}
+column_cache = ColumnMapCache.load(os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'column_maps.json'))
+
+def canonical_columns(df, layout):
+    mapping = column_cache.resolve(layout, df.columns, {name: [name] for name in IMPORT_COLUMNS[layout]}, fuzzy=False)
+    column_cache.save()
+    rename = {col: name for name, col in mapping.items() if col is not None and col != name and name not in df.columns}
+    return df.rename(columns=rename) if rename else df
+
 # Insert functions (transactions/after_sales/shipping)
-def insert_after_sales(df, shop_name):
-    shop_id = get_shop_id(shop_name)
-    if not shop_id:
-        return 0, 0
-    conn = _connect()
-    inserted = 0
-    skipped = 0
-    for _, row in df.iterrows():
-        try:
-            amount = row.get('赔付金额', 0)
-            if pd.isna(amount):
-                amount = 0
-            account_time = str(row.get('账务时间', '')).strip()
-            settlement_date = account_time[:10] if account_time and len(account_time) >= 10 else None
-            violation_id = str(row.get('违规ID', '')).strip()
-            sku_id = str(row.get('SKU ID', '')).strip()
-            if after_sale_exists(shop_id, violation_id, sku_id, account_time, settlement_date):
-                skipped += 1
-                continue
-            conn.execute('''
-            INSERT INTO after_sales (shop_id, violation_id, sku_id, product_name, settlement_amount, currency, account_time, settlement_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                shop_id,
-                violation_id,
-                sku_id,
-                str(row.get('货品名称', '')).strip(),
-                float(amount),
-                str(row.get('币种', 'CNY')).strip(),
-                account_time,
-                settlement_date
-            ))
-            inserted += 1
-        except Exception as e:
-            print(f"insert_after_sales error: {e}")
-    conn.commit()
-    conn.close()
-    return inserted, skipped
+# ---------- 批量导入 ----------
+# 整列转换取值、executemany 插入（重复记录由自然键唯一索引跳过），全程只用调用方（或自己开）的一个连接；
+# 转换结果与原来逐行 str(row.get(...)) / float(str(...)) 的写法一致
 
-def insert_transactions(df, shop_name):
-    shop_id = get_shop_id(shop_name)
-    if not shop_id:
-        return 0, 0
-    conn = _connect()
-    inserted = 0
-    skipped = 0
-    for _, row in df.iterrows():
+def _text_column(df, col, default='', strip=True):
+    """整列版的 str(row.get(col, default))，strip=True 时再 .strip()"""
+    if col not in df.columns:
+        values = [str(default)] * len(df)
+    elif isinstance(df[col].dtype, pd.StringDtype):
+        values = df[col].to_numpy(dtype=object, na_value=str(df[col].dtype.na_value))  # 文本列只有空值要转成字符串
+    else:
+        values = [str(v) for v in df[col].astype(object)]
+    return pd.Series([v.strip() for v in values] if strip else values, index=df.index, dtype=object)
+
+def _number_column(df, col, default, via_str=True):
+    """整列版的 float(str(x))（via_str=False 时是 float(x)）：空值记 default，转不了的记 None"""
+    if col not in df.columns:
+        return pd.Series(float(str(default)) if via_str else float(default), index=df.index, dtype=object)
+    s = df[col]
+    if s.dtype.kind in 'iuf' or (s.dtype.kind == 'b' and not via_str):
+        return s.astype('float64').fillna(default).astype(object)
+    def convert(v):
+        if pd.isna(v):
+            return default
         try:
-            stock_order_id = str(row.get('备货单号', '')).strip()
-            settlement_date = parse_date_from_stock_id(stock_order_id)
-            account_time = str(row.get('账务时间', ''))
-            if not settlement_date and account_time and len(account_time) >= 10:
-                settlement_date = account_time[:10]
-            quantity = row.get('数量', 1)
-            if pd.isna(quantity) or quantity == '/':
-                quantity = 1
-            else:
-                try:
-                    quantity = int(float(str(quantity)))
-                except:
-                    quantity = 1
-            amount = row.get('金额', 0)
-            if pd.isna(amount) or amount == '/':
-                amount = 0
-            else:
-                try:
-                    amount = float(str(amount))
-                except:
-                    amount = 0
-            sku_id = str(row.get('SKU ID', '')).strip()
-            transaction_type = str(row.get('交易类型', '销售回款')).strip()
-            if transaction_exists(shop_id, sku_id, account_time, transaction_type, settlement_date):
-                skipped += 1
+            return float(str(v)) if via_str else float(v)
+        except (TypeError, ValueError):
+            return None
+    # 不用 Series.map：结果全是数字和 None 时会被推断成 float，None 变成 NaN
+    return pd.Series([convert(v) for v in s.astype(object)], index=df.index, dtype=object)
+
+def _nullable(s):
+    return s.astype(object).where(s.notna(), None)
+
+def ensure_summary_indexes(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        for table in ('transaction_settlements', 'after_sales'):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_shop_date ON {table} (shop_id, settlement_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_daily_summary_date ON daily_summary (settlement_date)")
+        if own_conn:
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+
+def insert_after_sales(df, shop_name, conn=None, touched=None):
+    # 传入 conn 时由调用方统一提交，分块导入同一个文件时只提交一次；touched 收集有新增记录的 (shop_id, settlement_date)
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        shop_id = get_shop_id(shop_name, conn)
+        if not shop_id:
+            return 0, 0
+        df = canonical_columns(df, 'after_sales')
+        
+        amount = _number_column(df, '赔付金额', 0, via_str=False)
+        account_time = _text_column(df, '账务时间')
+        settlement_date = _nullable(account_time.where(account_time.str.len() >= 10).str[:10])
+        violation_id = _text_column(df, '违规ID')
+        sku_id = _text_column(df, 'SKU ID')
+        
+        rows, failed = [], 0
+        for values in zip(violation_id, sku_id, _text_column(df, '货品名称'), amount, _text_column(df, '币种', 'CNY'), account_time, settlement_date):
+            if values[3] is None:
+                failed += 1
                 continue
-            def parse_amount(val):
-                if pd.isna(val) or val == '/' or val == '':
-                    return 0
-                try:
-                    return float(str(val))
-                except:
-                    return 0
-            conn.execute('''
-            INSERT INTO transaction_settlements 
-            (shop_id, order_id, after_sale_id, stock_order_id, stock_order_type, sku_id, sku_code, product_name, sku_attribute, quantity, coupon_amount, store_coupon_amount, declared_discount, transaction_type, amount, currency, account_time, settlement_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                shop_id,
-                str(row.get('订单编号', '')).strip(),
-                str(row.get('售后单号', '')).strip(),
-                stock_order_id,
-                str(row.get('备货单类型', '定制品')).strip(),
-                sku_id,
-                str(row.get('SKU货号', '')).strip(),
-                str(row.get('货品名称', '')).strip(),
-                str(row.get('SKU属性', '')).strip(),
-                quantity,
-                parse_amount(row.get('单品券金额', 0)),
-                parse_amount(row.get('店铺满减券金额', 0)),
-                parse_amount(row.get('申报价格折扣金额', 0)),
-                transaction_type,
-                amount,
-                str(row.get('币种', 'CNY')).strip(),
-                account_time,
-                settlement_date
-            ))
-            inserted += 1
-        except Exception as e:
-            print(f"insert_transactions error: {e}")
-    conn.commit()
-    conn.close()
-    return inserted, skipped
+            rows.append((shop_id, *values))
+        if failed:
+            print(f"insert_after_sales error: {failed} rows with non-numeric 赔付金额")
+        changes = conn.total_changes
+        conn.executemany('''
+        INSERT INTO after_sales 
+        (shop_id, violation_id, sku_id, product_name, settlement_amount, currency, account_time, settlement_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        ''', rows)
+        inserted = conn.total_changes - changes
+        if touched is not None and inserted:
+            touched.update((shop_id, d) for d in set(settlement_date) if d)
+        
+        if own_conn:
+            conn.commit()
+        return inserted, len(rows) - inserted
+    finally:
+        if own_conn:
+            conn.close()
 
-def insert_shipping_details(df, shop_name):
-    shop_id = get_shop_id(shop_name)
-    if not shop_id:
-        print(f"店铺 '{shop_name}' 不存在")
-        return 0, 0
-    
-    conn = _connect()
-    inserted_count = 0
-    skipped_count = 0
-    
-    for _, row in df.iterrows():
-        try:
-            stock_order = str(row.get('备货单', '')).strip()
-            stock_order_id = None
-            quantity = 1
-            
-            # 解析备货单号和数量
-            if '，' in stock_order:
-                parts = stock_order.split('，')
-                if len(parts) >= 2:
-                    stock_order_id = parts[0].strip()
-                    quantity_str = parts[1].replace('件', '').strip()
-                    try:
-                        quantity = int(quantity_str)
-                    except:
-                        quantity = 1
-            else:
-                stock_order_id = stock_order
-            
-            shipping_date = parse_date_from_stock_id(stock_order_id) if stock_order_id else None
-            
-            spu_id = str(row.get('商品SPU ID', '')).strip()
-            skc_id = str(row.get('商品SKC ID', '')).strip()
-            if not skc_id:
-                skc_id = str(row.get('SKC ID', '')).strip()
-            sku_id = str(row.get('商品SKU ID', '')).strip()
-            product_name = str(row.get('商品名称', '')).strip()
-            sku_attribute = str(row.get('商品属性集', '')).strip()
-            
-            if shipping_detail_exists(shop_id, stock_order_id, sku_id):
-                skipped_count += 1
+def insert_transactions(df, shop_name, conn=None, touched=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        shop_id = get_shop_id(shop_name, conn)
+        if not shop_id:
+            return 0, 0
+        df = canonical_columns(df, 'transactions')
+        
+        stock_order_id = _text_column(df, '备货单号')
+        account_time = _text_column(df, '账务时间', strip=False)
+        # 备货单号里解析不出日期时用账务时间的日期部分
+        settlement_date = stock_dates(stock_order_id)
+        settlement_date = _nullable(settlement_date.where(settlement_date.notna(), account_time.where(account_time.str.len() >= 10).str[:10]))
+        
+        quantity = pd.to_numeric(_number_column(df, '数量', 1))
+        quantity = np.trunc(quantity.where(np.isfinite(quantity), 1)).astype('int64')
+        sku_id = _text_column(df, 'SKU ID')
+        transaction_type = _text_column(df, '交易类型', '销售回款')
+        
+        amounts = [[0 if v is None else v for v in _number_column(df, col, 0)] for col in ('单品券金额', '店铺满减券金额', '申报价格折扣金额', '金额')]
+        columns = zip(_text_column(df, '订单编号'), _text_column(df, '售后单号'), stock_order_id, _text_column(df, '备货单类型', '定制品'),
+                      sku_id, _text_column(df, 'SKU货号'), _text_column(df, '货品名称'), _text_column(df, 'SKU属性'), quantity.tolist(),
+                      *amounts[:3], transaction_type, amounts[3], _text_column(df, '币种', 'CNY'), account_time, settlement_date)
+        rows = [(shop_id, *values) for values in columns]
+        changes = conn.total_changes
+        conn.executemany('''
+        INSERT INTO transaction_settlements 
+        (shop_id, order_id, after_sale_id, stock_order_id, stock_order_type, sku_id, sku_code, 
+         product_name, sku_attribute, quantity, coupon_amount, store_coupon_amount, 
+         declared_discount, transaction_type, amount, currency, account_time, settlement_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        ''', rows)
+        inserted = conn.total_changes - changes
+        if touched is not None and inserted:
+            touched.update((shop_id, d) for d in set(settlement_date) if d)
+        
+        if own_conn:
+            conn.commit()
+        return inserted, len(rows) - inserted
+    finally:
+        if own_conn:
+            conn.close()
+
+def _split_stock_order(stock_order):
+    """'备货单号，N件' -> (备货单号, N)；没有数量部分时数量记 1"""
+    if '，' not in stock_order:
+        return stock_order, 1
+    parts = stock_order.split('，')
+    try:
+        return parts[0].strip(), int(parts[1].replace('件', '').strip())
+    except ValueError:
+        return parts[0].strip(), 1
+
+def _declared_price(value):
+    # 新商品从上传文件里带的价格列取值，空值、0、转不了的都记 0
+    if not value:
+        return 0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+# 本进程累计的发货明细导入计数（替代原来每建一个新商品打印一行）
+shipping_ingest_stats = {'rows': 0, 'inserted': 0, 'skipped': 0, 'new_products': 0, 'seconds': 0.0}
+
+def insert_shipping_details(df, shop_name, conn=None):
+    started = time.perf_counter()
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        shop_id = get_shop_id(shop_name, conn)
+        if not shop_id:
+            print(f"店铺 '{shop_name}' 不存在")
+            return 0, 0
+        df = canonical_columns(df, 'shipping')
+        
+        stock_orders = [_split_stock_order(s) for s in _text_column(df, '备货单')]
+        stock_order_id = [s for s, _ in stock_orders]
+        quantity = np.array([q for _, q in stock_orders], dtype='int64')
+        shipping_date = stock_dates(stock_order_id).tolist()
+        spu_id = _text_column(df, '商品SPU ID')
+        skc_id = _text_column(df, '商品SKC ID')
+        skc_id = skc_id.where(skc_id != '', _text_column(df, 'SKC ID'))
+        sku_id = _text_column(df, '商品SKU ID')
+        product_name = _text_column(df, '商品名称')
+        sku_attribute = _text_column(df, '商品属性集')
+        
+        # 店铺的商品价格一次读进来；表里没有的商品用它第一次出现那行带的价格新建，同一文件后面的行沿用已建的价格
+        prices = {(spu, attr): (unit or 0, cost or 0) for spu, attr, unit, cost in conn.execute(
+            "SELECT spu_id, sku_attribute, unit_price, cost_price FROM product_prices WHERE shop_id = ?", (shop_id,))}
+        first = lambda *cols: next((c for c in cols if c in df.columns), None)
+        unit_col, cost_col = first('申报价格', '单价', '价格'), first('成本单价', '成本价', '成本')
+        unit_values = df[unit_col].tolist() if unit_col else [0] * len(df)
+        cost_values = df[cost_col].tolist() if cost_col else [0] * len(df)
+        unit_price, new_products = [], []
+        for i, key in enumerate(zip(spu_id, sku_attribute)):
+            if key in prices:
+                unit_price.append(prices[key][0])
                 continue
-            
-            # **关键修改：检查并插入 product_prices（确保商品存在）**
-            cursor = conn.cursor()
-            cursor.execute('''
-            SELECT unit_price, cost_price FROM product_prices 
-            WHERE shop_id = ? AND spu_id = ? AND sku_attribute = ?
-            ''', (shop_id, spu_id, sku_attribute))
-            
-            price_result = cursor.fetchone()
-            
-            if price_result:
-                # 如果商品已存在，使用商品表中的价格
-                unit_price = price_result[0] or 0
-                cost_price = price_result[1] or 0
-            else:
-                # 如果商品不存在，创建新的商品记录
-                unit_price = 0  # 默认价格
-                cost_price = 0  # 默认成本价
-                
-                # 检查是否传入价格信息（从其他列获取）
-                unit_price_col = row.get('申报价格', row.get('单价', row.get('价格', 0)))
-                if unit_price_col:
-                    try:
-                        unit_price = float(unit_price_col)
-                    except:
-                        unit_price = 0
-                
-                cost_price_col = row.get('成本单价', row.get('成本价', row.get('成本', 0)))
-                if cost_price_col:
-                    try:
-                        cost_price = float(cost_price_col)
-                    except:
-                        cost_price = 0
-                
-                # 插入新的商品记录
-                cursor.execute('''
-                INSERT OR IGNORE INTO product_prices 
-                (shop_id, spu_id, skc_id, sku_id, product_name, sku_attribute, unit_price, cost_price)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    shop_id,
-                    spu_id,
-                    skc_id,
-                    sku_id,
-                    product_name,
-                    sku_attribute,
-                    unit_price,
-                    cost_price
-                ))
-                print(f"✅ 自动创建商品记录: {product_name} ({sku_attribute})")
-            
-            total_amount = unit_price * quantity
-            
-            # 插入发货明细
-            cursor.execute('''
-            INSERT INTO shipping_details 
-            (shop_id, spu_id, skc_id, sku_id, product_name, sku_attribute, 
-             stock_order_id, quantity, unit_price, total_amount, shipping_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                shop_id,
-                spu_id,
-                skc_id,
-                sku_id,
-                product_name,
-                sku_attribute,
-                stock_order_id,
-                quantity,
-                unit_price,
-                total_amount,
-                shipping_date
-            ))
-            inserted_count += 1
-            
-        except Exception as e:
-            print(f"插入发货数据出错: {e}, 行数据: {row.to_dict()}")
-    
-    conn.commit()
-    conn.close()
-    print(f"✅ 导入完成: 新增 {inserted_count} 条发货记录")
-    return inserted_count, skipped_count
+            unit, cost = _declared_price(unit_values[i]), _declared_price(cost_values[i])
+            new_products.append((shop_id, key[0], skc_id.iat[i], sku_id.iat[i], product_name.iat[i], key[1], unit, cost))
+            prices[key] = (0 if pd.isna(unit) else unit or 0, 0 if pd.isna(cost) else cost or 0)  # 存进库里 NaN 会变成 NULL，读回来记 0
+            unit_price.append(unit)
+        unit_price = np.array(unit_price, dtype='float64')
+        total_amount = unit_price * quantity
+        
+        conn.executemany('''
+        INSERT OR IGNORE INTO product_prices 
+        (shop_id, spu_id, skc_id, sku_id, product_name, sku_attribute, unit_price, cost_price)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', new_products)
+        
+        changes = conn.total_changes
+        conn.executemany('''
+        INSERT INTO shipping_details 
+        (shop_id, spu_id, skc_id, sku_id, product_name, sku_attribute, 
+         stock_order_id, quantity, unit_price, total_amount, shipping_date)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+        ''', [(shop_id, *values) for values in zip(spu_id, skc_id, sku_id, product_name, sku_attribute, stock_order_id,
+                                                     quantity.tolist(), unit_price.tolist(), total_amount.tolist(), shipping_date)])
+        inserted = conn.total_changes - changes
+        
+        if own_conn:
+            conn.commit()
+    finally:
+        if own_conn:
+            conn.close()
+    elapsed = time.perf_counter() - started
+    for name, value in (('rows', len(df)), ('inserted', inserted), ('skipped', len(df) - inserted), ('new_products', len(new_products)), ('seconds', elapsed)):
+        shipping_ingest_stats[name] += value
+    print(f"✅ 导入完成: 新增 {inserted} 条发货记录，自动创建 {len(new_products)} 个商品记录（{len(df)} 行，{elapsed:.2f}s）")
+    return inserted, len(df) - inserted
 
 # summary updates
+def refresh_daily_summary(keys, conn=None):
+    """Recompute daily_summary for the given (shop_id, settlement_date) keys with one grouped query and one upsert."""
+    keys = sorted({(sid, d) for sid, d in keys if sid and d})
+    if not keys:
+        return 0
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS summary_keys (shop_id INTEGER, settlement_date DATE, PRIMARY KEY (shop_id, settlement_date))")
+        conn.execute("DELETE FROM summary_keys")
+        conn.executemany("INSERT INTO summary_keys (shop_id, settlement_date) VALUES (?, ?)", keys)
+        conn.execute('''
+        INSERT INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales)
+        SELECT shop_id, settlement_date,
+            COALESCE(SUM(CASE WHEN transaction_type = '销售回款' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN transaction_type = '销售冲回' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN transaction_type = '非商责补贴' THEN amount END), 0),
+            COALESCE(SUM(after_sales_amount), 0)
+        FROM (
+            SELECT t.shop_id, t.settlement_date, t.transaction_type, t.amount, NULL AS after_sales_amount
+            FROM summary_keys k JOIN transaction_settlements t ON t.shop_id = k.shop_id AND t.settlement_date = k.settlement_date
+            UNION ALL
+            SELECT a.shop_id, a.settlement_date, NULL, NULL, a.settlement_amount
+            FROM summary_keys k JOIN after_sales a ON a.shop_id = k.shop_id AND a.settlement_date = k.settlement_date
+        )
+        GROUP BY shop_id, settlement_date
+        ON CONFLICT (shop_id, settlement_date) DO UPDATE SET
+            total_sales = excluded.total_sales, total_refunds = excluded.total_refunds,
+            total_subsidies = excluded.total_subsidies, total_after_sales = excluded.total_after_sales
+        ''')
+        conn.execute("DELETE FROM summary_keys")
+        if own_conn:
+            conn.commit()
+        return len(keys)
+    finally:
+        if own_conn:
+            conn.close()
+
 def update_daily_summary(shop_name):
     shop_id = get_shop_id(shop_name)
     if not shop_id:
         return
     conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT DISTINCT settlement_date FROM transaction_settlements WHERE shop_id = ? AND settlement_date IS NOT NULL
-    UNION
-    SELECT DISTINCT settlement_date FROM after_sales WHERE shop_id = ? AND settlement_date IS NOT NULL
-    ''', (shop_id, shop_id))
-    dates = [r[0] for r in cursor.fetchall()]
-    for d in dates:
-        if not d:
-            continue
-        cursor.execute("SELECT COALESCE(SUM(amount),0) FROM transaction_settlements WHERE shop_id = ? AND settlement_date = ? AND transaction_type = '销售回款'", (shop_id, d))
-        total_sales = cursor.fetchone()[0]
-        cursor.execute("SELECT COALESCE(SUM(amount),0) FROM transaction_settlements WHERE shop_id = ? AND settlement_date = ? AND transaction_type = '销售冲回'", (shop_id, d))
-        total_refunds = cursor.fetchone()[0]
-        cursor.execute("SELECT COALESCE(SUM(amount),0) FROM transaction_settlements WHERE shop_id = ? AND settlement_date = ? AND transaction_type = '非商责补贴'", (shop_id, d))
-        total_subsidies = cursor.fetchone()[0]
-        cursor.execute("SELECT COALESCE(SUM(settlement_amount),0) FROM after_sales WHERE shop_id = ? AND settlement_date = ?", (shop_id, d))
-        total_after = cursor.fetchone()[0]
-        cursor.execute('''
-        INSERT OR REPLACE INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (shop_id, d, total_sales, total_refunds, total_subsidies, total_after))
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.execute('''
+        SELECT DISTINCT settlement_date FROM transaction_settlements WHERE shop_id = ? AND settlement_date IS NOT NULL
+        UNION
+        SELECT DISTINCT settlement_date FROM after_sales WHERE shop_id = ? AND settlement_date IS NOT NULL
+        ''', (shop_id, shop_id))
+        refresh_daily_summary([(shop_id, r[0]) for r in cursor.fetchall()], conn)
+        conn.commit()
+    finally:
+        conn.close()
 
-def update_all_shops_summary():
+def update_all_shops_summary(dates=None, conn=None):
+    """Rebuild the 汇总 rows (sum over the other shops) for the given dates, or all dates, with one INSERT ... SELECT ... GROUP BY."""
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        sumid = conn.execute("SELECT id FROM shops WHERE shop_name = '汇总'").fetchone()
+        if not sumid:
+            return 0
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS summary_dates (settlement_date DATE PRIMARY KEY)")
+        conn.execute("DELETE FROM summary_dates")
+        if dates is None:
+            conn.execute("INSERT INTO summary_dates SELECT DISTINCT settlement_date FROM daily_summary WHERE settlement_date IS NOT NULL")
+        else:
+            conn.executemany("INSERT INTO summary_dates (settlement_date) VALUES (?)", [(d,) for d in set(dates) if d])
+        cur = conn.execute('''
+        INSERT INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales)
+        SELECT ?, d.settlement_date,
+            COALESCE(SUM(s.total_sales), 0), COALESCE(SUM(s.total_refunds), 0),
+            COALESCE(SUM(s.total_subsidies), 0), COALESCE(SUM(s.total_after_sales), 0)
+        FROM summary_dates d
+        LEFT JOIN daily_summary s ON s.settlement_date = d.settlement_date AND s.shop_id IN (SELECT id FROM shops WHERE shop_name != '汇总')
+        GROUP BY d.settlement_date
+        ON CONFLICT (shop_id, settlement_date) DO UPDATE SET
+            total_sales = excluded.total_sales, total_refunds = excluded.total_refunds,
+            total_subsidies = excluded.total_subsidies, total_after_sales = excluded.total_after_sales
+        ''', (sumid[0],))
+        conn.execute("DELETE FROM summary_dates")
+        if own_conn:
+            conn.commit()
+        return cur.rowcount
+    finally:
+        if own_conn:
+            conn.close()
+
+# daily_summary trigger mode: every insert/delete/update on the detail tables adds its delta to the shop row and the 汇总 row.
+# Contribution of each table to (sales, refunds, subsidies, after_sales); {row} is NEW or OLD
+SUMMARY_DELTAS = {
+    'transaction_settlements': (
+        "CASE WHEN {row}.transaction_type = '销售回款' THEN COALESCE({row}.amount, 0) ELSE 0 END",
+        "CASE WHEN {row}.transaction_type = '销售冲回' THEN COALESCE({row}.amount, 0) ELSE 0 END",
+        "CASE WHEN {row}.transaction_type = '非商责补贴' THEN COALESCE({row}.amount, 0) ELSE 0 END",
+        "0",
+    ),
+    'after_sales': ("0", "0", "0", "COALESCE({row}.settlement_amount, 0)"),
+}
+SUMMARY_TRIGGER_COLUMNS = {
+    'transaction_settlements': 'shop_id, settlement_date, transaction_type, amount',
+    'after_sales': 'shop_id, settlement_date, settlement_amount',
+}
+
+def _summary_delta_sql(table, row, sign):
+    deltas = ', '.join(f"{sign}({d.format(row=row)})" for d in SUMMARY_DELTAS[table])
+    return f'''
+    INSERT INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales)
+    SELECT target.shop_id, {row}.settlement_date, {deltas}
+    FROM (SELECT {row}.shop_id AS shop_id UNION ALL SELECT id FROM shops WHERE shop_name = '汇总') target
+    WHERE {row}.settlement_date IS NOT NULL AND {row}.shop_id NOT IN (SELECT id FROM shops WHERE shop_name = '汇总')
+    ON CONFLICT (shop_id, settlement_date) DO UPDATE SET
+        total_sales = total_sales + excluded.total_sales, total_refunds = total_refunds + excluded.total_refunds,
+        total_subsidies = total_subsidies + excluded.total_subsidies, total_after_sales = total_after_sales + excluded.total_after_sales;
+    '''
+
+def summary_triggers_installed(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        names = {f"trg_{t}_summary_{e}" for t in SUMMARY_DELTAS for e in ('insert', 'delete', 'update')}
+        return names <= {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    finally:
+        if own_conn:
+            conn.close()
+
+def _drop_summary_triggers(conn):
+    for t in SUMMARY_DELTAS:
+        for e in ('insert', 'delete', 'update'):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{t}_summary_{e}")
+
+def _create_summary_triggers(conn):
+    for t in SUMMARY_DELTAS:
+        conn.execute(f"CREATE TRIGGER trg_{t}_summary_insert AFTER INSERT ON {t} BEGIN {_summary_delta_sql(t, 'NEW', '+')} END")
+        conn.execute(f"CREATE TRIGGER trg_{t}_summary_delete AFTER DELETE ON {t} BEGIN {_summary_delta_sql(t, 'OLD', '-')} END")
+        conn.execute(f"CREATE TRIGGER trg_{t}_summary_update AFTER UPDATE OF {SUMMARY_TRIGGER_COLUMNS[t]} ON {t} "
+                     f"BEGIN {_summary_delta_sql(t, 'OLD', '-')} {_summary_delta_sql(t, 'NEW', '+')} END")
+
+def set_summary_triggers(enabled):
+    """Turn trigger mode on/off. Turning it on rebuilds daily_summary from the detail tables first."""
     conn = _connect()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, shop_name FROM shops WHERE shop_name != '汇总'")
-    shops = cursor.fetchall()
-    cursor.execute("SELECT DISTINCT settlement_date FROM daily_summary WHERE settlement_date IS NOT NULL ORDER BY settlement_date")
-    dates = [r[0] for r in cursor.fetchall()]
-    for d in dates:
-        if not d:
-            continue
-        total_sales = total_refunds = total_subsidies = total_after = 0
-        for sid, sname in shops:
-            cursor.execute("SELECT total_sales, total_refunds, total_subsidies, total_after_sales FROM daily_summary WHERE shop_id = ? AND settlement_date = ?", (sid, d))
-            r = cursor.fetchone()
-            if r:
-                total_sales += r[0] or 0
-                total_refunds += r[1] or 0
-                total_subsidies += r[2] or 0
-                total_after += r[3] or 0
-        cursor.execute("SELECT id FROM shops WHERE shop_name = '汇总'")
-        sumid = cursor.fetchone()
-        if sumid:
-            cursor.execute('''
-            INSERT OR REPLACE INTO daily_summary (shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (sumid[0], d, total_sales, total_refunds, total_subsidies, total_after))
-    conn.commit()
-    conn.close()
+    try:
+        installed = summary_triggers_installed(conn)
+        if enabled and not installed:
+            _drop_summary_triggers(conn)
+            conn.execute("DELETE FROM daily_summary")
+            keys = conn.execute('''
+            SELECT shop_id, settlement_date FROM transaction_settlements WHERE settlement_date IS NOT NULL
+            UNION
+            SELECT shop_id, settlement_date FROM after_sales WHERE settlement_date IS NOT NULL
+            ''').fetchall()
+            refresh_daily_summary(keys, conn)
+            update_all_shops_summary(conn=conn)
+            _create_summary_triggers(conn)
+        elif not enabled and installed:
+            _drop_summary_triggers(conn)
+        conn.commit()
+    finally:
+        conn.close()
+
+def check_daily_summary(tolerance=1e-6, conn=None):
+    """Compare daily_summary with a full recompute from the detail tables (汇总 = sum of the other shops).
+    Missing rows count as 0. Returns [(shop_id, settlement_date, stored, recomputed)] that differ by more than tolerance."""
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect()
+    try:
+        r = conn.execute("SELECT id FROM shops WHERE shop_name = '汇总'").fetchone()
+        sumid = r[0] if r else None
+        expected = {}
+        for sid, d, *totals in conn.execute('''
+        SELECT shop_id, settlement_date,
+            COALESCE(SUM(CASE WHEN transaction_type = '销售回款' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN transaction_type = '销售冲回' THEN amount END), 0),
+            COALESCE(SUM(CASE WHEN transaction_type = '非商责补贴' THEN amount END), 0),
+            COALESCE(SUM(after_sales_amount), 0)
+        FROM (
+            SELECT shop_id, settlement_date, transaction_type, amount, NULL AS after_sales_amount FROM transaction_settlements
+            UNION ALL
+            SELECT shop_id, settlement_date, NULL, NULL, settlement_amount FROM after_sales
+        )
+        WHERE settlement_date IS NOT NULL AND shop_id IS NOT ?
+        GROUP BY shop_id, settlement_date
+        ''', (sumid,)):
+            expected[(sid, d)] = totals
+            if sumid is not None:
+                expected[(sumid, d)] = [a + b for a, b in zip(expected.get((sumid, d), [0, 0, 0, 0]), totals)]
+        actual = {(sid, d): list(t) for sid, d, *t in conn.execute(
+            "SELECT shop_id, settlement_date, total_sales, total_refunds, total_subsidies, total_after_sales FROM daily_summary")}
+        out = []
+        for key in sorted(set(expected) | set(actual), key=repr):
+            got, want = actual.get(key, [0, 0, 0, 0]), expected.get(key, [0, 0, 0, 0])
+            if any(abs((a or 0) - b) > tolerance for a, b in zip(got, want)):
+                out.append((*key, got, want))
+        return out
+    finally:
+        if own_conn:
+            conn.close()
 
 # search & retrieval helpers
 def get_daily_summary(shop_name, date):
@@ -738,11 +890,16 @@ def compare_shipping_settlement(shop_name, start_date=None, end_date=None):
 def clear_all_data():
     conn = _connect()
     c = conn.cursor()
+    triggers = summary_triggers_installed(conn)  # drop them so the bulk delete doesn't update daily_summary row by row
+    if triggers:
+        _drop_summary_triggers(conn)
     c.execute("DELETE FROM after_sales")
     c.execute("DELETE FROM transaction_settlements")
     c.execute("DELETE FROM daily_summary")
     c.execute("DELETE FROM shipping_details")
     c.execute("DELETE FROM product_prices")
+    if triggers:
+        _create_summary_triggers(conn)
     conn.commit()
     conn.close()
 
@@ -757,23 +914,6 @@ def get_all_dates():
     conn.close()
     return {'transaction_dates': transaction_dates, 'after_sales_dates': after_dates, 'shipping_dates': shipping_dates}
 
-def transaction_exists(shop_id, sku_id, account_time, transaction_type, settlement_date):
-    conn = _connect(); c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM transaction_settlements WHERE shop_id = ? AND sku_id = ? AND account_time = ? AND transaction_type = ? AND settlement_date = ?', (shop_id, sku_id, account_time, transaction_type, settlement_date))
-    r = c.fetchone()[0]; conn.close(); return r > 0
-
-def after_sale_exists(shop_id, violation_id, sku_id, account_time, settlement_date):
-    conn = _connect(); c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM after_sales WHERE shop_id = ? AND violation_id = ? AND sku_id = ? AND account_time = ? AND settlement_date = ?', (shop_id, violation_id, sku_id, account_time, settlement_date))
-    r = c.fetchone()[0]; conn.close(); return r > 0
-
-def shipping_detail_exists(shop_id, stock_order_id, sku_id):
-    if not stock_order_id:
-        return False
-    conn = _connect(); c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM shipping_details WHERE shop_id = ? AND stock_order_id = ? AND sku_id = ?', (shop_id, stock_order_id, sku_id))
-    r = c.fetchone()[0]; conn.close(); return r > 0
-
 def debug_data():
     conn = _connect(); c = conn.cursor()
     c.execute("SELECT COUNT(*) FROM after_sales"); a = c.fetchone()[0]
@@ -7,6 +7,7 @@ import app  # 导入你的 app.py 模块
 import pandas as pd
 from datetime import datetime
 import os
+from readers import UploadReader
 
 def show_menu():
     """显示主菜单"""
@@ -68,30 +69,41 @@ def import_transaction_data():
     print("请准备CSV文件，包含以下列:")
     print("  - 备货单号, SKU ID, 货品名称, 数量, 金额, 交易类型等")
     
-    file_path = input("请输入CSV文件路径（直接回车使用示例数据）: ").strip()
+    file_path = input("请输入CSV/Excel文件路径（直接回车使用示例数据）: ").strip()
     shop_name = select_shop()
     
     if not shop_name:
         return
     
+    touched = set()  # 有新增记录的 (店铺ID, 日期)，只重算这些日汇总
     if file_path:
         if not os.path.exists(file_path):
             print(f"❌ 文件不存在: {file_path}")
             return
+        # 按块读、按块写，共用一个连接最后统一提交，大文件不用整表拼到内存里
+        reader = UploadReader(file_path, file_path)
+        inserted = skipped = rows = 0
+        conn = app._connect()
         try:
-            df = pd.read_csv(file_path)
-            print(f"✅ 成功读取 {len(df)} 行数据")
+            for df in reader.chunks():
+                chunk_inserted, chunk_skipped = app.insert_transactions(df, shop_name, conn, touched)
+                inserted += chunk_inserted; skipped += chunk_skipped; rows += len(df)
+            conn.commit()
         except Exception as e:
             print(f"❌ 读取文件失败: {e}")
             return
+        finally:
+            conn.close()
+        print(f"✅ 成功读取 {rows} 行数据（{reader.backend} 解析 {reader.parse_seconds:.2f}s{'，编码 ' + reader.encoding if reader.encoding else ''}）")
     else:
         # 创建示例数据
         df = create_sample_transaction_data()
         print("📝 使用示例数据...")
+        inserted, skipped = app.insert_transactions(df, shop_name, touched=touched)
     
-    inserted, skipped = app.insert_transactions(df, shop_name)
-    app.update_daily_summary(shop_name)
-    app.update_all_shops_summary()
+    if not app.summary_triggers_installed():
+        app.refresh_daily_summary(touched)
+        app.update_all_shops_summary({date for _, date in touched})
     
     print(f"\n✅ 导入完成:")
     print(f"  新增: {inserted} 条记录")
@@ -108,9 +120,11 @@ def import_after_sales_data():
     # 创建示例数据
     df = create_sample_after_sales_data()
     
-    inserted, skipped = app.insert_after_sales(df, shop_name)
-    app.update_daily_summary(shop_name)
-    app.update_all_shops_summary()
+    touched = set()
+    inserted, skipped = app.insert_after_sales(df, shop_name, touched=touched)
+    if not app.summary_triggers_installed():
+        app.refresh_daily_summary(touched)
+        app.update_all_shops_summary({date for _, date in touched})
     
     print(f"\n✅ 导入完成:")
     print(f"  新增: {inserted} 条记录")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# 各表的自然键：同一店铺下这些列都相同的记录算重复，由唯一索引保证只存一条，导入时 ON CONFLICT DO NOTHING 跳过。
+# 交易结算原来查重只看 SKU、账务时间、交易类型、结算日期，这里还带上备货单号和订单编号，
+# 不然同一时刻结算的同一 SKU 的不同订单会被当成一条——这类记录原来导入时会被跳过，现在各存一条。
+#
+# 老库里可能已经有重复记录，唯一索引建不上。启动时（init_database、后台导入线程）只给没有重复记录的表建索引，
+# 有重复记录的表原样不动、打印提示，由下面的迁移命令清理：
+#   python natural_keys.py            列出每张表要删的重复记录（每组保留 id 最小的一条），不改库
+#   python natural_keys.py --apply    先把库文件备份一份，再删除重复记录、建唯一索引、重算日汇总
+import argparse
+import shutil
+import sys
+from datetime import datetime
+
+NATURAL_KEYS = {
+    'transaction_settlements': ['shop_id', 'sku_id', 'account_time', 'transaction_type', 'settlement_date', 'stock_order_id', 'order_id'],
+    'after_sales': ['shop_id', 'violation_id', 'sku_id', 'account_time', 'settlement_date'],
+    'shipping_details': ['shop_id', 'stock_order_id', 'sku_id'],
+}
+
+
+def _has_unique_key(conn, table, columns):
+    for _, name, unique, *_ in conn.execute(f"PRAGMA index_list({table})"):
+        if unique and [row[2] for row in conn.execute(f"PRAGMA index_info('{name}')")] == columns:
+            return True
+    return False
+
+
+def _create_unique_key(conn, table):
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_natural_key ON {table} ({', '.join(NATURAL_KEYS[table])})")
+
+
+def find_duplicates(conn):
+    """还没有自然键唯一索引的表 -> 其中的重复记录 [(要删的 id, 同组保留的 id)]；键里有 NULL 的记录唯一索引不管，不算重复"""
+    duplicates = {}
+    for table, columns in NATURAL_KEYS.items():
+        if _has_unique_key(conn, table, columns):
+            continue
+        key = ', '.join(columns)
+        duplicates[table] = conn.execute(f'''
+        SELECT id, keep_id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY {key} ORDER BY id) AS rn, MIN(id) OVER (PARTITION BY {key}) AS keep_id FROM {table}
+            WHERE {' AND '.join(f'{c} IS NOT NULL' for c in columns)}
+        ) WHERE rn > 1 ORDER BY id
+        ''').fetchall()
+    return duplicates
+
+
+def ensure_natural_keys(conn):
+    """给没有重复记录的表建自然键唯一索引（已有就跳过）；有重复记录的表不删不建，返回 {表名: 重复条数}，由调用方提交"""
+    pending = {}
+    for table, duplicates in find_duplicates(conn).items():
+        if duplicates:
+            pending[table] = len(duplicates)
+            print(f"⚠️  {table} 有 {len(duplicates)} 条重复记录，自然键唯一索引没建，重复导入的记录不会被跳过；"
+                  f"运行 python natural_keys.py 查看，确认后加 --apply 清理")
+        else:
+            _create_unique_key(conn, table)
+    return pending
+
+
+def remove_duplicates(conn):
+    """删掉各表的重复记录（每组保留 id 最小的一条）并建唯一索引，由调用方提交 -> {表名: 删除的 id}"""
+    removed = {}
+    for table, duplicates in find_duplicates(conn).items():
+        conn.executemany(f"DELETE FROM {table} WHERE id = ?", [(i,) for i, _ in duplicates])
+        _create_unique_key(conn, table)
+        removed[table] = [i for i, _ in duplicates]
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='清理各表的重复记录并建自然键唯一索引；不加 --apply 时只列出要删的记录')
+    parser.add_argument('--db', help='库文件，默认同 SETTLEMENT_DB_PATH（没设时是 settlement_system.db）')
+    parser.add_argument('--apply', action='store_true', help='真正删除；删之前把库文件备份到同目录下')
+    parser.add_argument('--show', type=int, default=20, help='每张表列出多少条要删的记录')
+    args = parser.parse_args(argv)
+    import app as database
+    if args.db:
+        database.DB_PATH = args.db
+    conn = database._connect()
+    try:
+        duplicates = find_duplicates(conn)
+        for table, rows in duplicates.items():
+            print(f"{table}: {len(rows)} 条重复记录" + ('' if rows else '，可以直接建唯一索引'))
+            columns = ', '.join(NATURAL_KEYS[table])
+            for drop_id, keep_id in rows[:args.show]:
+                values = conn.execute(f"SELECT {columns} FROM {table} WHERE id = ?", (drop_id,)).fetchone()
+                print(f"  删除 id={drop_id}（保留 id={keep_id}）: {values}")
+            if len(rows) > args.show:
+                print(f"  …… 还有 {len(rows) - args.show} 条")
+        if not any(duplicates.values()):
+            if duplicates:
+                ensure_natural_keys(conn)
+                conn.commit()
+            print("没有重复记录，唯一索引已建好")
+            return 0
+        if not args.apply:
+            print("以上记录没有删除；确认后加 --apply 执行")
+            return 1
+        conn.close()
+        backup = f"{database.DB_PATH}.bak-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        shutil.copy2(database.DB_PATH, backup)
+        print(f"已备份库文件: {backup}")
+        conn = database._connect()
+        removed = remove_duplicates(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    for table, ids in removed.items():
+        print(f"🧹 {table}: 删除 {len(ids)} 条重复记录，已建唯一索引")
+    # 删掉的交易 / 售后记录之前算进过日汇总，各店和"汇总"的日汇总全部重算
+    if removed.get('transaction_settlements') or removed.get('after_sales'):
+        for shop_name in database.SHOP_LIST[:-1]:
+            database.update_daily_summary(shop_name)
+        database.update_all_shops_summary()
+        print("日汇总已重算")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+# settlement-tracker 的测试：每个测试用临时目录里的新库，app（即 web_app 里的 database）和后台导入任务都指向它
+import os
+import sys
+import tempfile
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# column_maps.json、import_jobs 目录跟着导入时的库路径走，先指到临时目录，别碰仓库里的库
+os.environ['SETTLEMENT_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='settlement_test_'), 'settlement_system.db')
+sys.path.insert(0, HERE)
+# weijing_system 也有 app 模块，两边的测试一起跑时各自导入自己的
+for name in ('app', 'database', 'web_app'):
+    sys.modules.pop(name, None)
+import app as database
+import web_app
+
+
+@pytest.fixture(autouse=True)
+def settlement_modules(monkeypatch):
+    # 代码里按名字导入 app 的地方（比如 natural_keys.main）拿到的是这边的 app
+    monkeypatch.setitem(sys.modules, 'app', database)
+    monkeypatch.setitem(sys.modules, 'web_app', web_app)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'settlement_system.db'))
+    monkeypatch.setitem(web_app.app.config, 'IMPORT_JOB_DIR', str(tmp_path / 'import_jobs'))
+    database.init_database(summary_triggers=False)
+    web_app.init_job_table()
+    return database
+
+
+def write_transactions(path, rows):
+    """交易结算导出文件：rows 是 {列名: 值}，没给的列用默认值"""
+    defaults = {'订单编号': 'PO-1', '售后单号': '', '备货单号': 'WB2501050001', '备货单类型': '定制品', 'SKU ID': '1001', 'SKU货号': 'A-1',
+                '货品名称': '马克杯', 'SKU属性': '默认', '数量': 1, '单品券金额': '/', '店铺满减券金额': '/', '申报价格折扣金额': 0,
+                '交易类型': '销售回款', '金额': 10.5, '币种': 'CNY', '账务时间': '2025-01-06 10:00:00'}
+    import pandas as pd
+    pd.DataFrame([dict(defaults, **row) for row in rows]).to_csv(path, index=False, encoding='utf-8-sig')
+    return str(path)
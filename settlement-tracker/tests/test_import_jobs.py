@@ -0,0 +1,85 @@
+import threading
+import time
+import web_app
+from conftest import write_transactions
+
+
+def post_upload(client, path, name, data_type='transactions'):
+    with open(path, 'rb') as f:
+        return client.post('/import', data={'file': (f, name), 'shop_name': '维鲸', 'data_type': data_type})
+
+
+def wait_for(job_id, statuses=('done', 'failed'), timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = web_app.get_job(job_id)
+        if job['status'] in statuses: return job
+        time.sleep(0.05)
+    raise AssertionError(f"导入任务 {job_id} 没有结束: {web_app.get_job(job_id)}")
+
+
+def count_rows(db):
+    conn = db._connect()
+    try: return conn.execute("SELECT COUNT(*) FROM transaction_settlements").fetchone()[0]
+    finally: conn.close()
+
+
+def test_upload_is_accepted_while_a_job_is_writing(db, tmp_path, monkeypatch):
+    monkeypatch.setitem(web_app.app.config, 'IMPORT_CHUNK_ROWS', 100)
+    first = write_transactions(tmp_path / 'first.csv', [{'订单编号': f'PO-{i}'} for i in range(300)])
+    second = write_transactions(tmp_path / 'second.csv', [{'订单编号': f'PO-B{i}', 'SKU ID': '2002', '备货单号': 'WB2501070001'} for i in range(50)])
+    # 第一个任务写完第一块后停在第二块之前，这时提交第二个文件
+    writing, proceed, calls = threading.Event(), threading.Event(), []
+    insert = db.insert_transactions
+    def paused_insert(df, shop_name, conn=None, touched=None):
+        calls.append(len(df))
+        if len(calls) == 2:
+            writing.set(); assert proceed.wait(30)
+        return insert(df, shop_name, conn, touched)
+    monkeypatch.setattr(db, 'insert_transactions', paused_insert)
+
+    client = web_app.app.test_client()
+    response = post_upload(client, first, 'first.csv')
+    assert response.status_code == 202, response.get_json()
+    first_job = response.get_json()['job_id']
+    try:
+        assert writing.wait(30)
+        start = time.perf_counter()
+        response = post_upload(client, second, 'second.csv')
+        assert response.status_code == 202, response.get_json()
+        assert time.perf_counter() - start < 2  # 不用等正在跑的导入释放写锁
+        second_job = response.get_json()['job_id']
+        assert client.get(f'/jobs/{first_job}').get_json()['status'] == 'running'
+        assert count_rows(db) == 100  # 第一块已经提交
+    finally:
+        proceed.set()
+
+    assert wait_for(first_job)['rows_inserted'] == 300
+    assert wait_for(second_job)['rows_inserted'] == 50
+    assert count_rows(db) == 350
+    assert db.check_daily_summary() == []
+
+
+def test_failed_job_keeps_committed_chunks_and_summary(db, tmp_path, monkeypatch):
+    monkeypatch.setitem(web_app.app.config, 'IMPORT_CHUNK_ROWS', 100)
+    path = write_transactions(tmp_path / 'transactions.csv', [{'订单编号': f'PO-{i}', '备货单号': f'WB25010{5 + i // 100}0001'} for i in range(300)])
+    insert, calls = db.insert_transactions, []
+    def failing_insert(df, shop_name, conn=None, touched=None):
+        calls.append(len(df))
+        result = insert(df, shop_name, conn, touched)
+        if len(calls) == 2: raise RuntimeError('磁盘满了')
+        return result
+    monkeypatch.setattr(db, 'insert_transactions', failing_insert)
+
+    client = web_app.app.test_client()
+    job = wait_for(post_upload(client, path, 'transactions.csv').get_json()['job_id'])
+    assert job['status'] == 'failed' and '磁盘满了' in job['message']
+    assert job['rows_inserted'] == 100
+    assert count_rows(db) == 100  # 出错的第二块回滚，第一块留着
+    assert db.check_daily_summary() == []
+
+    # 同一个文件重新导入：已写入的跳过，其余补上
+    monkeypatch.setattr(db, 'insert_transactions', insert)
+    job = wait_for(post_upload(client, path, 'transactions.csv').get_json()['job_id'])
+    assert (job['status'], job['rows_inserted'], job['rows_skipped']) == ('done', 200, 100)
+    assert db.check_daily_summary() == []
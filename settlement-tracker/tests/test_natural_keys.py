@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import natural_keys
+from conftest import write_transactions
+from readers import UploadReader
+
+
+def import_file(db, path, shop_name='维鲸'):
+    """与后台导入任务相同：按块读取、insert_transactions 写入 -> (新增, 跳过)"""
+    inserted = skipped = 0
+    conn = db._connect()
+    try:
+        for df in UploadReader(path, 'transactions.csv').chunks():
+            chunk_inserted, chunk_skipped = db.insert_transactions(df, shop_name, conn)
+            inserted += chunk_inserted; skipped += chunk_skipped
+        conn.commit()
+    finally:
+        conn.close()
+    return inserted, skipped
+
+
+def rows(db, table='transaction_settlements', columns='id, order_id, stock_order_id, transaction_type, amount'):
+    conn = db._connect()
+    try: return conn.execute(f"SELECT {columns} FROM {table} ORDER BY id").fetchall()
+    finally: conn.close()
+
+
+def test_import_keeps_one_row_per_natural_key(db, tmp_path):
+    path = write_transactions(tmp_path / 'transactions.csv', [
+        {},
+        {},                                   # 完全相同
+        {'金额': 99},                          # 金额不在键里：和第一行算同一条，保留先导入的
+        {'订单编号': 'PO-2'},                  # 同一时刻同一 SKU 的另一个订单：原来按 SKU+账务时间+交易类型+日期查重会跳过，现在保留
+        {'备货单号': 'WB2501050002'},          # 另一个备货单
+        {'交易类型': '销售冲回', '金额': -10.5},
+    ])
+    assert import_file(db, path) == (4, 2)
+    assert [r[1:] for r in rows(db)] == [
+        ('PO-1', 'WB2501050001', '销售回款', 10.5),
+        ('PO-2', 'WB2501050001', '销售回款', 10.5),
+        ('PO-1', 'WB2501050002', '销售回款', 10.5),
+        ('PO-1', 'WB2501050001', '销售冲回', -10.5),
+    ]
+    # 同一个文件再导一遍全部跳过
+    assert import_file(db, path) == (0, 6)
+    assert len(rows(db)) == 4
+
+
+def test_startup_leaves_duplicates_for_the_migration(db, capsys):
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("DROP INDEX ux_transaction_settlements_natural_key")  # 建唯一索引之前的老库
+    shop_id = db.get_shop_id('维鲸', conn)
+    row = (shop_id, 'PO-1', 'WB2501050001', '1001', '销售回款', 10.5, '2025-01-06 10:00:00', '2025-01-05')
+    conn.executemany("INSERT INTO transaction_settlements (shop_id, order_id, stock_order_id, sku_id, transaction_type, amount, account_time, settlement_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     [row, row, (shop_id, 'PO-2', *row[2:]), row])
+    conn.commit()
+    conn.close()
+    db.update_daily_summary('维鲸'); db.update_all_shops_summary()
+
+    # 启动时只提示，不删记录也不建索引
+    db.init_database(summary_triggers=False)
+    assert [r[0] for r in rows(db)] == [1, 2, 3, 4]
+    assert 'natural_keys.py' in capsys.readouterr().out
+
+    # 不加 --apply 只列出要删的记录
+    assert natural_keys.main(['--db', db.DB_PATH]) == 1
+    out = capsys.readouterr().out
+    assert 'transaction_settlements: 2 条重复记录' in out and '删除 id=2（保留 id=1）' in out and '删除 id=4（保留 id=1）' in out
+    assert [r[0] for r in rows(db)] == [1, 2, 3, 4]
+
+    assert natural_keys.main(['--db', db.DB_PATH, '--apply']) == 0
+    assert [r[0] for r in rows(db)] == [1, 3]
+    conn = db._connect()
+    try:
+        assert natural_keys.find_duplicates(conn) == {}  # 各表都有唯一索引了
+        assert db.check_daily_summary(conn=conn) == []
+        assert conn.execute("SELECT total_sales FROM daily_summary WHERE shop_id = ?", (shop_id,)).fetchone() == (21.0,)
+    finally:
+        conn.close()
+    backup = [p for p in os.listdir(os.path.dirname(db.DB_PATH)) if p.startswith('settlement_system.db.bak-')]
+    assert len(backup) == 1
+    assert sqlite3.connect(os.path.join(os.path.dirname(db.DB_PATH), backup[0])).execute("SELECT COUNT(*) FROM transaction_settlements").fetchone() == (4,)
@@ -2,6 +2,14 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for
 from datetime import datetime
 import os
+import json
+import time
+import queue
+import pickle
+import shutil
+import hashlib
+import sqlite3
+import threading
 import pandas as pd
 
 # 导入数据库模块
@@ -11,10 +19,190 @@ try:
 except:
     import database
     print("✅ 使用database模块")
+from readers import UploadReader
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024  # 256MB max upload，xlsx 按块流式读取，不会整表进内存
+app.config['IMPORT_CHUNK_ROWS'] = 50000  # Excel 按块读取时每块多少行
+app.config['IMPORT_JOB_DIR'] = os.path.join(os.path.dirname(os.path.abspath(database.DB_PATH)), 'import_jobs')  # 后台导入任务的上传文件，导完删除
+
+# ==================== 后台导入任务 ====================
+# /import 只把文件落盘、在 import_jobs 表里建任务就返回；后台线程按提交顺序一个个导入。
+# 写库时每块单独提交（库是 WAL 模式），写锁只在一块的插入期间占着，新任务、任务表的更新不用等整个导入完；
+# 实时进度放在内存里，导完（或失败）再写回任务表。进程重启后，没导完的任务整个文件重新导一遍：
+# 重启前已提交的块按自然键全部跳过，这些日期不在本次新增里，日汇总整店重算。
+
+_job_queue = queue.Queue()
+_job_progress = {}  # job_id -> 正在跑的任务的实时进度
+_job_threads = []
+_job_lock = threading.Lock()
+
+def init_job_table():
+    conn = database._connect()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shop_name TEXT,
+        data_type TEXT,
+        filename TEXT,
+        stored_path TEXT,
+        status TEXT DEFAULT 'queued',
+        rows_parsed INTEGER DEFAULT 0,
+        rows_inserted INTEGER DEFAULT 0,
+        rows_skipped INTEGER DEFAULT 0,
+        backend TEXT,
+        parse_seconds REAL,
+        message TEXT,
+        content_hash TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+    # 旧库的任务表没有 content_hash 列
+    if 'content_hash' not in [row[1] for row in conn.execute("PRAGMA table_info(import_jobs)")]:
+        conn.execute("ALTER TABLE import_jobs ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_hash ON import_jobs (shop_name, data_type, content_hash)")
+    conn.commit()
+    conn.close()
+
+def get_job(job_id):
+    conn = database._connect()
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("SELECT * FROM import_jobs WHERE id = ?", (job_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+def update_job(job_id, **fields):
+    conn = database._connect()
+    conn.execute(f"UPDATE import_jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?", (*fields.values(), job_id))
+    conn.commit()
+    conn.close()
+
+def find_duplicate_job(conn, shop_name, data_type, content_hash):
+    """同店铺同类型、内容完全相同且没失败的导入任务号"""
+    row = conn.execute("SELECT id FROM import_jobs WHERE shop_name = ? AND data_type = ? AND content_hash = ? AND status != 'failed' ORDER BY id LIMIT 1",
+                       (shop_name, data_type, content_hash)).fetchone()
+    return row[0] if row else None
+
+def submit_import_job(file, filename, shop_name, data_type):
+    """上传文件落盘（边写边算 SHA-256）、建任务、排队，立即返回 (任务号, None)；
+    同样的文件已经导入过（或正在排队）时不建任务，返回 (None, 之前的任务号)"""
+    conn = database._connect()
+    try:
+        cur = conn.execute("INSERT INTO import_jobs (shop_name, data_type, filename) VALUES (?, ?, ?)", (shop_name, data_type, filename))
+        job_id = cur.lastrowid
+        job_dir = os.path.join(app.config['IMPORT_JOB_DIR'], str(job_id))
+        os.makedirs(job_dir, exist_ok=True)
+        stored_path = os.path.join(job_dir, 'upload' + os.path.splitext(filename)[1].lower())
+        h = hashlib.sha256()
+        with open(stored_path, 'wb') as out:
+            for block in iter(lambda: file.stream.read(1 << 20), b''):
+                h.update(block); out.write(block)
+        duplicate_of = find_duplicate_job(conn, shop_name, data_type, h.hexdigest())
+        if duplicate_of:
+            conn.rollback()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return None, duplicate_of
+        conn.execute("UPDATE import_jobs SET stored_path = ?, content_hash = ? WHERE id = ?", (stored_path, h.hexdigest(), job_id))
+        conn.commit()
+    finally:
+        conn.close()
+    _job_queue.put(job_id)
+    return job_id, None
+
+def run_import_job(job_id):
+    """先把整个文件解析成块存到临时文件（这一步结束才知道总行数），再逐块写库；按块更新内存里的进度"""
+    job = get_job(job_id)
+    if not job or job['status'] in ('done', 'failed'): return
+    resumed = job['status'] == 'running'
+    started = time.time()
+    update_job(job_id, status='running', started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    progress = _job_progress[job_id] = {'phase': 'parsing', 'rows_parsed': 0, 'rows_total': None, 'rows_written': 0, 'rows_inserted': 0, 'rows_skipped': 0, 'started': started, 'write_started': None}
+    spool_path = job['stored_path'] + '.spool'
+    try:
+        shop_name, data_type = job['shop_name'], job['data_type']
+        reader = UploadReader(job['stored_path'], job['filename'], app.config['IMPORT_CHUNK_ROWS'])
+        batches = 0
+        with open(spool_path, 'wb') as spool:
+            for df in reader.chunks():
+                pickle.dump(df, spool, pickle.HIGHEST_PROTOCOL)
+                batches += 1; progress['rows_parsed'] += len(df)
+        progress.update(phase='writing', rows_total=progress['rows_parsed'], write_started=time.time())
+
+        # 每块写完就提交；日汇总和汇总店铺只重算有新增记录的日期，写完（或中途失败）后单独一个短事务
+        conn = database._connect()
+        touched = set()
+        try:
+            with open(spool_path, 'rb') as spool:
+                for _ in range(batches):
+                    df = pickle.load(spool)
+                    if data_type == 'transactions':
+                        chunk_inserted, chunk_skipped = database.insert_transactions(df, shop_name, conn, touched)
+                    elif data_type == 'after_sales':
+                        chunk_inserted, chunk_skipped = database.insert_after_sales(df, shop_name, conn, touched)
+                    elif data_type == 'shipping':
+                        chunk_inserted, chunk_skipped = database.insert_shipping_details(df, shop_name, conn)
+                    else:
+                        chunk_inserted, chunk_skipped = 0, 0
+                    conn.commit()
+                    progress['rows_written'] += len(df)
+                    progress['rows_inserted'] += chunk_inserted
+                    progress['rows_skipped'] += chunk_skipped
+        finally:
+            try: refresh_job_summary(conn, shop_name, touched, resumed and data_type in ('transactions', 'after_sales'))
+            finally: conn.close()
+
+        print(f"📄 {job['filename']}: {reader.backend} 解析 {reader.parse_seconds:.2f}s")
+        inserted, skipped = progress['rows_inserted'], progress['rows_skipped']
+        update_job(job_id, status='done', rows_parsed=progress['rows_parsed'], rows_inserted=inserted, rows_skipped=skipped, backend=reader.backend, parse_seconds=round(reader.parse_seconds, 3),
+                   message=f'导入成功！新增 {inserted} 条记录，跳过 {skipped} 条重复记录', finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    except Exception as e:
+        # 出错的那块回滚，之前提交的块留在库里（日汇总已按它们重算），同一个文件重新导入时按自然键跳过
+        inserted, skipped = progress['rows_inserted'], progress['rows_skipped']
+        update_job(job_id, status='failed', rows_parsed=progress['rows_parsed'], rows_inserted=inserted, rows_skipped=skipped,
+                   message=f'导入失败: {str(e)}（出错前已写入 {inserted} 条）', finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    finally:
+        _job_progress.pop(job_id, None)
+        shutil.rmtree(os.path.dirname(job['stored_path']), ignore_errors=True)
+
+def refresh_job_summary(conn, shop_name, touched, whole_shop=False):
+    """导入写完（或中途失败）后重算日汇总：有新增记录的 (店铺, 日期) 和这些日期的汇总店铺，单独一个事务。
+    whole_shop=True（重启后续跑的任务）时整店重算；触发器模式下日汇总已随写入更新"""
+    conn.rollback()
+    if database.summary_triggers_installed(conn): return
+    if whole_shop:
+        database.update_daily_summary(shop_name)
+        database.update_all_shops_summary()
+    elif touched:
+        database.refresh_daily_summary(touched, conn)
+        database.update_all_shops_summary({date for _, date in touched}, conn)
+        conn.commit()
+
+def job_worker():
+    while True:
+        job_id = _job_queue.get()
+        try: run_import_job(job_id)
+        except Exception as e: print(f"⚠️  导入任务 {job_id} 异常: {e}")
+
+def start_job_workers():
+    """建任务表、启动后台导入线程，并把重启前没导完的任务重新排队；只有第一次调用生效。
+    库是单写入方，一个线程就够了"""
+    with _job_lock:
+        if _job_threads: return
+        init_job_table()
+        database.ensure_summary_indexes()
+        conn = database._connect()
+        database.ensure_natural_keys(conn)  # 没跑过 init_database 的旧库也要有唯一键，导入才能靠它跳过重复记录；有重复记录时只提示
+        conn.commit()
+        for (job_id,) in conn.execute("SELECT id FROM import_jobs WHERE status IN ('queued', 'running') ORDER BY id"): _job_queue.put(job_id)
+        conn.close()
+        t = threading.Thread(target=job_worker, name='import-job', daemon=True); t.start(); _job_threads.append(t)
+
+@app.before_request
+def ensure_job_workers():
+    start_job_workers()
 
 # 首页 - 使用简约模板
 @app.route('/')
@@ -90,40 +278,39 @@ def import_data():
             return jsonify({'error': '请选择店铺和数据类型'}), 400
         
         try:
-            # 根据文件类型读取数据
-            if file_ext == '.csv':
-                df = pd.read_csv(file)
-            else:
-                # Excel文件
-                df = pd.read_excel(file)
-            
-            # 根据数据类型导入
-            inserted = 0
-            skipped = 0
-            
-            if data_type == 'transactions':
-                inserted, skipped = database.insert_transactions(df, shop_name)
-                database.update_daily_summary(shop_name)
-                database.update_all_shops_summary()
-            elif data_type == 'after_sales':
-                inserted, skipped = database.insert_after_sales(df, shop_name)
-                database.update_daily_summary(shop_name)
-                database.update_all_shops_summary()
-            elif data_type == 'shipping':
-                inserted, skipped = database.insert_shipping_details(df, shop_name)
-            
+            job_id, duplicate_of = submit_import_job(file, filename, shop_name, data_type)
+            if duplicate_of:
+                return jsonify({
+                    'success': True,
+                    'duplicate_of': duplicate_of,
+                    'message': f'该文件已导入过（导入任务 #{duplicate_of}），本次没有重复导入'
+                })
             return jsonify({
                 'success': True,
-                'message': f'导入成功！新增 {inserted} 条记录，跳过 {skipped} 条重复记录',
-                'inserted': inserted,
-                'skipped': skipped
-            })
-            
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id),
+                'message': f'已提交后台导入任务 #{job_id}'
+            }), 202
         except Exception as e:
             return jsonify({'error': f'导入失败: {str(e)}'}), 500
     
     return render_template('minimal_import.html', shops=database.SHOP_LIST)
 
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """后台导入任务的进度：解析/插入/跳过行数、每秒行数，写库阶段给出预计剩余秒数"""
+    job = get_job(job_id)
+    if not job: return jsonify({'error': '任务不存在'}), 404
+    job.pop('stored_path', None)
+    progress = _job_progress.get(job_id)
+    if progress:
+        now = time.time()
+        job.update(phase=progress['phase'], rows_parsed=progress['rows_parsed'], rows_inserted=progress['rows_inserted'], rows_skipped=progress['rows_skipped'], rows_written=progress['rows_written'], rows_total=progress['rows_total'])
+        job['rows_per_second'] = round(progress['rows_parsed'] / (now - progress['started']), 1) if now > progress['started'] else None
+        written, total, write_started = progress['rows_written'], progress['rows_total'], progress['write_started']
+        job['eta_seconds'] = round((now - write_started) * (total - written) / written, 1) if write_started and written else None
+    return jsonify(job)
+
 # 发货明细页面 - 使用简约模板
 # NOTE:
 # Previously this route rendered a non-existing template 'minimal_shipping_details.html' and was mounted at '/shipping_details'.
@@ -520,7 +707,8 @@ def data_management():
                           transaction_dates=transaction_dates,
                           after_sales_dates=after_sales_dates,
                           shipping_dates=shipping_dates,
-                          shop_stats=shop_stats)
+                          shop_stats=shop_stats,
+                          column_stats=database.column_cache.stats())
 
 # 清除数据API
 @app.route('/api/clear_data', methods=['POST'])
@@ -528,6 +716,11 @@ def clear_data():
     """清除数据API"""
     try:
         database.clear_all_data()
+        # 数据清掉以后之前导入过的文件要能重新导入
+        conn = database._connect()
+        conn.execute("UPDATE import_jobs SET content_hash = NULL")
+        conn.commit()
+        conn.close()
         return jsonify({'success': True, 'message': '数据已清除'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -569,7 +762,7 @@ def sync_shipping_prices():
             return jsonify({'error': '请提供店铺名称和SPU ID'}), 400
         
         # 获取所有规格的商品价格
-        conn = sqlite3.connect('settlement_system.db')
+        conn = database._connect()
         cursor = conn.cursor()
         
         # 根据是否有sku_attribute参数决定查询条件
@@ -661,6 +854,8 @@ if __name__ == '__main__':
         print("✅ 数据库初始化成功")
     except Exception as e:
         print(f"⚠️  数据库初始化失败: {e}")
+    # debug 模式下外层进程只监控文件改动，导入线程在真正处理请求的子进程里启动，顺带续跑重启前没导完的任务
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true': start_job_workers()
     
     print("🚀 启动维鲸运营系统Web版...")
     print("🌐 访问地址: http://localhost:5000")
@@ -1,19 +1,45 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, make_response
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, or_, desc, case, and_, extract, text
+from sqlalchemy import func, or_, desc, case, and_, extract, text, event, false, select, union_all, literal, null
 from datetime import datetime, date, timedelta
 import pandas as pd
+import numpy as np
 import os
+import sys
 import re
+import hashlib
+import functools
 from itertools import groupby
 import calendar
 import socket
-from io import StringIO
+import json
+import queue
+import threading
+import pickle
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+# 两个系统共用的模块（上传文件读取等）放在仓库根目录的 common/ 下，只有一份
+COMMON_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'common'))
+if COMMON_DIR not in sys.path: sys.path.insert(0, COMMON_DIR)
+from sku_filter import SkuBloomFilter
+from readers import UploadReader
+from column_map import ColumnMapCache
+from page_cache import PageCache
+import order_numbers
+import report_metrics
 
-app = Flask(__name__)
+# 库文件、上传暂存、列映射和布隆过滤器都在 instance 目录下；设了 WEIJING_INSTANCE_PATH 时用它（测试指到临时目录）
+app = Flask(__name__, instance_path=os.environ.get('WEIJING_INSTANCE_PATH'))
 app.secret_key = 'weijing_secret_key'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///weijing.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['UPLOAD_CHUNK_SIZE'] = 5000  # 上传写库时每多少行提交一次
+app.config['UPLOAD_READ_CHUNK_ROWS'] = 50000  # Excel 按块读取时每块多少行
+app.config['UPLOAD_PARSE_WORKERS'] = min(os.cpu_count() or 1, 16)  # 解析上传文件的进程数，1 表示在写库线程里直接解析
+app.config['UPLOAD_JOB_WORKERS'] = 1  # 后台导入线程数；SQLite 同一时间只有一个写入方，开多了也是排队等锁
+app.config['PAGE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024  # 首页和报表页渲染结果的缓存上限
 db = SQLAlchemy(app)
 
 # ==================== 1. 数据库模型 ====================
@@ -26,6 +52,57 @@ class UploadRecord(db.Model):
     upload_type = db.Column(db.String(20))
     upload_date = db.Column(db.DateTime, default=datetime.now)
     row_count = db.Column(db.Integer, default=0)
+    reader_backend = db.Column(db.String(20))  # 实际用来解析文件的后端
+    parse_seconds = db.Column(db.Float)
+    content_hash = db.Column(db.String(64), index=True)  # 文件内容的 SHA-256，同店铺同类型再传一模一样的文件直接跳过
+
+class UploadSheet(db.Model):
+    """结算文件里每个导入过的 Sheet 的内容哈希（按解析出的记录算），整个文件变了但某个 Sheet 没变时只跳过这个 Sheet"""
+    __tablename__ = 'upload_sheets'
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), index=True)
+    sheet_name = db.Column(db.String(100))
+    content_hash = db.Column(db.String(64), index=True)
+    row_count = db.Column(db.Integer, default=0)
+
+class ImportJob(db.Model):
+    """后台导入任务：上传的文件先落盘到 instance/uploads/<id>/，由后台线程按文件顺序导入；
+    每个文件导完就在 files 里记一笔，进程重启后从第一个没导完的文件接着导"""
+    __tablename__ = 'import_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(20))  # shipment / settlement
+    shop_name = db.Column(db.String(50))
+    status = db.Column(db.String(20), default='queued', index=True)  # queued / running / done / failed
+    files = db.Column(db.Text)  # JSON: [{path, filename, size, upload_id, done, parsed, inserted, skipped}]
+    messages = db.Column(db.Text)  # JSON: [[category, message]]，原来直接 flash 给用户的提示
+    rows_parsed = db.Column(db.Integer, default=0)
+    rows_inserted = db.Column(db.Integer, default=0)
+    rows_skipped = db.Column(db.Integer, default=0)
+    bytes_total = db.Column(db.Integer, default=0)
+    bytes_done = db.Column(db.Float, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def file_list(self): return json.loads(self.files or '[]')
+    def set_file_list(self, files): self.files = json.dumps(files, ensure_ascii=False)
+
+    def notify(self, message, category='info'):
+        self.messages = json.dumps(json.loads(self.messages or '[]') + [[category, message]], ensure_ascii=False)
+
+    def to_dict(self):
+        elapsed = ((self.finished_at or datetime.now()) - self.started_at).total_seconds() if self.started_at else 0.0
+        done = self.bytes_done or 0.0
+        eta = elapsed * (self.bytes_total - done) / done if self.status == 'running' and done > 0 else None
+        return {'id': self.id, 'type': self.job_type, 'shop_name': self.shop_name, 'status': self.status,
+                'files': [{'filename': f['filename'], 'upload_id': f['upload_id'], 'done': f['done']} for f in self.file_list()],
+                'rows_parsed': self.rows_parsed or 0, 'rows_inserted': self.rows_inserted or 0, 'rows_skipped': self.rows_skipped or 0,
+                'rows_per_second': round((self.rows_parsed or 0) / elapsed, 1) if elapsed > 0 else None,
+                'progress': round(done / self.bytes_total, 4) if self.bytes_total else None, 'eta_seconds': round(eta, 1) if eta is not None else None,
+                'messages': json.loads(self.messages or '[]'),
+                'created_at': self.created_at.isoformat(timespec='seconds') if self.created_at else None,
+                'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+                'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None}
 
 class Product(db.Model):
     __tablename__ = 'products'
@@ -44,7 +121,7 @@ class Shipment(db.Model):
     shop_name = db.Column(db.String(50))
     order_no = db.Column(db.String(100), index=True) 
     custom_sku = db.Column(db.String(200), unique=True, index=True)
-    date = db.Column(db.Date)
+    date = db.Column(db.Date, index=True)
     spu_id = db.Column(db.String(100))
     skc_id = db.Column(db.String(100))
     goods_name = db.Column(db.String(200))
@@ -53,6 +130,7 @@ class Shipment(db.Model):
     declared_price_total = db.Column(db.Float, default=0.0)
     cost_price_total = db.Column(db.Float, default=0.0)
     upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=True)
+    __table_args__ = (db.Index('ix_shipments_shop_date', 'shop_name', 'date'),)
 
 class DailyStat(db.Model):
     __tablename__ = 'daily_stats'
@@ -70,7 +148,7 @@ class Settlement(db.Model):
     shop_name = db.Column(db.String(50))
     order_no = db.Column(db.String(100))
     sku_id = db.Column(db.String(100))
-    account_date = db.Column(db.Date)
+    account_date = db.Column(db.Date, index=True)
     amount = db.Column(db.Float, default=0.0)
     sales_income = db.Column(db.Float, default=0.0) 
     sales_refund = db.Column(db.Float, default=0.0) 
@@ -78,35 +156,58 @@ class Settlement(db.Model):
     platform_fine = db.Column(db.Float, default=0.0)
     trans_type = db.Column(db.String(50))
     violation_id = db.Column(db.String(100))
-    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=True)
+    natural_key = db.Column(db.String(40), unique=True, index=True)  # 去重用的业务主键哈希，见 settlement_keys()
+    upload_id = db.Column(db.Integer, db.ForeignKey('upload_records.id'), nullable=True, index=True)
+    __table_args__ = (db.Index('ix_settlements_shop_date', 'shop_name', 'account_date'),)
+
+class DailyFact(db.Model):
+    """店铺×日的发货、结算预汇总，报表都读这张表；发货 / 结算行写入、删除、改价后由 refresh_daily_facts 按涉及的 (店铺, 日期) 重算。
+    金额、件数是原始行的 SUM（全为空时为空，同直接查原始表），ship_rows / settle_rows 为 0 表示这天没有该类数据"""
+    __tablename__ = 'daily_facts'
+    shop_name = db.Column(db.String(50), primary_key=True)
+    date = db.Column(db.Date, primary_key=True, index=True)
+    ship_rows = db.Column(db.Integer, default=0)
+    quantity = db.Column(db.Integer)
+    declared = db.Column(db.Float)
+    cost = db.Column(db.Float)
+    settle_rows = db.Column(db.Integer, default=0)
+    sales_income = db.Column(db.Float)
+    sales_refund = db.Column(db.Float)
+    subsidy = db.Column(db.Float)
+    platform_fine = db.Column(db.Float)
 
 # ==================== 2. 辅助函数 ====================
 
 def extract_date_from_order(order_no):
-    try:
-        match = re.search(r'WB(\d{6})', str(order_no))
-        if match:
-            date_str = match.group(1)
-            return datetime.strptime(date_str, '%y%m%d').date()
-    except: pass
-    return date.today()
-
-def find_column(df_columns, possible_names):
-    # 1. 优先精确匹配
-    for col in df_columns:
-        clean_col = str(col).strip().replace('\t', '').replace('\n', '').replace(' ', '').replace('\ufeff', '')
-        for p in possible_names:
-            target = p.lower().replace(' ', '')
-            if target == clean_col.lower():
-                return col
-    # 2. 模糊匹配
-    for col in df_columns:
-        clean_col = str(col).strip().replace('\t', '').replace('\n', '').replace(' ', '').replace('\ufeff', '')
-        for p in possible_names:
-            target = p.lower().replace(' ', '')
-            if target in clean_col.lower():
-                return col
-    return None
+    return order_numbers.order_date(order_no) or date.today()
+
+# 各类上传表要找的逻辑字段和候选列名，交给 ColumnMapCache 按表头一次解析完
+SHIPMENT_FIELDS = {
+    'order': ['备货单', '发货单', '订单号', 'order_no'],
+    'custom_sku': ['定制SKU', 'custom_sku', 'Custom SKU'],
+    'spu': ['商品SPU ID', 'SPUID', 'spu_id'],
+    'skc': ['商品SKC ID', 'SKCID', 'skc_id'],
+    'name': ['商品名称', 'Title', 'name'],
+    'specs': ['商品属性集', '规格', 'SKU属性'],
+    'qty': ['总发货件数', '数量', '件数', 'Quantity'],
+}
+SETTLEMENT_FIELDS = {
+    'trans_type': ['交易类型'],
+    # [核心修复] 优先匹配 '金额' 而不是 '单品券金额'
+    'order': ['备货单号', '订单号', 'order_no'], 'sku': ['SKUID', 'SKU ID'], 'amount': ['金额', '发生金额'],
+    'vid': ['违规ID', '违规编号'], 'fine_sku': ['SKUID'], 'fine_amount': ['赔付金额', '扣款金额'], 'fine_date': ['账务时间'],
+}
+
+def settlement_sheet_columns(columns, cache):
+    """只看表头判断结算 Sheet 类型：返回 ('trans' 交易明细 | 'fine' 违规罚款, 各字段对应的列名)，无关或缺关键列的 Sheet 返回 (None, None)"""
+    m = cache.resolve('settlement', columns, SETTLEMENT_FIELDS)
+    if m['trans_type']:
+        cols = {'order': m['order'], 'sku': m['sku'], 'type': m['trans_type'], 'amount': m['amount']}
+        return ('trans', cols) if all(cols.values()) else (None, None)
+    if m['vid']:
+        cols = {'vid': m['vid'], 'sku': m['fine_sku'], 'amount': m['fine_amount'], 'date': m['fine_date']}
+        return ('fine', cols) if cols['vid'] and cols['amount'] and cols['date'] else (None, None)
+    return None, None
 
 def clean_quantity(val):
     try:
@@ -117,30 +218,540 @@ def clean_quantity(val):
     except: pass
     return 1
 
+def order_dates(order_nos):
+    # 整列版 extract_date_from_order
+    return order_numbers.order_dates(order_nos, date.today())
+
+def settlement_keys(kind, sku_id=None, account_date=None, trans_type=None, order_no=None, amount=None, violation_id=None):
+    """整列计算结算记录的去重键：交易按 (SKU, 账务日期, 交易类型, 备货单号, 金额)，违规按违规ID"""
+    if kind == 'fine':
+        raw = 'F\x1f' + violation_id.astype(str)
+    else:
+        dates = pd.Series([str(d) for d in account_date], index=account_date.index, dtype=object)
+        amounts = pd.Series([repr(float(a) + 0.0) for a in amount], index=amount.index, dtype=object)
+        raw = 'T\x1f' + sku_id.astype(str) + '\x1f' + dates + '\x1f' + trans_type.astype(str) + '\x1f' + order_no.astype(str) + '\x1f' + amounts
+    return pd.Series([hashlib.sha1(k.encode('utf-8')).hexdigest() for k in raw], index=raw.index, dtype=object)
+
+def _text_col(df, col):
+    # 整列版 str(x) if pd.notna(x) else ''
+    if not col: return pd.Series('', index=df.index, dtype=object)
+    s = df[col]
+    return s.astype(str).where(s.notna(), '').astype(object)
+
+def _quantity_col(s):
+    # 整列版 clean_quantity：数值直接取整，文本取第一段数字，取不到按 1 件
+    if pd.api.types.is_numeric_dtype(s):
+        return s.where(np.isfinite(s)).fillna(1).astype('int64')
+    is_num = s.map(lambda v: isinstance(v, (int, float)))
+    num = pd.to_numeric(s.where(is_num), errors='coerce')
+    num = num.where(np.isfinite(num))
+    txt = pd.to_numeric(s.astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
+    return num.where(is_num, txt).fillna(1).astype('int64')
+
+def parse_shipment_frame(df, col_order, col_custom_sku=None, col_name=None, col_qty=None, col_spu=None, col_skc=None, col_specs=None):
+    """把发货明细整表解析成 order_no/custom_sku/date/spu_id/skc_id/goods_name/specs/quantity，结果与逐行解析一致"""
+    raw = df[col_order].map(str).str.strip()
+    raw = raw.str.split('/').str[-1].str.strip()
+    qty_match = raw.str.extract(r'[，,]\s*(\d+)\s*件', expand=False)
+    has_qty = qty_match.notna()
+    order_no = raw.where(~has_qty, raw.str.split(r'[，,]', regex=True).str[0].str.strip())
+    quantity = pd.to_numeric(qty_match, errors='coerce').fillna(1).astype('int64')
+    if col_qty:
+        q = df[col_qty]
+        quantity = _quantity_col(q).where(q.notna(), quantity)
+
+    custom_sku = pd.Series(None, index=df.index, dtype=object)
+    if col_custom_sku:
+        sku = _text_col(df, col_custom_sku).str.strip()
+        custom_sku = sku.where((sku != '') & (sku != '-') & (sku.str.lower() != 'nan'), None)
+    goods_name = _text_col(df, col_name).str.strip()
+    keep = custom_sku.notna() | ((goods_name != '') & (goods_name != '-') & (goods_name.str.lower() != 'nan'))
+
+    out = pd.DataFrame({'order_no': order_no, 'custom_sku': custom_sku, 'date': order_dates(order_no), 'spu_id': _text_col(df, col_spu), 'skc_id': _text_col(df, col_skc), 'goods_name': goods_name, 'specs': _text_col(df, col_specs), 'quantity': quantity})
+    return out[keep]
+
+def settlement_trans_frame(df, cols, shop_name):
+    """交易明细 Sheet 的一块 -> settlements 表记录（不含 upload_id）"""
+    order_no = df[cols['order']].map(str).str.strip()
+    trans_type = df[cols['type']].map(str).str.strip()
+    amount = pd.to_numeric(df[cols['amount']], errors='coerce').fillna(0.0).astype(float)
+    out = pd.DataFrame({'shop_name': shop_name, 'order_no': order_no, 'sku_id': _text_col(df, cols['sku']), 'account_date': order_dates(order_no), 'trans_type': trans_type, 'amount': amount})
+    is_refund = trans_type.str.contains('售后', regex=False) | trans_type.str.contains('冲回', regex=False)
+    is_subsidy = ~is_refund & trans_type.str.contains('补贴', regex=False)
+    out['sales_income'] = amount.where(~is_refund & ~is_subsidy, 0.0)
+    out['sales_refund'] = amount.where(is_refund, 0.0)
+    out['subsidy'] = amount.where(is_subsidy, 0.0)
+    out['platform_fine'] = 0.0
+    out['violation_id'] = None
+    out['natural_key'] = settlement_keys('trans', out['sku_id'], out['account_date'], out['trans_type'], out['order_no'], out['amount'])
+    return out.drop_duplicates('natural_key')
+
+def settlement_fine_frame(df, cols, shop_name):
+    """违规罚款 Sheet 的一块 -> settlements 表记录（不含 upload_id）"""
+    amt = pd.to_numeric(df[cols['amount']], errors='coerce').fillna(0.0).astype(float)
+    acc = pd.to_datetime(df[cols['date']], errors='coerce', format='mixed')
+    out = pd.DataFrame({'shop_name': shop_name, 'order_no': None, 'sku_id': _text_col(df, cols['sku']), 'account_date': acc.dt.date.astype(object).where(acc.notna(), date.today()), 'trans_type': '售后罚款', 'amount': amt, 'sales_income': 0.0, 'sales_refund': 0.0, 'subsidy': 0.0, 'platform_fine': amt})
+    out['violation_id'] = df[cols['vid']].map(str).str.strip()
+    out['natural_key'] = settlement_keys('fine', violation_id=out['violation_id'])
+    return out.drop_duplicates('natural_key')
+
+# ---- 解析进程里跑的任务：只读文件、不碰数据库，解析结果按块 pickle 进 spool 文件，返回批次数和读取信息 ----
+
+def parse_shipment_upload(path, filename, spool, chunk_rows, known_layouts):
+    """发货明细文件 -> parse_shipment_frame 的结果批次；找不到备货单列时 batches 为 None。
+    known_layouts 是主进程列名映射缓存的快照，这里新学到的表头随结果的 column_map 交回去"""
+    reader = UploadReader(path, filename, chunk_rows)
+    cache = ColumnMapCache(entries=known_layouts)
+    batches, rows, last_order, cols = 0, 0, None, None  # 备货单向下填充要跨块延续
+    with open(spool, 'wb') as f:
+        for df in reader.chunks():
+            if cols is None: cols = cache.resolve('shipment', df.columns, SHIPMENT_FIELDS)  # 各块列名一样，解析一次就够
+            col_order = cols['order']
+            if not col_order: batches = None; break
+
+            df[col_order] = df[col_order].ffill()
+            if last_order is not None: df[col_order] = df[col_order].fillna(last_order)
+            if df[col_order].notna().any(): last_order = df[col_order].dropna().iloc[-1]
+            parsed = parse_shipment_frame(df, col_order, cols['custom_sku'], cols['name'], cols['qty'], cols['spu'], cols['skc'], cols['specs'])
+            pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
+            batches += 1; rows += len(parsed)
+    return {'batches': batches, 'rows': rows, 'backend': reader.backend, 'parse_seconds': reader.parse_seconds, 'column_map': cache.drain()}
+
+def parse_settlement_sheet(path, filename, sheet_name, shop_name, spool, chunk_rows, known_layouts):
+    """结算文件的一个 Sheet -> settlements 记录批次；先只读表头分类，无关的 Sheet 直接返回 0 批"""
+    reader = UploadReader(path, filename, chunk_rows)
+    cache = ColumnMapCache(entries=known_layouts)
+    kind, cols = settlement_sheet_columns(reader.columns(sheet_name), cache)
+    batches, rows = 0, 0
+    content = hashlib.sha256()  # 按解析出的记录逐行哈希，同样内容的 Sheet 换个文件、换个位置哈希也一样
+    if kind:
+        build = settlement_trans_frame if kind == 'trans' else settlement_fine_frame
+        with open(spool, 'wb') as f:
+            for df in reader.chunks(sheet_name, usecols=list(dict.fromkeys(c for c in cols.values() if c))):
+                out = build(df, cols, shop_name)
+                content.update(pd.util.hash_pandas_object(out, index=False).values.tobytes())
+                pickle.dump(out, f, pickle.HIGHEST_PROTOCOL)
+                batches += 1; rows += len(out)
+    return {'batches': batches, 'rows': rows, 'content_hash': content.hexdigest(), 'backend': reader.backend, 'parse_seconds': reader.parse_seconds, 'column_map': cache.drain()}
+
+def read_spool(spool, batches):
+    if not batches: return  # 没有批次时解析进程不会建 spool 文件
+    with open(spool, 'rb') as f:
+        for _ in range(batches): yield pickle.load(f)
+
+class ProductIndex:
+    """单次上传内的商品索引：按店铺一次查询加载，之后的价格查找和继承全部在内存里完成"""
+    def __init__(self, shop_name):
+        self.shop_name = shop_name
+        self.by_key = {}          # (spu, skc, specs) -> (申报价, 成本价)
+        self.priced_by_skc = {}   # skc -> 第一个有价格的同 SKC 商品的 (申报价, 成本价)
+        self.new_products = []
+        rows = db.session.query(Product.spu_id, Product.skc_id, Product.specs, Product.declared_price, Product.cost_price).filter(Product.shop_name == shop_name).order_by(Product.id).all()
+        for r in rows: self._add(r.spu_id, r.skc_id, r.specs, r.declared_price, r.cost_price)
+
+    def _add(self, spu_id, skc_id, specs, declared_price, cost_price):
+        self.by_key.setdefault((spu_id, skc_id, specs), (declared_price, cost_price))
+        if (declared_price or 0) > 0 or (cost_price or 0) > 0: self.priced_by_skc.setdefault(skc_id, (declared_price, cost_price))
+
+    def resolve(self, spu_id, skc_id, specs, name):
+        """返回单价 (申报价, 成本价)；商品不存在时按同 SKC 继承价格并登记为新商品"""
+        prices = self.by_key.get((spu_id, skc_id, specs))
+        if prices is not None: return prices
+        declared_price, cost_price = self.priced_by_skc.get(skc_id, (0.0, 0.0))
+        self.new_products.append({'shop_name': self.shop_name, 'spu_id': spu_id, 'skc_id': skc_id, 'name': name, 'specs': specs, 'declared_price': declared_price, 'cost_price': cost_price})
+        self._add(spu_id, skc_id, specs, declared_price, cost_price)
+        return declared_price, cost_price
+
+    def write_new_products(self):
+        if self.new_products: db.session.execute(Product.__table__.insert(), self.new_products)
+        self.new_products = []
+
+class ChunkedWriter:
+    """上传数据的批量写入：攒够 chunk_size 行用 Core executemany 写一次，每块一个 savepoint 并单独提交，坏块只丢自己。
+    ignore_conflicts=True 时用 INSERT OR IGNORE，撞唯一索引的行直接跳过，written 只算真正插入的行。
+    fact_date 给出日期列名时，记下已提交的块涉及的 (店铺, 日期)，写完交给 refresh_daily_facts"""
+    def __init__(self, table, chunk_size=None, ignore_conflicts=False, fact_date=None):
+        self.table = table
+        self.chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+        self.stmt = table.insert().prefix_with('OR IGNORE') if ignore_conflicts else table.insert()
+        self.buffer = []
+        self.written, self.failed, self.errors = 0, 0, []
+        self.fact_date, self.touched = fact_date, set()
+
+    def add(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.chunk_size: self.flush()
+
+    def extend(self, rows):
+        for row in rows: self.add(row)
+
+    def flush(self):
+        if not self.buffer: return
+        try:
+            with db.session.begin_nested(): result = db.session.execute(self.stmt, self.buffer)
+            db.session.commit()
+            self.written += result.rowcount if result.rowcount >= 0 else len(self.buffer)
+            if self.fact_date: self.touched.update((r['shop_name'], r[self.fact_date]) for r in self.buffer)
+        except Exception as e:
+            self.failed += len(self.buffer); self.errors.append(str(e))
+        self.buffer = []
+
+_parse_pool = None
+
+def parse_pool():
+    """常驻的解析进程池，第一次上传时才创建；用 spawn 启动，不继承 Web 进程里的线程和数据库连接"""
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=app.config['UPLOAD_PARSE_WORKERS'], mp_context=multiprocessing.get_context('spawn'))
+    return _parse_pool
+
+def run_parse_jobs(jobs):
+    """并行执行解析任务 [(函数, 参数...)]，按提交顺序逐个产出 (结果, 异常)，写库的一方因此总按文件/Sheet 的原始顺序处理。
+    只有一个任务或只配了 1 个进程时直接在当前线程里解析"""
+    global _parse_pool
+    if len(jobs) <= 1 or app.config['UPLOAD_PARSE_WORKERS'] <= 1:
+        for fn, *args in jobs:
+            try: yield fn(*args), None
+            except Exception as e: yield None, e
+        return
+    try: futures = [parse_pool().submit(fn, *args) for fn, *args in jobs]
+    except BrokenProcessPool:
+        _parse_pool = None
+        futures = [parse_pool().submit(fn, *args) for fn, *args in jobs]
+    for fut in futures:
+        try: yield fut.result(), None
+        except BrokenProcessPool as e: _parse_pool = None; yield None, e
+        except Exception as e: yield None, e
+
+class FileProgress:
+    """任务里单个文件的进度记账：任务上的解析/插入/跳过行数 = 已导完文件的合计 + 当前文件，已完成字节按当前文件写到第几行估算"""
+    def __init__(self, job, index, writer, rows):
+        done = [f for f in job.file_list() if f['done']]
+        self.base = tuple(sum(f[k] for f in done) for k in ('parsed', 'inserted', 'skipped', 'size'))
+        self.job, self.index, self.writer, self.rows, self.parsed = job, index, writer, rows, 0
+
+    def update(self, parsed=0):
+        w, (p, i, k, b) = self.writer, self.base
+        self.parsed += parsed
+        self.job.rows_parsed, self.job.rows_inserted = p + self.parsed, i + w.written
+        self.job.rows_skipped = k + self.parsed - w.written - w.failed - len(w.buffer)
+        self.job.bytes_done = b + (self.job.file_list()[self.index]['size'] * min(self.parsed / self.rows, 1.0) if self.rows else 0)
+        db.session.commit()
+
+    def finish(self):
+        """文件导完（writer 已 flush）后调用：记进 files，续跑时跳过它"""
+        files = self.job.file_list(); entry = files[self.index]
+        w = self.writer
+        entry.update(done=True, parsed=self.parsed, inserted=w.written, skipped=self.parsed - w.written - w.failed)
+        self.job.set_file_list(files)
+        self.update()
+
+def job_upload_record(job, index, upload_type, table):
+    """任务里第 index 个文件的上传记录；续跑时复用上次建的记录，先清掉它写了一半的数据"""
+    files = job.file_list(); entry = files[index]
+    rec = db.session.get(UploadRecord, entry['upload_id']) if entry['upload_id'] else None
+    if rec:
+        keys = upload_fact_keys(upload_type, rec.id)
+        db.session.execute(table.delete().where(table.c.upload_id == rec.id)); rec.row_count = 0
+        refresh_daily_facts(keys)
+        UploadSheet.query.filter_by(upload_id=rec.id).delete()
+    else:
+        rec = UploadRecord(filename=entry['filename'], shop_name=job.shop_name, upload_type=upload_type, row_count=0, content_hash=entry['sha256'])
+        db.session.add(rec); db.session.flush()
+        entry['upload_id'] = rec.id; job.set_file_list(files)
+    db.session.commit()
+    return rec
+
+def find_duplicate_upload(shop_name, upload_type, content_hash, exclude_id=None):
+    """同店铺同类型、内容完全相同且没失败的上传记录"""
+    q = UploadRecord.query.filter(UploadRecord.shop_name == shop_name, UploadRecord.upload_type == upload_type, UploadRecord.content_hash == content_hash, UploadRecord.row_count >= 0)
+    if exclude_id: q = q.filter(UploadRecord.id != exclude_id)
+    return q.order_by(UploadRecord.id).first()
+
+def pending_files(job, upload_type):
+    """任务里还没导完的 [(序号, 文件)]；排队期间别处已经导入了同样内容的文件，直接记为完成"""
+    files, todo = job.file_list(), []
+    for i, f in enumerate(files):
+        if f['done']: continue
+        dup = find_duplicate_upload(job.shop_name, upload_type, f['sha256'], exclude_id=f['upload_id'])
+        if dup:
+            f['done'] = True; job.notify(f"文件 {f['filename']} 已导入过（上传记录 #{dup.id}），本次跳过", 'info')
+        else: todo.append((i, f))
+    job.set_file_list(files); db.session.commit()
+    return todo
+
+def save_upload(file, path):
+    """边落盘边算 SHA-256，返回 (字节数, 哈希)"""
+    h, size = hashlib.sha256(), 0
+    with open(path, 'wb') as out:
+        for block in iter(lambda: file.stream.read(1 << 20), b''):
+            h.update(block); out.write(block); size += len(block)
+    return size, h.hexdigest()
+
+def job_dir(job_id):
+    return os.path.join(app.instance_path, 'uploads', str(job_id))
+
+_job_queue = queue.Queue()
+_job_threads = []
+_job_lock = threading.Lock()
+
+def submit_import_job(job_type, shop_name, files):
+    """把上传的文件落盘、建任务并排队，立即返回；真正的导入在后台线程里做。
+    同店铺同类型导入过一模一样的文件（同一次上传里重复选的也算）不进任务，返回 (任务或 None, [(文件名, 之前的上传记录号或 None)])"""
+    job = ImportJob(job_type=job_type, shop_name=shop_name, status='queued')
+    db.session.add(job); db.session.flush()
+    os.makedirs(job_dir(job.id), exist_ok=True)
+    entries, duplicates, seen = [], [], {}
+    for i, file in enumerate(f for f in files if f.filename != ''):
+        path = f'{i}{os.path.splitext(file.filename)[1].lower()}'
+        size, sha256 = save_upload(file, os.path.join(job_dir(job.id), path))
+        dup = find_duplicate_upload(shop_name, job_type, sha256)
+        if dup or sha256 in seen:
+            duplicates.append((file.filename, dup.id if dup else None)); os.remove(os.path.join(job_dir(job.id), path)); continue
+        seen[sha256] = file.filename
+        entries.append({'path': path, 'filename': file.filename, 'size': size, 'sha256': sha256, 'upload_id': None, 'done': False, 'parsed': 0, 'inserted': 0, 'skipped': 0})
+    if not entries:
+        db.session.rollback(); shutil.rmtree(job_dir(job.id), ignore_errors=True)
+        return None, duplicates
+    job.set_file_list(entries); job.bytes_total = sum(e['size'] for e in entries)
+    db.session.commit()
+    _job_queue.put(job.id)
+    return job, duplicates
+
+def run_import_job(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if job is None or job.status in ('done', 'failed'): return
+    job.status, job.started_at = 'running', datetime.now(); db.session.commit()
+    try:
+        (run_shipment_job if job.job_type == 'shipment' else run_settlement_job)(job)
+        job.status = 'done'
+    except Exception as e:
+        db.session.rollback(); job.status = 'failed'; job.notify(f"上传失败: {str(e)}", 'error')
+    job.finished_at = datetime.now(); db.session.commit()
+    get_column_cache().save()
+    shutil.rmtree(job_dir(job.id), ignore_errors=True)
+
+def job_worker():
+    while True:
+        job_id = _job_queue.get()
+        try:
+            with app.app_context(): run_import_job(job_id)
+        except Exception as e: print(f"导入任务 {job_id} 异常: {e}")
+
+def start_job_workers():
+    """启动后台导入线程，并把上次没跑完（排队中/运行中）的任务重新排队；只有第一次调用生效"""
+    with _job_lock:
+        if _job_threads: return
+        with app.app_context():
+            for (job_id,) in db.session.query(ImportJob.id).filter(ImportJob.status.in_(['queued', 'running'])).order_by(ImportJob.id): _job_queue.put(job_id)
+        for _ in range(app.config['UPLOAD_JOB_WORKERS']):
+            t = threading.Thread(target=job_worker, name='import-job', daemon=True); t.start(); _job_threads.append(t)
+
+_sku_filter = None
+_column_cache = None
+
+def get_column_cache():
+    """上传表头 -> 字段列名的映射缓存（instance/column_maps.json），导入任务结束时落盘"""
+    global _column_cache
+    if _column_cache is None: _column_cache = ColumnMapCache.load(os.path.join(app.instance_path, 'column_maps.json'))
+    return _column_cache
+
+def sku_filter_path():
+    return os.path.join(app.instance_path, 'custom_sku.bloom')
+
+def rebuild_sku_filter(keep_stats=False):
+    """用 shipments 表里全部定制SKU重建布隆过滤器并落盘；容量不够自动扩容时保留原来的命中统计"""
+    global _sku_filter
+    old = _sku_filter
+    keys = [r[0] for r in db.session.query(Shipment.custom_sku).filter(Shipment.custom_sku.isnot(None))]
+    _sku_filter = SkuBloomFilter.build(keys)
+    if keep_stats and old is not None: _sku_filter.probes, _sku_filter.maybe, _sku_filter.confirmed = old.probes, old.maybe, old.confirmed
+    os.makedirs(app.instance_path, exist_ok=True); _sku_filter.save(sku_filter_path())
+    return _sku_filter
+
+def get_sku_filter():
+    global _sku_filter
+    if _sku_filter is None:
+        try: _sku_filter = SkuBloomFilter.load(sku_filter_path())
+        except (OSError, ValueError): rebuild_sku_filter()
+    return _sku_filter
+
+@app.cli.command('rebuild-sku-filter')
+def rebuild_sku_filter_command():
+    """重建定制SKU布隆过滤器（instance/custom_sku.bloom）"""
+    bf = rebuild_sku_filter()
+    print(f"已重建定制SKU过滤器：{bf.count} 个SKU，容量 {bf.capacity}，{len(bf.bits) // 1024} KB")
+
+FACT_COLUMNS = ['ship_rows', 'quantity', 'declared', 'cost', 'settle_rows', 'sales_income', 'sales_refund', 'subsidy', 'platform_fine']
+
+def daily_fact_select(shop_name=None, dates=None):
+    """发货、结算原始行按 (店铺, 日期) 汇总成 daily_facts 的行；给了 dates 时只算这个店铺的这些天"""
+    ship = select(Shipment.shop_name, Shipment.date.label('date'), func.count().label('ship_rows'), func.sum(Shipment.quantity).label('quantity'), func.sum(Shipment.declared_price_total).label('declared'), func.sum(Shipment.cost_price_total).label('cost'),
+                  literal(0).label('settle_rows'), null().label('sales_income'), null().label('sales_refund'), null().label('subsidy'), null().label('platform_fine')).where(Shipment.date.isnot(None))
+    settle = select(Settlement.shop_name, Settlement.account_date.label('date'), literal(0).label('ship_rows'), null().label('quantity'), null().label('declared'), null().label('cost'),
+                    func.count().label('settle_rows'), func.sum(Settlement.sales_income).label('sales_income'), func.sum(Settlement.sales_refund).label('sales_refund'), func.sum(Settlement.subsidy).label('subsidy'), func.sum(Settlement.platform_fine).label('platform_fine')).where(Settlement.account_date.isnot(None))
+    if dates is not None:
+        ship = ship.where(Shipment.shop_name.is_not_distinct_from(shop_name), Shipment.date.in_(dates))
+        settle = settle.where(Settlement.shop_name.is_not_distinct_from(shop_name), Settlement.account_date.in_(dates))
+    rows = union_all(ship.group_by(Shipment.shop_name, Shipment.date), settle.group_by(Settlement.shop_name, Settlement.account_date)).subquery()
+    # 同一天两边各一行，外层再 SUM 一次：只有一边有值时原样保留，两边都空时仍为空
+    return select(rows.c.shop_name, rows.c.date, *[func.sum(rows.c[c]).label(c) for c in FACT_COLUMNS]).group_by(rows.c.shop_name, rows.c.date)
+
+def refresh_daily_facts(keys):
+    """按 (店铺, 日期) 从原始行重算 daily_facts，已经没有原始行的键随之删掉；不提交，跟着调用方的事务走"""
+    by_shop = {}
+    for shop_name, d in keys:
+        if d is not None: by_shop.setdefault(shop_name, set()).add(d)
+    table = DailyFact.__table__
+    for shop_name, dates in by_shop.items():
+        dates = sorted(dates)
+        for i in range(0, len(dates), 500):
+            part = dates[i:i + 500]
+            db.session.execute(table.delete().where(table.c.shop_name.is_not_distinct_from(shop_name), table.c.date.in_(part)))
+            db.session.execute(table.insert().from_select(['shop_name', 'date'] + FACT_COLUMNS, daily_fact_select(shop_name, part)))
+
+def rebuild_daily_facts():
+    """整表重建 daily_facts，返回行数；不提交"""
+    table = DailyFact.__table__
+    db.session.execute(table.delete())
+    return db.session.execute(table.insert().from_select(['shop_name', 'date'] + FACT_COLUMNS, daily_fact_select())).rowcount
+
+def upload_fact_keys(upload_type, upload_id):
+    """一个上传记录写入的行涉及的 (店铺, 日期)"""
+    model, col = (Shipment, Shipment.date) if upload_type == 'shipment' else (Settlement, Settlement.account_date)
+    return {tuple(r) for r in db.session.query(model.shop_name, col).filter(model.upload_id == upload_id).distinct()}
+
+def check_daily_facts(tolerance=1e-6):
+    """daily_facts 与原始行逐个 (店铺, 日期) 核对，返回不一致的 [(店铺, 日期, 列, 表里的值, 原始行算出的值)]；空值按 0 比"""
+    keys = ['shop_name', 'date']
+    ship = pd.DataFrame(db.session.query(Shipment.shop_name, Shipment.date, func.count(), func.sum(Shipment.quantity), func.sum(Shipment.declared_price_total), func.sum(Shipment.cost_price_total)).filter(Shipment.date.isnot(None)).group_by(Shipment.shop_name, Shipment.date).all(), columns=keys + FACT_COLUMNS[:4])
+    settle = pd.DataFrame(db.session.query(Settlement.shop_name, Settlement.account_date, func.count(), func.sum(Settlement.sales_income), func.sum(Settlement.sales_refund), func.sum(Settlement.subsidy), func.sum(Settlement.platform_fine)).filter(Settlement.account_date.isnot(None)).group_by(Settlement.shop_name, Settlement.account_date).all(), columns=keys + FACT_COLUMNS[4:])
+    stored = pd.DataFrame(db.session.query(DailyFact.shop_name, DailyFact.date, *[getattr(DailyFact, c) for c in FACT_COLUMNS]).all(), columns=keys + FACT_COLUMNS)
+    both = ship.merge(settle, on=keys, how='outer').merge(stored, on=keys, how='outer', suffixes=('_raw', ''))
+    mismatches = []
+    for c in FACT_COLUMNS:
+        raw, got = both[c + '_raw'].astype(float).fillna(0.0), both[c].astype(float).fillna(0.0)
+        bad = (raw - got).abs() > tolerance * np.maximum(1.0, raw.abs())
+        mismatches += [(r.shop_name, r.date, c, r[c], r[c + '_raw']) for _, r in both[bad].iterrows()]
+    return mismatches
+
+@app.cli.command('rebuild-daily-facts')
+def rebuild_daily_facts_command():
+    """从发货、结算原始行整表重建 daily_facts"""
+    rows = rebuild_daily_facts(); db.session.commit()
+    print(f"已重建 daily_facts：{rows} 个店铺×日")
+
+@app.cli.command('check-daily-facts')
+def check_daily_facts_command():
+    """核对 daily_facts 与原始行，不一致时列出来并以非 0 退出"""
+    mismatches = check_daily_facts()
+    for shop_name, d, col, stored, raw in mismatches[:50]: print(f"{shop_name} {d} {col}: 表里 {stored}，原始 {raw}")
+    if mismatches: raise SystemExit(f"daily_facts 有 {len(mismatches)} 处与原始数据不一致，可运行 flask rebuild-daily-facts 重建")
+    print("daily_facts 与原始数据一致")
+
+def upgrade_schema():
+    """老库升级：create_all 只建新表，不会给已有的表补字段和索引"""
+    cols = {r[1] for r in db.session.execute(text("PRAGMA table_info(settlements)"))}
+    if 'natural_key' not in cols:
+        db.session.execute(text("ALTER TABLE settlements ADD COLUMN natural_key VARCHAR(40)"))
+        rows = pd.DataFrame(db.session.query(Settlement.id, Settlement.sku_id, Settlement.account_date, Settlement.trans_type, Settlement.order_no, Settlement.amount, Settlement.violation_id).order_by(Settlement.id).all(), columns=['id', 'sku_id', 'account_date', 'trans_type', 'order_no', 'amount', 'violation_id'])
+        if len(rows):
+            fines = rows['violation_id'].notna()
+            rows.loc[fines, 'natural_key'] = settlement_keys('fine', violation_id=rows.loc[fines, 'violation_id'])
+            t = rows[~fines]
+            rows.loc[~fines, 'natural_key'] = settlement_keys('trans', t['sku_id'], t['account_date'], t['trans_type'], t['order_no'], t['amount'].fillna(0.0))
+            # 历史重复数据只给第一条打键，其余留空，保证唯一索引能建起来
+            rows = rows.drop_duplicates('natural_key')
+            db.session.execute(text("UPDATE settlements SET natural_key = :k WHERE id = :i"), [{'k': k, 'i': int(i)} for i, k in zip(rows['id'], rows['natural_key'])])
+    db.session.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_settlements_natural_key ON settlements (natural_key)"))
+    cols = {r[1] for r in db.session.execute(text("PRAGMA table_info(upload_records)"))}
+    if 'reader_backend' not in cols: db.session.execute(text("ALTER TABLE upload_records ADD COLUMN reader_backend VARCHAR(20)"))
+    if 'parse_seconds' not in cols: db.session.execute(text("ALTER TABLE upload_records ADD COLUMN parse_seconds FLOAT"))
+    if 'content_hash' not in cols: db.session.execute(text("ALTER TABLE upload_records ADD COLUMN content_hash VARCHAR(64)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_upload_records_content_hash ON upload_records (content_hash)"))
+    # 以前清空数据时没删 Sheet 哈希，留下的孤儿记录会被新上传记录的同号 id 认领
+    db.session.execute(text("DELETE FROM upload_sheets WHERE upload_id NOT IN (SELECT id FROM upload_records)"))
+    # 报表按日期区间（可带店铺）筛选用的索引
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_shipments_date ON shipments (date)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_shipments_shop_date ON shipments (shop_name, date)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_settlements_account_date ON settlements (account_date)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_settlements_shop_date ON settlements (shop_name, account_date)"))
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_settlements_upload_id ON settlements (upload_id)"))
+    # daily_facts 是新表（create_all 建的空表），老库第一次启动时从原始行补齐
+    if db.session.query(DailyFact.date).first() is None and (db.session.query(Shipment.id).first() or db.session.query(Settlement.id).first()): rebuild_daily_facts()
+    db.session.commit()
+
+# 数据版本：本进程里任何一次写库的提交（导入的每一块、改价、录日数据、删文件、清空）都加 1，页面缓存按它失效
+data_version = 0
+_data_version_lock = threading.Lock()
+WRITE_STATEMENT = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.I)
+
+def _note_write(conn, cursor, statement, parameters, context, executemany):
+    if WRITE_STATEMENT.match(statement): conn.info['wrote'] = True
+
+def _bump_data_version(conn):
+    global data_version
+    if conn.info.pop('wrote', False):
+        with _data_version_lock: data_version += 1
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _note_write)
+    event.listen(db.engine, 'commit', _bump_data_version)
+    event.listen(db.engine, 'rollback', lambda conn: conn.info.pop('wrote', None))
+
+_page_cache = None
+
+def get_page_cache():
+    global _page_cache
+    if _page_cache is None: _page_cache = PageCache(app.config['PAGE_CACHE_MAX_BYTES'])
+    return _page_cache
+
+def cached_page(view):
+    """首页和报表页：渲染结果按 (页面, 排好序的查询参数, 当天, 数据版本) 缓存，响应带内容的 ETag，
+    浏览器带 If-None-Match 来且内容没变时回 304。还有没显示的提示消息、或渲染期间数据版本变了时照常返回、不存"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if '_flashes' in session: return view(*args, **kwargs)
+        cache = get_page_cache()
+        key = (request.endpoint, tuple(sorted(request.args.items(multi=True))), date.today(), data_version)
+        entry = cache.get(key)
+        if entry is None:
+            body = view(*args, **kwargs).encode('utf-8')
+            entry = (hashlib.md5(body).hexdigest(), body)
+            # 渲染期间有写入提交时，页面可能混着改动前后的数据，不存（下次请求按新版本重新渲染）
+            if data_version == key[-1]: cache.put(key, *entry)
+        response = make_response(entry[1])
+        response.set_etag(entry[0]); response.cache_control.no_cache = True
+        response.make_conditional(request)
+        if response.status_code == 304: cache.count_not_modified()
+        return response
+    return wrapper
+
 # ==================== 3. 路由与逻辑 ====================
 
 @app.route('/')
+@cached_page
 def index():
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    latest_shipment = Shipment.query.order_by(Shipment.date.desc()).first()
-    default_end = latest_shipment.date if latest_shipment else date.today()
+    default_end = db.session.query(func.max(DailyFact.date)).filter(DailyFact.ship_rows > 0).scalar() or date.today()
     default_start = default_end - timedelta(days=29)
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else default_start
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else default_end
     today = date.today()
 
     today_activity = db.session.query(func.sum(DailyStat.total_activity)).filter(DailyStat.date == today).scalar() or 0.0
-    today_orders = db.session.query(func.sum(Shipment.quantity)).filter(Shipment.date == today).scalar() or 0
-    today_settlement = db.session.query(func.sum(Settlement.sales_income)).filter(Settlement.account_date == today).scalar() or 0.0
+    today_orders = db.session.query(func.sum(DailyFact.quantity)).filter(DailyFact.date == today).scalar() or 0
+    today_settlement = db.session.query(func.sum(DailyFact.sales_income)).filter(DailyFact.date == today).scalar() or 0.0
     total_all_activity = db.session.query(func.sum(DailyStat.total_activity)).scalar() or 0.0
-    total_all_settled = db.session.query(func.sum(Settlement.sales_income)).scalar() or 0.0
+    total_all_settled = db.session.query(func.sum(DailyFact.sales_income)).scalar() or 0.0
     total_pending = total_all_activity - total_all_settled
 
-    ship_trend = db.session.query(Shipment.date, func.sum(Shipment.quantity).label('qty')).filter(Shipment.date >= start_date, Shipment.date <= end_date).group_by(Shipment.date).all()
+    in_range = [DailyFact.date >= start_date, DailyFact.date <= end_date]
+    ship_trend = db.session.query(DailyFact.date, func.sum(DailyFact.quantity).label('qty')).filter(*in_range, DailyFact.ship_rows > 0).group_by(DailyFact.date).all()
     ship_map = {item.date: item.qty for item in ship_trend}
-    settle_trend = db.session.query(Settlement.account_date, func.sum(Settlement.sales_income).label('income')).filter(Settlement.account_date >= start_date, Settlement.account_date <= end_date).group_by(Settlement.account_date).all()
-    settle_map = {item.account_date: item.income for item in settle_trend}
+    settle_trend = db.session.query(DailyFact.date, func.sum(DailyFact.sales_income).label('income')).filter(*in_range, DailyFact.settle_rows > 0).group_by(DailyFact.date).all()
+    settle_map = {item.date: item.income for item in settle_trend}
 
     all_dates = sorted(list(set(list(ship_map.keys()) + list(settle_map.keys()))))
     chart_dates, chart_shipments, chart_settlements = [], [], []
@@ -149,14 +760,47 @@ def index():
         chart_shipments.append(ship_map.get(d, 0))
         chart_settlements.append(settle_map.get(d, 0.0))
 
-    shop_dist = db.session.query(Shipment.shop_name, func.sum(Shipment.quantity).label('qty')).filter(Shipment.date >= start_date, Shipment.date <= end_date).group_by(Shipment.shop_name).order_by(desc('qty')).all()
+    shop_dist = db.session.query(DailyFact.shop_name, func.sum(DailyFact.quantity).label('qty')).filter(*in_range, DailyFact.ship_rows > 0).group_by(DailyFact.shop_name).order_by(desc('qty')).all()
     shop_labels = [s.shop_name for s in shop_dist]
     shop_data = [s.qty for s in shop_dist]
     alert_list = db.session.query(Settlement).filter(or_(Settlement.platform_fine < 0, Settlement.trans_type.like('%罚款%'))).order_by(Settlement.account_date.desc()).limit(5).all()
 
     return render_template('index.html', start_date=start_date, end_date=end_date, today_activity=today_activity, today_orders=today_orders, today_settlement=today_settlement, total_pending=total_pending, chart_dates=chart_dates, chart_shipments=chart_shipments, chart_settlements=chart_settlements, shop_labels=shop_labels, shop_data=shop_data, alert_list=alert_list)
 
+def period_filters(column, year, month=None, day=None):
+    """报表的年 / 月 / 日选择 -> 日期列上的半开区间 [start, end)，能走日期索引；
+    选了日没选月时是全年每个月的这一天；日期不存在（如 2 月 30 日）时查不到数据，和原来按 extract 比较一致"""
+    try:
+        if month and day: start = date(year, month, day); end = start + timedelta(days=1)
+        elif month: start = date(year, month, 1); end = date(year + month // 12, month % 12 + 1, 1)
+        else: start = date(year, 1, 1); end = date(year + 1, 1, 1)
+    except (ValueError, OverflowError): return [false()]
+    conds = [column >= start, column < end]
+    if day and not month: conds.append(extract('day', column) == day)
+    return conds
+
+def fact_filters(rows, shop_filter, year, month=None, day=None):
+    """daily_facts 上的报表条件：日期区间 + 这一类数据确实有（rows 为 ship_rows / settle_rows）+ 店铺"""
+    conds = period_filters(DailyFact.date, year, month, day) + [rows > 0]
+    if shop_filter != '所有店铺': conds.append(DailyFact.shop_name == shop_filter)
+    return conds
+
+def grouped_frame(query, rows=None):
+    """分组查询的结果 -> DataFrame，以第一列（日期或月份）为索引，列名用查询里的 label；rows 已取过时直接传入"""
+    names = [c['name'] for c in query.column_descriptions]
+    rows = query.all() if rows is None else rows
+    return pd.DataFrame([tuple(r) for r in rows], columns=names).set_index(names[0])
+
+def daily_stats_by_date(dates, shop_filter):
+    """日报本页各天的 DailyStat，一条查询取齐：所有店铺时按天求和，单个店铺时就是那一行；没有记录的日期不在结果里"""
+    cols = [DailyStat.total_activity, DailyStat.total_service, DailyStat.total_ad, DailyStat.delivery_fine, DailyStat.total_cost]
+    labels = ['act', 'srv', 'ad', 'dfine', 'manual_cost']
+    if shop_filter == '所有店铺': q = db.session.query(DailyStat.date, *[func.sum(c).label(l) for c, l in zip(cols, labels)]).filter(DailyStat.date.in_(dates)).group_by(DailyStat.date)
+    else: q = db.session.query(DailyStat.date, *[c.label(l) for c, l in zip(cols, labels)]).filter(DailyStat.date.in_(dates), DailyStat.shop_name == shop_filter)
+    return grouped_frame(q)
+
 @app.route('/shipment')
+@cached_page
 def shipment():
     page = request.args.get('page', 1, type=int)
     shop_filter = request.args.get('shop_name', '所有店铺')
@@ -167,74 +811,43 @@ def shipment():
     day_str = request.args.get('day', '')
     day = int(day_str) if day_str and day_str != '0' else None
     
-    filters = [extract('year', Shipment.date) == year]
-    if month: filters.append(extract('month', Shipment.date) == month)
-    if day: filters.append(extract('day', Shipment.date) == day)
-    if shop_filter != '所有店铺': filters.append(Shipment.shop_name == shop_filter)
+    # 报表都从 daily_facts 读，发货这边只看有发货的店铺×日
+    filters = fact_filters(DailyFact.ship_rows, shop_filter, year, month, day)
 
-    if not month: trend_q = db.session.query(func.strftime('%Y-%m', Shipment.date).label('d'), func.sum(Shipment.quantity)).filter(and_(*filters)).group_by('d')
-    else: trend_q = db.session.query(Shipment.date, func.sum(Shipment.quantity)).filter(and_(*filters)).group_by(Shipment.date)
+    if not month: trend_q = db.session.query(func.strftime('%Y-%m', DailyFact.date).label('d'), func.sum(DailyFact.quantity)).filter(and_(*filters)).group_by('d')
+    else: trend_q = db.session.query(DailyFact.date, func.sum(DailyFact.quantity)).filter(and_(*filters)).group_by(DailyFact.date)
     
     trend_data = trend_q.all()
     if not month: trend_dates = [str(d[0]) for d in trend_data]
     else: trend_dates = [d[0].strftime('%m-%d') for d in trend_data]
     trend_values = [d[1] for d in trend_data]
 
-    dist_q = db.session.query(Shipment.shop_name, func.sum(Shipment.quantity).label('qty')).filter(and_(*filters)).group_by(Shipment.shop_name).order_by(desc('qty'))
+    dist_q = db.session.query(DailyFact.shop_name, func.sum(DailyFact.quantity).label('qty')).filter(and_(*filters)).group_by(DailyFact.shop_name).order_by(desc('qty'))
     s_data = dist_q.all(); shop_labels = [s[0] for s in s_data]; shop_values = [s[1] for s in s_data]
 
-    daily_data = []
-    
-    # 列表数据逻辑 (月报 vs 日报)
+    # 列表数据逻辑 (月报 vs 日报)：三路分组结果按月份 / 日期对齐后交给 report_metrics 统一算指标和合计行
     if month is None:
-        ship_rows = db.session.query(extract('month', Shipment.date).label('m'), func.sum(Shipment.quantity).label('qty'), func.sum(Shipment.declared_price_total).label('dec'), func.sum(Shipment.cost_price_total).label('cost')).filter(and_(*filters)).group_by('m').all()
-        ds_filters = [extract('year', DailyStat.date) == year]
+        ship_q = db.session.query(extract('month', DailyFact.date).label('m'), func.sum(DailyFact.quantity).label('qty'), func.sum(DailyFact.declared).label('dec'), func.sum(DailyFact.cost).label('cost')).filter(and_(*filters)).group_by('m')
+        ds_filters = period_filters(DailyStat.date, year)
         if shop_filter != '所有店铺': ds_filters.append(DailyStat.shop_name == shop_filter)
-        ds_rows = db.session.query(extract('month', DailyStat.date).label('m'), func.sum(DailyStat.total_activity).label('act'), func.sum(DailyStat.total_service).label('srv'), func.sum(DailyStat.total_ad).label('ad'), func.sum(DailyStat.delivery_fine).label('fine'), func.sum(DailyStat.total_cost).label('manual_cost')).filter(and_(*ds_filters)).group_by('m').all()
-        st_filters = [extract('year', Settlement.account_date) == year]
-        if shop_filter != '所有店铺': st_filters.append(Settlement.shop_name == shop_filter)
-        st_rows = db.session.query(extract('month', Settlement.account_date).label('m'), func.sum(Settlement.platform_fine).label('fine'), func.sum(Settlement.sales_refund).label('ref')).filter(and_(*st_filters)).group_by('m').all()
-
-        monthly_map = {m: {'date': f"{year}年{m}月", 'total_quantity':0, 'total_declared':0, 'total_cost':0, 'total_service':0, 'total_activity':0, 'total_fine':0, 'total_refund':0, 'total_ad':0} for m in range(1, 13)}
-        for r in ship_rows: d=monthly_map[int(r.m)]; d['total_quantity']=r.qty or 0; d['total_declared']=r.dec or 0; d['total_cost']=r.cost or 0
-        for r in ds_rows: d=monthly_map[int(r.m)]; d['total_activity']=r.act or 0; d['total_service']=r.srv or 0; d['total_ad']=r.ad or 0
-        for r in st_rows: d=monthly_map[int(r.m)]; d['total_fine']=r.fine or 0; d['total_refund']=abs(r.ref or 0)
+        ds_q = db.session.query(extract('month', DailyStat.date).label('m'), func.sum(DailyStat.total_activity).label('act'), func.sum(DailyStat.total_service).label('srv'), func.sum(DailyStat.total_ad).label('ad')).filter(and_(*ds_filters)).group_by('m')
+        st_filters = fact_filters(DailyFact.settle_rows, shop_filter, year)
+        st_q = db.session.query(extract('month', DailyFact.date).label('m'), func.sum(DailyFact.platform_fine).label('fine'), func.sum(DailyFact.sales_refund).label('ref')).filter(and_(*st_filters)).group_by('m')
+
+        table = report_metrics.align(range(12, 0, -1), grouped_frame(ship_q), grouped_frame(ds_q), grouped_frame(st_q))
+        table = table[(table['qty'] > 0) | (table['act'] > 0)]
+        table.index = [f"{year}年{m}月" for m in table.index]
         pagination = None
-        for m in sorted(monthly_map.keys(), reverse=True):
-            if monthly_map[m]['total_quantity'] > 0 or monthly_map[m]['total_activity'] > 0: daily_data.append(monthly_map[m])
     else:
-        shipment_query = db.session.query(Shipment.date, func.sum(Shipment.quantity).label('total_quantity'), func.sum(Shipment.declared_price_total).label('total_declared'), func.sum(Shipment.cost_price_total).label('total_cost')).filter(and_(*filters)).group_by(Shipment.date).order_by(desc(Shipment.date))
+        shipment_query = db.session.query(DailyFact.date, func.sum(DailyFact.quantity).label('qty'), func.sum(DailyFact.declared).label('dec'), func.sum(DailyFact.cost).label('cost')).filter(and_(*filters)).group_by(DailyFact.date).order_by(desc(DailyFact.date))
         pagination = shipment_query.paginate(page=page, per_page=31)
-        for item in pagination.items:
-            if shop_filter == '所有店铺': daily_stat = db.session.query(func.sum(DailyStat.total_activity).label('total_activity'), func.sum(DailyStat.total_service).label('total_service'), func.sum(DailyStat.total_ad).label('total_ad'), func.sum(DailyStat.delivery_fine).label('delivery_fine'), func.sum(DailyStat.total_cost).label('total_cost')).filter(DailyStat.date == item.date).first()
-            else: daily_stat = DailyStat.query.filter_by(date=item.date, shop_name=shop_filter).first()
-            settle_q = db.session.query(func.sum(Settlement.platform_fine).label('today_fine'), func.sum(Settlement.sales_refund).label('today_refund')).filter(Settlement.account_date == item.date)
-            if shop_filter != '所有店铺': settle_q = settle_q.filter(Settlement.shop_name == shop_filter)
-            settlement_stats = settle_q.first()
-            calc_cost = item.total_cost or 0.0; manual_cost = (daily_stat.total_cost or 0.0) if daily_stat else 0.0
-            t_cost = manual_cost if manual_cost > 0 else calc_cost
-            daily_data.append({'date': item.date, 'total_quantity': item.total_quantity or 0, 'total_declared': item.total_declared or 0.0, 'total_cost': t_cost, 'total_service': (daily_stat.total_service or 0.0) if daily_stat else 0.0, 'total_activity': (daily_stat.total_activity or 0.0) if daily_stat else 0.0, 'total_fine': (settlement_stats.today_fine or 0.0), 'total_refund': abs(settlement_stats.today_refund or 0.0), 'total_ad': (daily_stat.total_ad or 0.0) if daily_stat else 0.0})
-
-    sum_data = {'quantity':0,'declared':0,'cost':0,'service':0,'activity':0,'fine':0,'refund':0,'gross_profit':0,'ad':0}
-    for row in daily_data:
-        t_cost, t_srv, t_fine, t_ref, t_ad = float(row['total_cost']), float(row['total_service']), float(row['total_fine']), float(row['total_refund']), float(row['total_ad'])
-        t_act = float(row['total_activity'])
-        row['gross_profit'] = t_act - t_cost - t_srv - t_fine - t_ref - t_ad
-        row['roi'] = row['gross_profit'] / t_cost if t_cost else 0.0
-        t_q=row['total_quantity']; t_d=row['total_declared']
-        row['declared_per_ticket'] = (t_d/t_q) if t_q else 0
-        row['profit_per_ticket'] = (row['gross_profit']/t_q) if t_q else 0
-        row['refund_rate'] = (t_ref/t_act) if t_act else 0
-        row['ad_sales_ratio'] = (t_ad/t_act) if t_act else 0
-        row['ad_profit_ratio'] = (t_ad/row['gross_profit']) if row['gross_profit'] else 0
-        row['cost_sales_ratio'] = (t_cost/t_act) if t_act else 0
-        row['sales_profit_rate'] = (row['gross_profit']/t_act) if t_act else 0
-        row['actual_discount_rate'] = (t_act/t_d) if t_d else 0
-        sum_data['quantity']+=t_q; sum_data['declared']+=t_d; sum_data['cost']+=t_cost; sum_data['service']+=t_srv; sum_data['activity']+=t_act; sum_data['fine']+=t_fine; sum_data['refund']+=t_ref; sum_data['gross_profit']+=row['gross_profit']; sum_data['ad']+=t_ad
-
-    if daily_data:
-        s=sum_data
-        daily_data.insert(0, {'date':'合计', 'is_summary':True, 'total_quantity':s['quantity'], 'total_declared':s['declared'], 'total_cost':s['cost'], 'total_service':s['service'], 'total_activity':s['activity'], 'total_fine':s['fine'], 'total_refund':s['refund'], 'gross_profit':s['gross_profit'], 'total_ad':s['ad'], 'roi': s['gross_profit']/s['cost'] if s['cost'] else 0, 'declared_per_ticket': (s['declared']/s['quantity']) if s['quantity'] else 0, 'profit_per_ticket': (s['gross_profit']/s['quantity']) if s['quantity'] else 0, 'refund_rate': (s['refund']/s['activity']) if s['activity'] else 0, 'ad_sales_ratio': (s['ad']/s['activity']) if s['activity'] else 0, 'ad_profit_ratio': (s['ad']/s['gross_profit']) if s['gross_profit'] else 0, 'cost_sales_ratio': (s['cost']/s['activity']) if s['activity'] else 0, 'sales_profit_rate': (s['gross_profit']/s['activity']) if s['activity'] else 0, 'actual_discount_rate': (s['activity']/s['declared']) if s['declared'] else 0})
+        # 本页各天的手工数据和结算数据各一条分组查询，按日期对齐
+        page_dates = [item.date for item in pagination.items]
+        settle_q = db.session.query(DailyFact.date, func.sum(DailyFact.platform_fine).label('fine'), func.sum(DailyFact.sales_refund).label('ref')).filter(DailyFact.date.in_(page_dates), DailyFact.settle_rows > 0)
+        if shop_filter != '所有店铺': settle_q = settle_q.filter(DailyFact.shop_name == shop_filter)
+        table = report_metrics.align(page_dates, grouped_frame(shipment_query, pagination.items), daily_stats_by_date(page_dates, shop_filter), grouped_frame(settle_q.group_by(DailyFact.date)))
+
+    daily_data = report_metrics.shipment_rows(table)
 
     return render_template('shipment.html', title="发货明细", daily_data=daily_data, pagination=pagination, trend_dates=trend_dates, trend_values=trend_values, shop_labels=shop_labels, shop_values=shop_values, current_shop=shop_filter, selected_year=year, selected_month=month, selected_day=day)
 
@@ -256,78 +869,73 @@ def update_daily_stat():
         return jsonify({'status': 'success', 'msg': '已保存'})
     except Exception as e: return jsonify({'status': 'error', 'msg': str(e)})
 
+def job_accepted(submitted, endpoint):
+    """上传接口的返回：要 JSON 的调用方拿任务号去轮询 /jobs/<id>，页面表单提交就提示一句跳回原页面"""
+    job, duplicates = submitted
+    if request.accept_mimetypes.best == 'application/json':
+        body = {'job_id': job.id if job else None, 'duplicates': [{'filename': name, 'upload_id': upload_id} for name, upload_id in duplicates]}
+        if job: body['status_url'] = url_for('job_status', job_id=job.id)
+        return jsonify(body), 202 if job else 200
+    for name, upload_id in duplicates:
+        flash(f"文件 {name} 已导入过（上传记录 #{upload_id}），本次跳过" if upload_id else f"文件 {name} 在本次上传里重复选择，只导入一次", 'info')
+    if job: flash(f"已提交后台导入任务 #{job.id}（{len(job.file_list())} 个文件），导入结果可在文件管理页查看", 'success')
+    return redirect(url_for(endpoint))
+
 @app.route('/shipment/upload', methods=['POST'])
 def upload_shipment():
     if 'file' not in request.files: return redirect(url_for('shipment'))
     files = request.files.getlist('file')
     shop_name_selected = request.form.get('shop_name')
     if not files or files[0].filename == '': return redirect(url_for('shipment'))
-    try:
-        for file in files:
-            if file.filename == '': continue
-            upload_rec = UploadRecord(filename=file.filename, shop_name=shop_name_selected, upload_type='shipment', row_count=0)
-            db.session.add(upload_rec); db.session.flush()
-
-            df = pd.read_csv(file) if file.filename.endswith('.csv') else pd.read_excel(file)
-            col_order = find_column(df.columns, ['备货单', '发货单', '订单号', 'order_no'])
-            col_custom_sku = find_column(df.columns, ['定制SKU', 'custom_sku', 'Custom SKU']) 
-            col_spu = find_column(df.columns, ['商品SPU ID', 'SPUID', 'spu_id'])
-            col_skc = find_column(df.columns, ['商品SKC ID', 'SKCID', 'skc_id'])
-            col_name = find_column(df.columns, ['商品名称', 'Title', 'name'])
-            col_specs = find_column(df.columns, ['商品属性集', '规格', 'SKU属性'])
-            col_qty = find_column(df.columns, ['总发货件数', '数量', '件数', 'Quantity'])
-            col_shop = find_column(df.columns, ['店铺', '店铺名称'])
-            if not col_order: 
-                db.session.rollback(); upload_rec.row_count = -1; db.session.commit(); flash(f"文件 {file.filename} 上传失败：未找到关键列 '备货单/订单号'！", 'error'); continue
+    return job_accepted(submit_import_job('shipment', shop_name_selected, files), 'shipment')
 
-            df[col_order] = df[col_order].ffill()
-            if col_shop: df[col_shop] = df[col_shop].ffill()
-            count = 0
-            for index, row in df.iterrows():
-                raw_order_str = str(row[col_order]).strip()
-                if '/' in raw_order_str: raw_order_str = raw_order_str.split('/')[-1].strip()
-                qty_val = 1; order_no = raw_order_str
-                qty_match = re.search(r'[，,]\s*(\d+)\s*件', raw_order_str)
-                if qty_match:
-                    try: qty_val = int(qty_match.group(1)); order_no = re.split(r'[，,]', raw_order_str)[0].strip()
-                    except: qty_val = 1
-                if col_qty and pd.notna(row[col_qty]): qty_val = clean_quantity(row[col_qty])
-                custom_sku_val = None
-                if col_custom_sku and pd.notna(row[col_custom_sku]): raw_sku = str(row[col_custom_sku]).strip(); custom_sku_val = raw_sku if raw_sku and raw_sku!='-' and raw_sku.lower()!='nan' else None
-                goods_name = str(row[col_name]).strip() if col_name and pd.notna(row[col_name]) else ''
-                if not custom_sku_val: 
-                    if not goods_name or goods_name == '-' or goods_name.lower() == 'nan': continue 
-                if custom_sku_val:
-                    existing = Shipment.query.filter_by(custom_sku=custom_sku_val).first()
-                    if existing: continue
-                ship_date = extract_date_from_order(order_no)
-                current_shop = row[col_shop] if col_shop and pd.notna(row[col_shop]) else shop_name_selected
-                if not current_shop or str(current_shop).lower() == 'nan': current_shop = shop_name_selected
-                spu_val = str(row[col_spu]) if col_spu and pd.notna(row[col_spu]) else ''
-                skc_val = str(row[col_skc]) if col_skc and pd.notna(row[col_skc]) else ''
-                specs_val = str(row[col_specs]) if col_specs and pd.notna(row[col_specs]) else ''
-                
-                product_record = Product.query.filter_by(shop_name=shop_name_selected, spu_id=spu_val, skc_id=skc_val, specs=specs_val).first()
-                unit_declared_price, unit_cost_price = 0.0, 0.0
-                if not product_record:
-                    # 继承价格逻辑
-                    sibling = Product.query.filter_by(shop_name=shop_name_selected, skc_id=skc_val).filter(or_(Product.declared_price > 0, Product.cost_price > 0)).first()
-                    if sibling:
-                        unit_declared_price = sibling.declared_price
-                        unit_cost_price = sibling.cost_price
-                    new_product = Product(shop_name=shop_name_selected, spu_id=spu_val, skc_id=skc_val, name=goods_name, specs=specs_val, declared_price=unit_declared_price, cost_price=unit_cost_price)
-                    db.session.add(new_product); db.session.flush() 
-                else:
-                    unit_declared_price = product_record.declared_price; unit_cost_price = product_record.cost_price
-                new_shipment = Shipment(shop_name=shop_name_selected, order_no=order_no, custom_sku=custom_sku_val, date=ship_date, spu_id=spu_val, skc_id=skc_val, goods_name=goods_name, specs=specs_val, quantity=qty_val, declared_price_total=unit_declared_price * qty_val, cost_price_total=unit_cost_price * qty_val, upload_id=upload_rec.id)
-                db.session.add(new_shipment)
-                count += 1
-            upload_rec.row_count = count
-        db.session.commit()
-    except Exception as e: db.session.rollback(); flash(f"上传失败: {str(e)}", 'error')
-    return redirect(url_for('shipment'))
+def run_shipment_job(job):
+    """后台导入发货明细：先把没导完的文件交给解析进程并行解析，再按上传顺序逐个文件写库"""
+    shop_name_selected, work_dir = job.shop_name, job_dir(job.id)
+    todo = pending_files(job, 'shipment')
+    column_cache = get_column_cache()
+    known_layouts = column_cache.snapshot()
+    jobs = [(parse_shipment_upload, os.path.join(work_dir, f['path']), f['filename'], os.path.join(work_dir, f'{i}.spool'), app.config['UPLOAD_READ_CHUNK_ROWS'], known_layouts) for i, f in todo]
+    parsed_files = run_parse_jobs(jobs)
+
+    product_index = ProductIndex(shop_name_selected)
+    sku_filter = get_sku_filter()
+    seen_skus = set()
+    for (i, file), (_, _, _, spool, _, _), (result, error) in zip(todo, jobs, parsed_files):
+        if error: raise error
+        column_cache.merge(result['column_map'])
+        upload_rec = job_upload_record(job, i, 'shipment', Shipment.__table__)
+        writer = ChunkedWriter(Shipment.__table__, ignore_conflicts=True, fact_date='date')
+        progress = FileProgress(job, i, writer, result['rows'] if result['batches'] is not None else 0)
+        if result['batches'] is None:
+            upload_rec.row_count = -1; job.notify(f"文件 {file['filename']} 上传失败：未找到关键列 '备货单/订单号'！", 'error'); progress.finish(); continue
+
+        for parsed in read_spool(spool, result['batches']):
+            for row in parsed.itertuples(index=False):
+                if row.custom_sku:
+                    if row.custom_sku in seen_skus: continue
+                    # 过滤器说没有就一定没有，只有"可能存在"时才查库确认
+                    if sku_filter.might_contain(row.custom_sku) and Shipment.query.filter_by(custom_sku=row.custom_sku).first():
+                        sku_filter.record_confirmed(); continue
+                    seen_skus.add(row.custom_sku)
+                unit_declared_price, unit_cost_price = product_index.resolve(row.spu_id, row.skc_id, row.specs, row.goods_name)
+                qty_val = int(row.quantity)
+                writer.add({'shop_name': shop_name_selected, 'order_no': row.order_no, 'custom_sku': row.custom_sku, 'date': row.date, 'spu_id': row.spu_id, 'skc_id': row.skc_id, 'goods_name': row.goods_name, 'specs': row.specs, 'quantity': qty_val, 'declared_price_total': unit_declared_price * qty_val, 'cost_price_total': unit_cost_price * qty_val, 'upload_id': upload_rec.id})
+            progress.update(len(parsed))
+        writer.flush()
+        refresh_daily_facts(writer.touched)
+        upload_rec.row_count = writer.written
+        upload_rec.reader_backend, upload_rec.parse_seconds = result['backend'], result['parse_seconds']
+        if writer.failed: job.notify(f"文件 {file['filename']} 有 {writer.failed} 行写入失败: {writer.errors[0]}", 'error')
+        # 新商品随文件一起提交，重启续跑时后面的文件能查到它们的价格
+        product_index.write_new_products()
+        progress.finish()
+    for sku in seen_skus: sku_filter.add(sku)
+    if sku_filter.is_full: rebuild_sku_filter(keep_stats=True)
+    else: sku_filter.save(sku_filter_path())
 
 @app.route('/settlement')
+@cached_page
 def settlement():
     page = request.args.get('page', 1, type=int)
     shop_filter = request.args.get('shop_name', '所有店铺')
@@ -338,89 +946,42 @@ def settlement():
     day_str = request.args.get('day', '')
     day = int(day_str) if day_str and day_str != '0' else None
 
-    filters = [extract('year', Settlement.account_date) == year]
-    if month: filters.append(extract('month', Settlement.account_date) == month)
-    if day: filters.append(extract('day', Settlement.account_date) == day)
-    if shop_filter != '所有店铺': filters.append(Settlement.shop_name == shop_filter)
+    # 报表都从 daily_facts 读，结算这边只看有结算的店铺×日
+    filters = fact_filters(DailyFact.settle_rows, shop_filter, year, month, day)
 
-    if not month: trend_q = db.session.query(func.strftime('%Y-%m', Settlement.account_date).label('d'), func.sum(Settlement.sales_income)).filter(and_(*filters)).group_by('d')
-    else: trend_q = db.session.query(func.strftime('%Y-%m-%d', Settlement.account_date).label('d'), func.sum(Settlement.sales_income)).filter(and_(*filters)).group_by('d')
+    if not month: trend_q = db.session.query(func.strftime('%Y-%m', DailyFact.date).label('d'), func.sum(DailyFact.sales_income)).filter(and_(*filters)).group_by('d')
+    else: trend_q = db.session.query(func.strftime('%Y-%m-%d', DailyFact.date).label('d'), func.sum(DailyFact.sales_income)).filter(and_(*filters)).group_by('d')
     
     t_data = trend_q.all(); trend_dates=[d[0] for d in t_data]; trend_income=[d[1] for d in t_data]
 
     total_inc = sum(trend_income)
-    ref_q = db.session.query(func.sum(Settlement.sales_refund)).filter(and_(*filters))
-    fine_q = db.session.query(func.sum(Settlement.platform_fine)).filter(and_(*filters))
-    if shop_filter != '所有店铺': ref_q=ref_q.filter(Settlement.shop_name == shop_filter); fine_q=fine_q.filter(Settlement.shop_name == shop_filter)
-    total_refund = ref_q.scalar() or 0.0; total_fine = fine_q.scalar() or 0.0
-    
-    report_data = []
+    total_refund, total_fine = db.session.query(func.sum(DailyFact.sales_refund), func.sum(DailyFact.platform_fine)).filter(and_(*filters)).one()
+    total_refund = total_refund or 0.0; total_fine = total_fine or 0.0
     
     if month is None:
         # 月报模式
-        rows = db.session.query(extract('month', Settlement.account_date).label('m'), func.sum(Settlement.sales_income).label('inc'), func.sum(Settlement.sales_refund).label('ref'), func.sum(Settlement.subsidy).label('sub'), func.sum(Settlement.platform_fine).label('fine'), func.count(Settlement.id).label('cnt')).filter(and_(*filters)).group_by('m').all()
-        s_filt = [extract('year', Shipment.date) == year]; 
-        if shop_filter!='所有店铺': s_filt.append(Shipment.shop_name == shop_filter)
-        s_rows = db.session.query(extract('month', Shipment.date).label('m'), func.sum(Shipment.quantity).label('qty'), func.sum(Shipment.declared_price_total).label('dec'), func.sum(Shipment.cost_price_total).label('cost')).filter(and_(*s_filt)).group_by('m').all()
-        d_filt = [extract('year', DailyStat.date) == year];
+        st_q = db.session.query(extract('month', DailyFact.date).label('m'), func.sum(DailyFact.sales_income).label('inc'), func.sum(DailyFact.sales_refund).label('ref'), func.sum(DailyFact.subsidy).label('sub'), func.sum(DailyFact.platform_fine).label('fine'), func.sum(DailyFact.settle_rows).label('cnt')).filter(and_(*filters)).group_by('m')
+        s_filt = fact_filters(DailyFact.ship_rows, shop_filter, year)
+        s_q = db.session.query(extract('month', DailyFact.date).label('m'), func.sum(DailyFact.quantity).label('qty'), func.sum(DailyFact.declared).label('dec'), func.sum(DailyFact.cost).label('cost')).filter(and_(*s_filt)).group_by('m')
+        d_filt = period_filters(DailyStat.date, year)
         if shop_filter!='所有店铺': d_filt.append(DailyStat.shop_name == shop_filter)
-        d_rows = db.session.query(extract('month', DailyStat.date).label('m'), func.sum(DailyStat.total_activity).label('act'), func.sum(DailyStat.total_service).label('srv'), func.sum(DailyStat.total_ad).label('ad'), func.sum(DailyStat.delivery_fine).label('dfine')).filter(and_(*d_filt)).group_by('m').all()
+        d_q = db.session.query(extract('month', DailyStat.date).label('m'), func.sum(DailyStat.total_activity).label('act'), func.sum(DailyStat.total_service).label('srv'), func.sum(DailyStat.total_ad).label('ad'), func.sum(DailyStat.delivery_fine).label('dfine')).filter(and_(*d_filt)).group_by('m')
 
-        m_map = {m:{'date':f"{year}年{m}月",'ship_qty':0,'ship_declared':0,'ship_cost':0,'activity_price':0,'service_fee':0,'ad_cost':0,'settle_count':0,'settle_amount':0,'consumer_refund':0,'subsidy':0,'after_sales_fine':0,'delivery_fine':0} for m in range(1,13)}
-        for r in rows: d=m_map[int(r.m)]; d.update({'settle_count':r.cnt,'settle_amount':r.inc or 0,'consumer_refund':abs(r.ref or 0),'subsidy':r.sub or 0,'after_sales_fine':abs(r.fine or 0)})
-        for r in s_rows: d=m_map[int(r.m)]; d.update({'ship_qty':r.qty or 0,'ship_declared':r.dec or 0,'ship_cost':r.cost or 0})
-        for r in d_rows: d=m_map[int(r.m)]; d.update({'activity_price':r.act or 0,'service_fee':r.srv or 0,'ad_cost':r.ad or 0,'delivery_fine':r.dfine or 0})
-            
+        table = report_metrics.align(range(12, 0, -1), grouped_frame(st_q), grouped_frame(s_q), grouped_frame(d_q))
+        table = table[(table['inc'] != 0) | (table['qty'] != 0)]
+        table.index = [f"{year}年{m}月" for m in table.index]
         pagination = None
-        for m in sorted(m_map.keys(), reverse=True):
-            d = m_map[m]
-            if d['settle_amount']==0 and d['ship_qty']==0: continue
-            
-            gp = d['settle_amount'] - d['ad_cost'] - d['ship_cost'] - d['service_fee'] - d['consumer_refund'] - d['subsidy'] - d['after_sales_fine'] - d['delivery_fine']
-            d.update({
-                'gross_profit': gp,
-                'roi': gp/(d['ship_cost']+d['service_fee']) if (d['ship_cost']+d['service_fee']) else 0,
-                'activity_discount': d['activity_price']/d['ship_declared'] if d['ship_declared'] else 0,
-                'settle_count_ratio': d['settle_count']/d['ship_qty'] if d['ship_qty'] else 0,
-                'settle_amount_discount': d['settle_amount']/d['ship_declared'] if d['ship_declared'] else 0,
-                'settle_amount_progress': d['settle_amount']/d['activity_price'] if d['activity_price'] else 0,
-                'declared_per_ticket': d['ship_declared']/d['ship_qty'] if d['ship_qty'] else 0,
-                'profit_per_ticket': gp/d['ship_qty'] if d['ship_qty'] else 0,
-                'discount_diff': 0, 'refund_rate': d['consumer_refund']/d['settle_amount'] if d['settle_amount'] else 0,
-                'after_sales_rate': d['after_sales_fine']/d['settle_amount'] if d['settle_amount'] else 0,
-                'delivery_fine_rate': d['delivery_fine']/d['settle_amount'] if d['settle_amount'] else 0
-            })
-            report_data.append(d)
+        report_data = report_metrics.settlement_rows(table, discount_diff=False)
     else:
         # 日报模式
-        settlement_query = db.session.query(Settlement.account_date, func.sum(Settlement.sales_income).label('total_income'), func.sum(Settlement.sales_refund).label('total_refund'), func.sum(Settlement.subsidy).label('total_subsidy'), func.sum(Settlement.platform_fine).label('total_fine'), func.count(Settlement.id).label('settlement_count')).filter(and_(*filters)).group_by(Settlement.account_date).order_by(desc(Settlement.account_date))
+        settlement_query = db.session.query(DailyFact.date, func.sum(DailyFact.sales_income).label('inc'), func.sum(DailyFact.sales_refund).label('ref'), func.sum(DailyFact.subsidy).label('sub'), func.sum(DailyFact.platform_fine).label('fine'), func.sum(DailyFact.settle_rows).label('cnt')).filter(and_(*filters)).group_by(DailyFact.date).order_by(desc(DailyFact.date))
         pagination = settlement_query.paginate(page=page, per_page=31)
-        for item in pagination.items:
-            date_obj = item.account_date
-            if shop_filter == '所有店铺': daily_stat = db.session.query(func.sum(DailyStat.total_activity).label('total_activity'), func.sum(DailyStat.total_service).label('total_service'), func.sum(DailyStat.total_ad).label('total_ad'), func.sum(DailyStat.delivery_fine).label('delivery_fine'), func.sum(DailyStat.total_cost).label('total_cost')).filter(DailyStat.date == date_obj).first()
-            else: daily_stat = DailyStat.query.filter_by(date=date_obj, shop_name=shop_filter).first()
-            ship_q = db.session.query(func.sum(Shipment.quantity).label('qty'), func.sum(Shipment.declared_price_total).label('declared'), func.sum(Shipment.cost_price_total).label('cost')).filter(Shipment.date == date_obj)
-            if shop_filter != '所有店铺': ship_q = ship_q.filter(Shipment.shop_name == shop_filter)
-            ship_stat = ship_q.first()
-            s_inc=item.total_income or 0; s_ref=abs(item.total_refund or 0); s_sub=item.total_subsidy or 0; s_fine=abs(item.total_fine or 0); s_cnt=item.settlement_count or 0
-            s_qty=ship_stat.qty or 0; s_dec=ship_stat.declared or 0
-            
-            # 手动成本
-            calc_cost = ship_stat.cost or 0.0
-            manual_cost = (daily_stat.total_cost or 0.0) if daily_stat else 0.0
-            ship_cost = manual_cost if manual_cost > 0 else calc_cost
-
-            d_ad=(daily_stat.total_ad or 0.0) if daily_stat else 0; d_srv=(daily_stat.total_service or 0.0) if daily_stat else 0; d_act=(daily_stat.total_activity or 0.0) if daily_stat else 0; d_dfine=(daily_stat.delivery_fine or 0.0) if daily_stat else 0
-            gp = s_inc - d_ad - ship_cost - d_srv - s_ref - s_sub - s_fine - d_dfine
-            
-            report_data.append({'date':date_obj, 'ship_qty':s_qty, 'ship_declared':s_dec, 'activity_price':d_act, 'activity_discount':d_act/s_dec if s_dec else 0, 'ship_cost':ship_cost, 'service_fee':d_srv, 'ad_cost':d_ad, 'settle_count':s_cnt, 'settle_count_ratio':s_cnt/s_qty if s_qty else 0, 'settle_amount':s_inc, 'settle_amount_discount':s_inc/s_dec if s_dec else 0, 'settle_amount_progress':s_inc/d_act if d_act else 0, 'consumer_refund':s_ref, 'subsidy':s_sub, 'after_sales_fine':s_fine, 'delivery_fine':d_dfine, 'gross_profit':gp, 'roi':gp/(ship_cost+d_srv) if (ship_cost+d_srv) else 0, 'declared_per_ticket':s_dec/s_qty if s_qty else 0, 'profit_per_ticket':gp/s_qty if s_qty else 0, 'discount_diff': (s_inc/s_dec - d_act/s_dec) if s_dec else 0, 'refund_rate':s_ref/s_inc if s_inc else 0, 'after_sales_rate':s_fine/s_inc if s_inc else 0, 'delivery_fine_rate':d_dfine/s_inc if s_inc else 0})
-
-    if report_data:
-        sd={'ship_qty':0,'ship_declared':0,'activity_price':0,'ship_cost':0,'service_fee':0,'ad_cost':0,'settle_count':0,'settle_amount':0,'consumer_refund':0,'subsidy':0,'after_sales_fine':0,'delivery_fine':0,'gross_profit':0}
-        for r in report_data:
-            sd['ship_qty']+=r['ship_qty']; sd['ship_declared']+=r['ship_declared']; sd['activity_price']+=r['activity_price']; sd['ship_cost']+=r['ship_cost']; sd['service_fee']+=r['service_fee']; sd['ad_cost']+=r['ad_cost']; sd['settle_count']+=r['settle_count']; sd['settle_amount']+=r['settle_amount']; sd['consumer_refund']+=r['consumer_refund']; sd['subsidy']+=r['subsidy']; sd['after_sales_fine']+=r['after_sales_fine']; sd['delivery_fine']+=r['delivery_fine']; sd['gross_profit']+=r['gross_profit']
-        summary={'date':'合计', 'is_summary':True, 'ship_qty':sd['ship_qty'], 'ship_declared':sd['ship_declared'], 'activity_price':sd['activity_price'], 'activity_discount':sd['activity_price']/sd['ship_declared'] if sd['ship_declared'] else 0, 'ship_cost':sd['ship_cost'], 'service_fee':sd['service_fee'], 'ad_cost':sd['ad_cost'], 'settle_count':sd['settle_count'], 'settle_count_ratio':sd['settle_count']/sd['ship_qty'] if sd['ship_qty'] else 0, 'settle_amount':sd['settle_amount'], 'settle_amount_discount':sd['settle_amount']/sd['ship_declared'] if sd['ship_declared'] else 0, 'settle_amount_progress':sd['settle_amount']/sd['activity_price'] if sd['activity_price'] else 0, 'consumer_refund':sd['consumer_refund'], 'subsidy':sd['subsidy'], 'after_sales_fine':sd['after_sales_fine'], 'delivery_fine':sd['delivery_fine'], 'gross_profit':sd['gross_profit'], 'roi':sd['gross_profit']/(sd['ship_cost']+sd['service_fee']) if (sd['ship_cost']+sd['service_fee']) else 0, 'declared_per_ticket':sd['ship_declared']/sd['ship_qty'] if sd['ship_qty'] else 0, 'profit_per_ticket':sd['gross_profit']/sd['ship_qty'] if sd['ship_qty'] else 0, 'discount_diff':0, 'refund_rate':sd['consumer_refund']/sd['settle_amount'] if sd['settle_amount'] else 0, 'after_sales_rate':sd['after_sales_fine']/sd['settle_amount'] if sd['settle_amount'] else 0, 'delivery_fine_rate':sd['delivery_fine']/sd['settle_amount'] if sd['settle_amount'] else 0}
-        report_data.insert(0, summary)
+        # 本页各天的手工数据和发货数据各一条分组查询，按日期对齐
+        page_dates = [item.date for item in pagination.items]
+        ship_q = db.session.query(DailyFact.date, func.sum(DailyFact.quantity).label('qty'), func.sum(DailyFact.declared).label('dec'), func.sum(DailyFact.cost).label('cost')).filter(DailyFact.date.in_(page_dates), DailyFact.ship_rows > 0)
+        if shop_filter != '所有店铺': ship_q = ship_q.filter(DailyFact.shop_name == shop_filter)
+        table = report_metrics.align(page_dates, grouped_frame(settlement_query, pagination.items), grouped_frame(ship_q.group_by(DailyFact.date)), daily_stats_by_date(page_dates, shop_filter))
+        report_data = report_metrics.settlement_rows(table)
     
     return render_template('settlement.html', title="结算明细", report_data=report_data, pagination=pagination, trend_dates=trend_dates, trend_income=trend_income, pie_data=[total_inc, abs(total_refund), abs(total_fine)], current_shop=shop_filter, selected_year=year, selected_month=month, selected_day=day)
 
@@ -430,130 +991,110 @@ def upload_settlement():
     files = request.files.getlist('file')
     shop_name = request.form.get('shop_name')
     if not files or files[0].filename == '': return redirect(url_for('settlement'))
-    
-    for file in files:
-        if file.filename == '': continue
-        
+    return job_accepted(submit_import_job('settlement', shop_name, files), 'settlement')
+
+def run_settlement_job(job):
+    """后台导入结算明细：每个文件的每个 Sheet 是一个解析任务，交给解析进程并行跑；写库仍按文件、Sheet 的原始顺序一个个来，每个文件单独提交"""
+    shop_name, work_dir = job.shop_name, job_dir(job.id)
+    todo = pending_files(job, 'settlement')
+    column_cache = get_column_cache()
+    known_layouts = column_cache.snapshot()
+    jobs, file_sheets = [], []
+    for i, file in todo:
+        path = os.path.join(work_dir, file['path'])
+        try: sheets = UploadReader(path, file['filename']).sheet_names()
+        except Exception as e: file_sheets.append(e); continue
+        file_sheets.append(len(sheets))
+        jobs += [(parse_settlement_sheet, path, file['filename'], sheet_name, shop_name, os.path.join(work_dir, f'{i}_{j}.spool'), app.config['UPLOAD_READ_CHUNK_ROWS'], known_layouts) for j, sheet_name in enumerate(sheets)]
+    parsed_sheets = zip(jobs, run_parse_jobs(jobs))
+
+    for (i, file), sheets in zip(todo, file_sheets):
+        # 先把这个文件的 Sheet 结果都取出来，这个文件失败时也不会错位到下一个文件
+        sheet_results = [] if isinstance(sheets, Exception) else [next(parsed_sheets) for _ in range(sheets)]
+        for _, (result, _) in sheet_results:
+            if result: column_cache.merge(result['column_map'])
         try:
-            upload_rec = UploadRecord(filename=file.filename, shop_name=shop_name, upload_type='settlement', row_count=0)
-            db.session.add(upload_rec)
-            db.session.commit() 
+            upload_rec = job_upload_record(job, i, 'settlement', Settlement.__table__)
         except Exception as e:
-            flash(f"文件 {file.filename} 记录创建失败: {str(e)}", 'error')
+            db.session.rollback(); job.notify(f"文件 {file['filename']} 记录创建失败: {str(e)}", 'error'); db.session.commit()
             continue
 
+        writer = ChunkedWriter(Settlement.__table__, ignore_conflicts=True, fact_date='account_date')
+        progress = FileProgress(job, i, writer, sum(r['rows'] for _, (r, _) in sheet_results if r))
         try:
-            def process_df(df, upload_rec_id, filename):
-                if find_column(df.columns, ['交易类型']):
-                    return process_trans(df, upload_rec_id)
-                elif find_column(df.columns, ['违规ID', '违规编号']):
-                    return process_fine(df, upload_rec_id)
-                else:
-                    return 0
-
-            def process_trans(df, upload_rec_id):
-                count = 0
-                col_order = find_column(df.columns, ['备货单号', '订单号', 'order_no'])
-                col_sku = find_column(df.columns, ['SKUID', 'SKU ID'])
-                col_type = find_column(df.columns, ['交易类型'])
-                # [核心修复] 优先匹配 '金额' 而不是 '单品券金额'
-                col_amount = find_column(df.columns, ['金额', '发生金额'])
-                if not col_amount: col_amount = find_column(df.columns, ['金额']) # 再次尝试
-
-                if not col_order or not col_sku or not col_type or not col_amount:
-                    return 0
-                
-                for index, row in df.iterrows():
-                    order_no = str(row[col_order]).strip() if col_order else ''
-                    trans_type = str(row[col_type]).strip() if col_type else ''
-                    amount = pd.to_numeric(row[col_amount], errors='coerce')
-                    if pd.isna(amount): amount = 0.0
-
-                    sku_val = str(row[col_sku]) if col_sku and pd.notna(row[col_sku]) else ''
-                    acc_date = extract_date_from_order(order_no)
-                    
-                    exists = Settlement.query.filter_by(sku_id=sku_val, account_date=acc_date, trans_type=trans_type, order_no=order_no, amount=amount).first()
-                    if exists: continue
-                    s_income=0; s_refund=0; s_subsidy=0
-                    if '售后' in trans_type or '冲回' in trans_type: s_refund = amount
-                    elif '补贴' in trans_type: s_subsidy = amount
-                    else: s_income = amount
-                    new_rec = Settlement(shop_name=shop_name, order_no=order_no, sku_id=sku_val, account_date=acc_date, trans_type=trans_type, amount=amount, sales_income=s_income, sales_refund=s_refund, subsidy=s_subsidy, platform_fine=0, upload_id=upload_rec_id)
-                    db.session.add(new_rec)
-                    count += 1
-                return count
-
-            def process_fine(df, upload_rec_id):
-                count = 0
-                col_vid = find_column(df.columns, ['违规ID', '违规编号'])
-                col_sku_f = find_column(df.columns, ['SKUID'])
-                col_amt_f = find_column(df.columns, ['赔付金额', '扣款金额'])
-                col_date_f = find_column(df.columns, ['账务时间'])
-                if not col_vid or not col_amt_f or not col_date_f:
-                     return 0
-                for index, row in df.iterrows():
-                    vid = str(row[col_vid]).strip()
-                    if Settlement.query.filter_by(violation_id=vid).first(): continue
-                    amt = pd.to_numeric(row[col_amt_f], errors='coerce')
-                    if pd.isna(amt): amt = 0.0
-                    try: acc_date = pd.to_datetime(row[col_date_f], errors='coerce').date()
-                    except: acc_date = date.today()
-                    sku_val = str(row[col_sku_f]) if col_sku_f and pd.notna(row[col_sku_f]) else ''
-                    new_rec = Settlement(shop_name=shop_name, violation_id=vid, sku_id=sku_val, account_date=acc_date, trans_type='售后罚款', amount=amt, platform_fine=amt, upload_id=upload_rec_id)
-                    db.session.add(new_rec)
-                    count += 1
-                return count
-            
-            # 读取文件
-            total_rows_processed = 0
-            if file.filename.endswith('.csv'):
-                file_content = file.read()
-                try: df = pd.read_csv(StringIO(file_content.decode('utf-8-sig')))
-                except: 
-                    try: df = pd.read_csv(StringIO(file_content.decode('gbk')))
-                    except: df = pd.read_csv(StringIO(file_content.decode('gb18030')))
-                total_rows_processed = process_df(df, upload_rec.id, file.filename)
-            else:
-                # 遍历所有 Sheet
-                file.seek(0)
-                excel_file = pd.ExcelFile(file)
-                for sheet_name in excel_file.sheet_names:
-                    try:
-                        df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                        total_rows_processed += process_df(df, upload_rec.id, file.filename)
-                    except: pass
-            
+            if isinstance(sheets, Exception): raise sheets
+            backend, parse_seconds, skipped_sheets = None, 0.0, 0
+            for (_, _, _, sheet_name, _, spool, _, _), (result, error) in sheet_results:
+                # CSV 只有一张表，读不出来直接报错；Excel 单个 Sheet 读坏了跳过
+                if error:
+                    if file['filename'].lower().endswith('.csv'): raise error
+                    continue
+                backend, parse_seconds = result['backend'] or backend, parse_seconds + result['parse_seconds']
+                if not result['batches']: continue
+                # 只认还在的上传记录：没失败，而且它导入的结算行还在库里（记录号被重新用过的旧 Sheet 不算）
+                dup = db.session.query(UploadSheet).join(UploadRecord, UploadSheet.upload_id == UploadRecord.id).filter(
+                    UploadRecord.shop_name == shop_name, UploadRecord.upload_type == 'settlement', UploadRecord.id != upload_rec.id, UploadRecord.row_count >= 0,
+                    UploadSheet.content_hash == result['content_hash'], db.session.query(Settlement.id).filter(Settlement.upload_id == UploadSheet.upload_id).exists()).first()
+                if dup:
+                    skipped_sheets += 1; progress.update(result['rows'])
+                    job.notify(f"文件 {file['filename']} 的 Sheet「{sheet_name}」与上传记录 #{dup.upload_id} 的 Sheet「{dup.sheet_name}」内容相同，已跳过", 'info')
+                    continue
+                written = writer.written
+                for out in read_spool(spool, result['batches']):
+                    out['upload_id'] = upload_rec.id
+                    writer.extend(out.to_dict('records'))
+                    progress.update(len(out))
+                writer.flush()
+                db.session.add(UploadSheet(upload_id=upload_rec.id, sheet_name=sheet_name, content_hash=result['content_hash'], row_count=writer.written - written))
+            total_rows_processed = writer.written
+            if writer.failed: job.notify(f"文件 {file['filename']} 有 {writer.failed} 行写入失败: {writer.errors[0]}", 'error')
+
+            upload_rec.reader_backend, upload_rec.parse_seconds = backend, parse_seconds
             if total_rows_processed > 0:
                 upload_rec.row_count = total_rows_processed
-                db.session.commit()
-                flash(f"文件 {file.filename} 上传成功，新增 {total_rows_processed} 条记录。", 'success')
+                job.notify(f"文件 {file['filename']} 上传成功，新增 {total_rows_processed} 条记录。", 'success')
+            elif skipped_sheets:
+                upload_rec.row_count = 0
+                job.notify(f"文件 {file['filename']} 的 Sheet 都已导入过，没有新数据。", 'info')
             else:
                 upload_rec.row_count = -1
-                db.session.commit()
-                flash(f"文件 {file.filename} 解析失败或无有效数据。", 'error')
+                job.notify(f"文件 {file['filename']} 解析失败或无有效数据。", 'error')
                 
         except Exception as e:
             db.session.rollback()
             rec = db.session.get(UploadRecord, upload_rec.id)
-            if rec:
-                rec.row_count = -1 
-                db.session.commit()
-            flash(f"文件 {file.filename} 处理失败: {str(e)}", 'error')
-            
-    return redirect(url_for('settlement'))
+            if rec: rec.row_count = writer.written or -1
+            job.notify(f"文件 {file['filename']} 处理失败: {str(e)}", 'error')
+        refresh_daily_facts(writer.touched)  # 出错时已提交的块也要算进去
+        progress.finish()
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = db.session.get(ImportJob, job_id)
+    if job is None: return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.before_request
+def ensure_job_workers():
+    start_job_workers()
 
 # ... (files, delete_file, product, update_product_price, search, clear_data 保持不变) ...
 @app.route('/files')
 def files():
     records = UploadRecord.query.order_by(UploadRecord.upload_date.desc()).all()
-    return render_template('files.html', title="文件管理", records=records)
+    jobs = ImportJob.query.order_by(ImportJob.id.desc()).limit(10).all()
+    column_cache = get_column_cache()
+    return render_template('files.html', title="文件管理", records=records, jobs=jobs, sku_filter_stats=get_sku_filter().stats(), column_stats=column_cache.stats(), column_layouts=column_cache.layouts(), page_cache_stats=get_page_cache().stats())
 
 @app.route('/files/delete/<int:record_id>', methods=['POST'])
 def delete_file(record_id):
     record = UploadRecord.query.get_or_404(record_id)
     try:
+        keys = upload_fact_keys(record.upload_type, record.id) if record.upload_type in ('shipment', 'settlement') else set()
         if record.upload_type == 'shipment': Shipment.query.filter_by(upload_id=record.id).delete()
         elif record.upload_type == 'settlement': Settlement.query.filter_by(upload_id=record.id).delete()
+        refresh_daily_facts(keys)
+        UploadSheet.query.filter_by(upload_id=record.id).delete()
         db.session.delete(record); db.session.commit()
         return jsonify({'status': 'success', 'msg': '删除成功'})
     except Exception as e: db.session.rollback(); return jsonify({'status': 'error', 'msg': str(e)})
@@ -621,6 +1162,7 @@ def update_product_price():
             for s in related:
                 if data.get('field') == 'declared_price': s.declared_price_total = s.quantity * val
                 elif data.get('field') == 'cost_price': s.cost_price_total = s.quantity * val
+            db.session.flush(); refresh_daily_facts({(s.shop_name, s.date) for s in related})
             db.session.commit()
             return jsonify({'status': 'success'})
         return jsonify({'status': 'error'})
@@ -644,16 +1186,22 @@ def clear_data():
 
         db.session.query(Shipment).delete()
         db.session.query(Settlement).delete()
+        db.session.query(DailyFact).delete()
         db.session.query(Product).delete()
         db.session.query(DailyStat).delete()
+        db.session.query(UploadSheet).delete()
         db.session.query(UploadRecord).delete()
+        db.session.query(ImportJob).filter(ImportJob.status.in_(('done', 'failed'))).delete()
         db.session.commit()
+        rebuild_sku_filter()
         return jsonify({'status': 'success', 'msg': '已清空'})
     except Exception as e: return jsonify({'status': 'error', 'msg': str(e)})
 
 if __name__ == '__main__':
-    if not os.path.exists('weijing.db'):
-        with app.app_context(): db.create_all()
+    with app.app_context():
+        db.create_all(); upgrade_schema()
+    # debug 模式下外层进程只负责监控文件改动，导入线程只在真正处理请求的子进程里启动（顺带续跑重启前没完成的任务）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true': start_job_workers()
     
     import socket
     try:
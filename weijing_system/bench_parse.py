@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# 发货明细解析测速：发货明细表格样本放大到 N 行（默认 10 万行），再掺进一些边角写法（带 / 前缀、",N 件"、空备货单、'-' 商品名、
+# 文字件数），分别用原来 upload_shipment 里 iterrows 的逐行解析和现在的 parse_shipment_frame 解析，核对结果逐行一致并输出耗时。
+# 用法: python bench_parse.py [行数]
+import os
+import sys
+import re
+import time
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+
+def make_frame(rows):
+    from bench_stream import sample_rows
+    df = pd.concat(list(sample_rows(rows)), ignore_index=True)
+    rng = np.random.default_rng(1)
+    pick = lambda share: rng.random(rows) < share
+    order = df['备货单'].astype(object)
+    mask = pick(0.05); order[mask] = 'X/' + order[mask]
+    mask = pick(0.05); order[mask] = order[mask].str.replace('，', ',', regex=False).str.replace('件', ' 件', regex=False)
+    order[pick(0.02)] = np.nan  # 合并单元格拆开后的空备货单，向下填充
+    df['备货单'] = order
+    df.loc[pick(0.03), '定制SKU'] = np.nan
+    df.loc[pick(0.03), '商品名称'] = '-'
+    df['总发货件数'] = pd.Series(rng.choice([None, 2, 3.0, '4件', 'abc'], rows), dtype=object)
+    return df
+
+
+def legacy_parse(df, cols):
+    """原来 upload_shipment 里的逐行解析（去掉写库部分）：每行返回 (备货单号, 定制SKU, 日期, SPU, SKC, 商品名, 属性集, 件数)"""
+    from app import clean_quantity, extract_date_from_order
+    col_order, col_custom_sku, col_name, col_qty = cols['order'], cols['custom_sku'], cols['name'], cols['qty']
+    col_spu, col_skc, col_specs = cols['spu'], cols['skc'], cols['specs']
+    out = []
+    for index, row in df.iterrows():
+        raw_order_str = str(row[col_order]).strip()
+        if '/' in raw_order_str: raw_order_str = raw_order_str.split('/')[-1].strip()
+        qty_val = 1; order_no = raw_order_str
+        qty_match = re.search(r'[，,]\s*(\d+)\s*件', raw_order_str)
+        if qty_match:
+            try: qty_val = int(qty_match.group(1)); order_no = re.split(r'[，,]', raw_order_str)[0].strip()
+            except: qty_val = 1
+        if col_qty and pd.notna(row[col_qty]): qty_val = clean_quantity(row[col_qty])
+        custom_sku_val = None
+        if col_custom_sku and pd.notna(row[col_custom_sku]): raw_sku = str(row[col_custom_sku]).strip(); custom_sku_val = raw_sku if raw_sku and raw_sku != '-' and raw_sku.lower() != 'nan' else None
+        goods_name = str(row[col_name]).strip() if col_name and pd.notna(row[col_name]) else ''
+        if not custom_sku_val:
+            if not goods_name or goods_name == '-' or goods_name.lower() == 'nan': continue
+        spu_val = str(row[col_spu]) if col_spu and pd.notna(row[col_spu]) else ''
+        skc_val = str(row[col_skc]) if col_skc and pd.notna(row[col_skc]) else ''
+        specs_val = str(row[col_specs]) if col_specs and pd.notna(row[col_specs]) else ''
+        out.append((order_no, custom_sku_val, extract_date_from_order(order_no), spu_val, skc_val, goods_name, specs_val, qty_val))
+    return out
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {elapsed:.2f}s")
+    return result, elapsed
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    import app
+    from column_map import ColumnMapCache
+    df = make_frame(rows)
+    cols = ColumnMapCache().resolve('shipment', df.columns, app.SHIPMENT_FIELDS)
+    df[cols['order']] = df[cols['order']].ffill()
+    print(f"📊 发货明细 {rows} 行")
+
+    expected, legacy = timed("iterrows 逐行解析", legacy_parse, df, cols)
+    parsed, current = timed("parse_shipment_frame 整列解析", app.parse_shipment_frame, df, cols['order'], cols['custom_sku'], cols['name'], cols['qty'], cols['spu'], cols['skc'], cols['specs'])
+    got = list(parsed[['order_no', 'custom_sku', 'date', 'spu_id', 'skc_id', 'goods_name', 'specs', 'quantity']].itertuples(index=False, name=None))
+    same = got == expected
+    print(f"  保留 {len(got)} 行，结果一致: {'是' if same else '否'}，{legacy / current:.1f} 倍")
+    if not same: raise SystemExit("整列解析与逐行解析结果不一致")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# 上传文件解析后端对比：发货明细表格样本放大成几种行数（默认 10 万、25 万、50 万行），分别存成 xlsx 和 csv，
+# 每个后端都强制指定（不走自动选择，超过 CALAMINE_MAX_BYTES 的 xlsx 也用 calamine 读），各在单独的进程里按块读完整个文件，
+# 输出耗时和读取期间内存峰值的增量，用来核对 CALAMINE_MAX_BYTES 定在哪里合适；同时核对各后端读出的内容与 pd.read_excel / pd.read_csv 整表读取一致。
+# 用法: python bench_readers.py [行数,行数,...] [每块行数]    生成的文件留在临时目录里
+import os
+import sys
+import time
+import resource
+import tempfile
+import multiprocessing
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, os.pardir, 'common'))
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def digest(frames):
+    """逐块累加的内容摘要和行数，不把整张表拼起来；摘要里带上各块的列名和类型，块与块的类型不一致时也比得出来"""
+    total, rows, schemas = 0, 0, set()
+    for df in frames:
+        total += int(pd.util.hash_pandas_object(df, index=False).sum())
+        schemas.add(repr(list(zip(df.columns, map(str, df.dtypes)))))
+        rows += len(df)
+    return (total & (2 ** 64 - 1), sorted(schemas)), rows
+
+
+def read_in_child(path, backend, chunk_rows):
+    """在新进程里读整个文件：backend 为 None 时用 pandas 整表读取（xlsx 用 openpyxl 引擎），否则用 UploadReader 强制指定这个后端按块读取。
+    返回 (实际用的后端, 摘要, 行数, 耗时, 读取期间内存峰值的增量MB)"""
+    from readers import UploadReader
+    before = peak_mb()
+    start = time.perf_counter()
+    if backend is None: reader, frames = None, [pd.read_excel(path, engine='openpyxl') if path.endswith('.xlsx') else pd.read_csv(path)]
+    else: reader = UploadReader(path, os.path.basename(path), chunk_rows, backends=[backend]); frames = reader.chunks()
+    value, rows = digest(frames)
+    return reader and reader.backend, value, rows, time.perf_counter() - start, peak_mb() - before
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [100000, 250000, 500000]
+    chunk_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    from bench_stream import make_shipments
+    from readers import BACKENDS, CALAMINE_MAX_BYTES
+    work_dir = tempfile.mkdtemp(prefix='bench_readers_')
+    mismatched = []
+    print(f"CALAMINE_MAX_BYTES = {CALAMINE_MAX_BYTES / 1024 / 1024:.0f}MB，每块 {chunk_rows} 行")
+    for rows in sizes:
+        for ext in ('xlsx', 'csv'):
+            path = os.path.join(work_dir, f'shipments_{rows}.{ext}')
+            make_shipments(path, rows)
+            print(f"📊 {ext}：{rows} 行，{os.path.getsize(path) / 1024 / 1024:.1f}MB")
+            expected = None
+            for backend in [None] + BACKENDS['.' + ext][::-1]:
+                label = f"pd.read_{'excel' if ext == 'xlsx' else 'csv'} 整表" if backend is None else f"UploadReader {backend}"
+                # 每次读取单独起一个进程，内存峰值互不影响
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    used, value, got_rows, seconds, growth = pool.apply(read_in_child, (path, backend, chunk_rows))
+                if used != backend: raise SystemExit(f"{backend} 不可用，实际用的是 {used}")
+                print(f"  {label:<24}{seconds:8.2f}s  {got_rows / seconds:>10,.0f} 行/秒  内存 +{growth:.0f}MB")
+                if expected is None: expected = value  # pandas 整表读取为准
+                elif value != expected or got_rows != rows: mismatched.append(f"{rows}/{ext}/{backend}")
+    print(f"临时目录: {work_dir}")
+    if mismatched: raise SystemExit(f"按块读取与整表读取不一致: {', '.join(mismatched)}")
+    print("✅ 各后端按块读取的结果与整表读取一致")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# 大文件流式导入的内存测试：把仓库里的发货明细表格样本放大成 N 行（默认 100 万行）的 xlsx，
+# 在单独的进程里按块解析（与后台导入任务的解析步骤相同，parse_shipment_upload），输出耗时和解析期间内存峰值的增量，
+# 增量超过上限时以非 0 退出——内存应当只跟块大小有关，与文件行数无关。
+# 用法: python bench_stream.py [行数] [内存上限MB] [每块行数]    生成的文件留在临时目录里
+import os
+import sys
+import time
+import resource
+import tempfile
+import multiprocessing
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+SAMPLE = os.path.join(HERE, '..', '发货明细表格样本.xlsx')
+
+
+def sample_rows(rows, seed=0):
+    """样本表逐块放大：备货单号、定制SKU 换成不重复的，发货日期铺在最近 90 天里，件数 1~3；逐块产出 DataFrame"""
+    sample = pd.read_excel(SAMPLE)
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, 10000):
+        n = min(10000, rows - start)
+        df = sample.iloc[np.arange(start, start + n) % len(sample)].reset_index(drop=True)
+        days = [(date(2025, 12, 31) - timedelta(days=int(d))).strftime('%y%m%d') for d in rng.integers(0, 90, n)]
+        df['备货单'] = [f"WB{d}{start + i:07d}，{q}件" for i, (d, q) in enumerate(zip(days, rng.integers(1, 4, n)))]
+        df['定制SKU'] = np.arange(start, start + n, dtype=np.float64) + 8.9e13
+        yield df
+
+
+def make_shipments(path, rows):
+    """放大后的样本写成 xlsx（openpyxl 只写模式，不在内存里攒整张表）或 csv"""
+    if path.endswith('.csv'):
+        for i, df in enumerate(sample_rows(rows)): df.to_csv(path, mode='a', header=i == 0, index=False, encoding='utf-8-sig')
+        return
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    for i, df in enumerate(sample_rows(rows)):
+        if i == 0: ws.append(list(df.columns))
+        for row in df.itertuples(index=False): ws.append([None if isinstance(v, float) and np.isnan(v) else v for v in row])
+    wb.save(path)
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_in_child(path, spool, chunk_rows):
+    """在新进程里导入 app 后记下内存峰值，再按块解析整个文件；返回 (解析结果, 耗时, 导入 app 后的峰值MB, 解析后的峰值MB)"""
+    import app
+    before = peak_mb()
+    start = time.perf_counter()
+    result = app.parse_shipment_upload(path, os.path.basename(path), spool, chunk_rows, {})
+    return result, time.perf_counter() - start, before, peak_mb()
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    ceiling = float(sys.argv[2]) if len(sys.argv) > 2 else 256
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    work_dir = tempfile.mkdtemp(prefix='bench_stream_')
+    path = os.path.join(work_dir, 'shipments.xlsx')
+    print(f"📝 生成 {rows} 行发货明细: {path}")
+    start = time.perf_counter()
+    make_shipments(path, rows)
+    print(f"  {os.path.getsize(path) / 1024 / 1024:.0f}MB，用时 {time.perf_counter() - start:.1f}s")
+
+    print(f"📥 按每块 {chunk_rows} 行解析")
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        result, seconds, before, after = pool.apply(parse_in_child, (path, os.path.join(work_dir, 'shipments.spool'), chunk_rows))
+    growth = after - before
+    print(f"  {result['rows']} 行，{result['batches']} 块，{result['backend']} 解析 {seconds:.1f}s（{result['rows'] / seconds:,.0f} 行/秒）")
+    print(f"  内存峰值 {after:.0f}MB，解析期间增加 {growth:.0f}MB（上限 {ceiling:.0f}MB）")
+    print(f"临时目录: {work_dir}")
+    if result['rows'] != rows: raise SystemExit(f"解析出 {result['rows']} 行，应为 {rows} 行")
+    if growth > ceiling: raise SystemExit(f"解析期间内存增加 {growth:.0f}MB，超过上限 {ceiling:.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# 页面缓存：首页和报表页读得多、数据改得少（上传、改价、录日数据、删文件时才变），
+# 渲染好的页面按 (页面, 参数, 当天, 数据版本) 存在内存里，按最近使用排序，总字节数超过上限时从最久没用的开始淘汰
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    """entries: key -> (etag, body)，key 的最后一项是数据版本。
+    数据版本只增不减：存进新版本的页面时旧版本的全部丢掉（再也不会命中），比当前版本旧的页面不存。
+    渲染期间数据又变了的页面由调用方（app.cached_page）渲染完比对数据版本后不存"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.version = None
+        self.bytes = 0
+        self.hits = self.misses = self.not_modified = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None: self.misses += 1; return None
+            self.entries.move_to_end(key); self.hits += 1
+            return entry
+
+    def put(self, key, etag, body):
+        version = key[-1]
+        if len(body) > self.max_bytes: return
+        with self.lock:
+            if self.version is not None and version < self.version: return
+            if version != self.version: self.entries.clear(); self.bytes = 0; self.version = version
+            old = self.entries.pop(key, None)
+            if old is not None: self.bytes -= len(old[1])
+            self.entries[key] = (etag, body); self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.bytes -= len(dropped); self.evictions += 1
+
+    def count_not_modified(self):
+        with self.lock: self.not_modified += 1
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {'entries': len(self.entries), 'size_kb': self.bytes / 1024, 'max_kb': self.max_bytes / 1024, 'version': self.version,
+                'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / requests if requests else None,
+                'not_modified': self.not_modified, 'evictions': self.evictions}
@@ -0,0 +1,74 @@
+# 报表指标：发货明细、结算明细两张报表的毛利、ROI、各项比率、客单和"合计"行，整列计算。
+# 路由把发货 / DailyStat / 结算三路按日期（或月份）分组好的结果交进来，列名统一用下面的短名：
+#   发货   qty 件数  dec 申报价  cost 成本
+#   日数据 act 活动价  srv 服务费  ad 广告  dfine 发货罚款  manual_cost 手工成本（大于 0 时顶替发货成本）
+#   结算   inc 销售收入  ref 退款  sub 补贴  fine 平台罚款  cnt 结算笔数
+# 这里按键对齐、缺的补 0；比率分母为 0 时记 0（同原来的 `a/b if b else 0`）；
+# 合计行按报表行的顺序依次累加（cumsum 与逐行 += 的结果逐位相同），毛利合计是各行毛利之和而不是重算。
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['qty', 'dec', 'cost', 'act', 'srv', 'ad', 'dfine', 'manual_cost', 'inc', 'ref', 'sub', 'fine', 'cnt']
+COUNTS = ['qty', 'cnt']
+SHIPMENT_FIELDS = {'qty': 'total_quantity', 'dec': 'total_declared', 'cost': 'total_cost', 'srv': 'total_service', 'act': 'total_activity', 'fine': 'total_fine', 'ref': 'total_refund', 'ad': 'total_ad', 'gp': 'gross_profit'}
+SETTLEMENT_FIELDS = {'qty': 'ship_qty', 'dec': 'ship_declared', 'act': 'activity_price', 'cost': 'ship_cost', 'srv': 'service_fee', 'ad': 'ad_cost', 'cnt': 'settle_count', 'inc': 'settle_amount', 'ref': 'consumer_refund', 'sub': 'subsidy', 'fine': 'after_sales_fine', 'dfine': 'delivery_fine', 'gp': 'gross_profit'}
+
+
+def align(keys, *frames):
+    """按 keys 的顺序把几路分组结果（以日期或月份为索引）拼成一张表，缺的补 0；件数、笔数为整数，其余为浮点"""
+    index = pd.Index(list(keys), dtype=object)
+    columns = {}
+    for frame in frames:
+        frame = frame.reindex(index)
+        for c in frame.columns: columns[c] = frame[c].to_numpy(dtype=float, na_value=0)
+    return pd.DataFrame({c: columns.get(c, np.zeros(len(index))).astype('int64' if c in COUNTS else float) for c in COLUMNS}, index=index)
+
+
+def _ratio(num, den):
+    return np.divide(num, den, out=np.zeros(len(num)), where=den != 0)
+
+
+def _columns_with_summary(t, fields):
+    """各列首位插入合计行：fields 各列按行序累加，其余列合计行记 0"""
+    return {c: np.concatenate([[(v.sum() if c in COUNTS else np.cumsum(v)[-1]) if c in fields else 0], v]) for c, v in t.items()}
+
+
+def _records(table, t, fields, metrics):
+    names = ['date', 'is_summary'] + [fields[c] for c in fields] + list(metrics)
+    columns = [['合计'] + table.index.tolist(), [True] + [False] * len(table)] + [t[c].tolist() for c in fields] + [v.tolist() for v in metrics.values()]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def _base(table):
+    t = {c: table[c].to_numpy() for c in table.columns}
+    t['cost'] = np.where(t['manual_cost'] > 0, t['manual_cost'], t['cost'])
+    t['ref'] = np.abs(t['ref'])
+    return t
+
+
+def shipment_rows(table):
+    """发货明细的行（合计在最前），table 为空时返回 []"""
+    if table.empty: return []
+    t = _base(table)
+    t['gp'] = t['act'] - t['cost'] - t['srv'] - t['fine'] - t['ref'] - t['ad']
+    t = _columns_with_summary(t, SHIPMENT_FIELDS)
+    return _records(table, t, SHIPMENT_FIELDS, {
+        'roi': _ratio(t['gp'], t['cost']), 'declared_per_ticket': _ratio(t['dec'], t['qty']), 'profit_per_ticket': _ratio(t['gp'], t['qty']),
+        'refund_rate': _ratio(t['ref'], t['act']), 'ad_sales_ratio': _ratio(t['ad'], t['act']), 'ad_profit_ratio': _ratio(t['ad'], t['gp']),
+        'cost_sales_ratio': _ratio(t['cost'], t['act']), 'sales_profit_rate': _ratio(t['gp'], t['act']), 'actual_discount_rate': _ratio(t['act'], t['dec'])})
+
+
+def settlement_rows(table, discount_diff=True):
+    """结算明细的行（合计在最前），table 为空时返回 []；折差只在日报的逐日行上算，月报和合计行记 0"""
+    if table.empty: return []
+    t = _base(table)
+    t['fine'] = np.abs(t['fine'])
+    t['gp'] = t['inc'] - t['ad'] - t['cost'] - t['srv'] - t['ref'] - t['sub'] - t['fine'] - t['dfine']
+    t = _columns_with_summary(t, SETTLEMENT_FIELDS)
+    diff = _ratio(t['inc'], t['dec']) - _ratio(t['act'], t['dec']) if discount_diff else np.zeros(len(t['gp']))
+    diff[0] = 0
+    return _records(table, t, SETTLEMENT_FIELDS, {
+        'activity_discount': _ratio(t['act'], t['dec']), 'settle_count_ratio': _ratio(t['cnt'], t['qty']), 'settle_amount_discount': _ratio(t['inc'], t['dec']),
+        'settle_amount_progress': _ratio(t['inc'], t['act']), 'roi': _ratio(t['gp'], t['cost'] + t['srv']), 'declared_per_ticket': _ratio(t['dec'], t['qty']),
+        'profit_per_ticket': _ratio(t['gp'], t['qty']), 'discount_diff': diff, 'refund_rate': _ratio(t['ref'], t['inc']),
+        'after_sales_rate': _ratio(t['fine'], t['inc']), 'delivery_fine_rate': _ratio(t['dfine'], t['inc'])})
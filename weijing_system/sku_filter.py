@@ -0,0 +1,83 @@
+# 定制SKU 布隆过滤器：上传发货明细时先问过滤器，只有"可能存在"的 SKU 才去查库
+import hashlib
+import json
+import math
+import os
+import threading
+
+
+class SkuBloomFilter:
+    def __init__(self, capacity=100000, error_rate=0.001):
+        self.capacity = max(int(capacity), 1000)
+        self.error_rate = error_rate
+        self.num_bits = int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.bits_set = 0  # 置 1 的位数，add 时累加，stats 算填充率不用每次数一遍整个位数组
+        # 运行统计：probes 查询次数，maybe 判定"可能存在"次数，confirmed 查库后确实存在次数
+        self.probes = self.maybe = self.confirmed = 0
+        self.lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        with self.lock:
+            for p in self._positions(key):
+                mask = 1 << (p & 7)
+                if not self.bits[p >> 3] & mask: self.bits[p >> 3] |= mask; self.bits_set += 1
+            self.count += 1
+
+    def might_contain(self, key):
+        hit = all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+        self.probes += 1
+        if hit: self.maybe += 1
+        return hit
+
+    def record_confirmed(self):
+        self.confirmed += 1
+
+    @property
+    def is_full(self):
+        return self.count > self.capacity
+
+    def stats(self):
+        fill = self.bits_set / self.num_bits
+        negatives = self.probes - self.confirmed
+        return {
+            'count': self.count, 'capacity': self.capacity, 'size_kb': len(self.bits) / 1024,
+            'probes': self.probes, 'maybe': self.maybe, 'confirmed': self.confirmed,
+            'observed_fp_rate': (self.maybe - self.confirmed) / negatives if negatives > 0 else 0.0,
+            'estimated_fp_rate': fill ** self.num_hashes,
+        }
+
+    def save(self, path):
+        header = {'capacity': self.capacity, 'error_rate': self.error_rate, 'count': self.count, 'probes': self.probes, 'maybe': self.maybe, 'confirmed': self.confirmed}
+        tmp = path + '.tmp'
+        with self.lock, open(tmp, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            bf = cls(header['capacity'], header['error_rate'])
+            bits = f.read()
+        if len(bits) != len(bf.bits): raise ValueError('布隆过滤器文件损坏')
+        bf.bits = bytearray(bits)
+        bf.bits_set = int.from_bytes(bits, 'little').bit_count()
+        bf.count, bf.probes, bf.maybe, bf.confirmed = header['count'], header['probes'], header['maybe'], header['confirmed']
+        return bf
+
+    @classmethod
+    def build(cls, keys, expected=0):
+        keys = list(keys)
+        bf = cls(capacity=max(expected, len(keys)) * 2)
+        for k in keys: bf.add(k)
+        return bf
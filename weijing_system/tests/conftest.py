@@ -0,0 +1,58 @@
+# weijing_system 的测试：instance 目录（库文件、列映射、布隆过滤器）指到临时目录，每个测试开始时重建空库
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+import pytest
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 库地址在导入 app 时就定了，先把 instance 目录指到临时目录，别碰 instance/weijing.db
+os.environ['WEIJING_INSTANCE_PATH'] = tempfile.mkdtemp(prefix='weijing_test_')
+sys.path.insert(0, HERE)
+# settlement-tracker 也有 app 模块，两边的测试一起跑时各自导入自己的
+for name in ('app', 'database', 'web_app'):
+    sys.modules.pop(name, None)
+import app as weijing_app
+
+
+@pytest.fixture(autouse=True)
+def weijing_module(monkeypatch):
+    # 按名字导入 app 的地方（bench 脚本里的函数等）拿到的是这边的 app
+    monkeypatch.setitem(sys.modules, 'app', weijing_app)
+
+
+@pytest.fixture
+def weijing(monkeypatch):
+    """空库 + 干净的进程内状态；不起后台导入线程、不开解析进程池，测试里直接调 run_import_job"""
+    monkeypatch.setitem(weijing_app.app.config, 'UPLOAD_PARSE_WORKERS', 1)
+    monkeypatch.setattr(weijing_app, '_job_threads', [None])
+    for name in ('_page_cache', '_sku_filter', '_column_cache'):
+        monkeypatch.setattr(weijing_app, name, None)
+    for name in ('custom_sku.bloom', 'column_maps.json'):
+        path = os.path.join(weijing_app.app.instance_path, name)
+        if os.path.exists(path): os.remove(path)
+    with weijing_app.app.app_context():
+        weijing_app.db.drop_all(); weijing_app.db.create_all(); weijing_app.upgrade_schema()
+        yield weijing_app
+        weijing_app.db.session.remove()
+
+
+# 报表测试用的数据：2024 年只有 6 月的 3 天，2025 年有 2 月的 3 天和 3 月起的每一天
+REPORT_DAYS = [date(2024, 6, d) for d in (1, 2, 3)] + [date(2025, 2, d) for d in (3, 4, 5)] + [date(2025, 3, 1) + timedelta(days=i) for i in range(306)]
+REPORT_SHOPS = ('维鲸', '鲸选')
+
+
+@pytest.fixture
+def reports(weijing):
+    """REPORT_DAYS 的每一天、每个店铺各一条发货、一条结算和一条日数据，daily_facts 整表重建"""
+    shipments, settlements, stats = [], [], []
+    for i, d in enumerate(REPORT_DAYS):
+        for shop in REPORT_SHOPS:
+            shipments.append({'shop_name': shop, 'order_no': f"WB{d:%y%m%d}{i:04d}", 'custom_sku': f"{shop}-{d}", 'date': d, 'quantity': 2, 'declared_price_total': 30.0, 'cost_price_total': 12.0})
+            settlements.append({'shop_name': shop, 'order_no': f"PO-{shop}-{d}", 'sku_id': '1001', 'account_date': d, 'amount': 25.0, 'sales_income': 25.0, 'sales_refund': -3.0, 'subsidy': 1.0, 'platform_fine': -0.5, 'trans_type': '销售回款', 'natural_key': f"{shop}-{d}"})
+            stats.append({'shop_name': shop, 'date': d, 'total_activity': 5.0, 'total_service': 1.0, 'total_ad': 2.0, 'delivery_fine': 0.0})
+    weijing.db.session.execute(weijing.Shipment.__table__.insert(), shipments)
+    weijing.db.session.execute(weijing.Settlement.__table__.insert(), settlements)
+    weijing.db.session.execute(weijing.DailyStat.__table__.insert(), stats)
+    weijing.rebuild_daily_facts(); weijing.db.session.commit()
+    return weijing
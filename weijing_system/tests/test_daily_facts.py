@@ -0,0 +1,82 @@
+from datetime import date
+
+DAYS = [date(2025, 3, d) for d in range(1, 7)]
+
+
+def add_upload(weijing, upload_type, shop_name, days, tag):
+    """一个上传记录和它写入的发货 / 结算行：days 里每天两条 -> 上传记录号"""
+    rec = weijing.UploadRecord(filename=f"{tag}.xlsx", shop_name=shop_name, upload_type=upload_type, row_count=2 * len(days))
+    weijing.db.session.add(rec); weijing.db.session.flush()
+    if upload_type == 'shipment':
+        rows = [{'shop_name': shop_name, 'order_no': f"WB{d:%y%m%d}{i}", 'custom_sku': f"{tag}-{d}-{i}", 'date': d, 'quantity': i + 1, 'declared_price_total': 10.5 * (i + 1), 'cost_price_total': 4.25, 'upload_id': rec.id} for d in days for i in range(2)]
+        weijing.db.session.execute(weijing.Shipment.__table__.insert(), rows)
+    else:
+        rows = [{'shop_name': shop_name, 'order_no': f"PO-{tag}-{d}-{i}", 'sku_id': '1001', 'account_date': d, 'amount': 20.0, 'sales_income': 20.0, 'sales_refund': -2.5 * i, 'subsidy': 0.5, 'platform_fine': -1.0 * i, 'trans_type': '销售回款', 'natural_key': f"{tag}-{d}-{i}", 'upload_id': rec.id} for d in days for i in range(2)]
+        weijing.db.session.execute(weijing.Settlement.__table__.insert(), rows)
+    return rec.id
+
+
+def facts(weijing):
+    return sorted(tuple(r) for r in weijing.db.session.execute(weijing.DailyFact.__table__.select()))
+
+
+def assert_matches_rebuild(weijing):
+    """增量维护出来的 daily_facts 与从原始行整表重建的逐行相同"""
+    incremental = facts(weijing)
+    assert weijing.check_daily_facts() == []
+    weijing.rebuild_daily_facts()
+    assert facts(weijing) == incremental
+    weijing.db.session.rollback()
+    return incremental
+
+
+def test_refresh_after_partially_failed_file(weijing):
+    # 库里已有同几天的发货和结算，增量重算要把新旧行合在一起算
+    add_upload(weijing, 'shipment', '维鲸', DAYS[:3], 'old')
+    add_upload(weijing, 'settlement', '维鲸', DAYS, 'old')
+    weijing.rebuild_daily_facts(); weijing.db.session.commit()
+
+    writer = weijing.ChunkedWriter(weijing.Shipment.__table__, chunk_size=4, ignore_conflicts=True, fact_date='date')
+    row = lambda shop_name, d, sku: {'shop_name': shop_name, 'order_no': 'WB2503010009', 'custom_sku': sku, 'date': d, 'quantity': 3, 'declared_price_total': 7.5, 'cost_price_total': 2.0}
+    writer.extend([row('维鲸', d, f"new-{d}") for d in DAYS[:4]])
+    # 第二块里有一行日期不是 date，整块写不进去：维鲸 5、6 日和鲸选 1 日都不算
+    writer.extend([row('维鲸', DAYS[4], 'new-5'), row('维鲸', DAYS[5], 'new-6'), row('鲸选', '2025-03-07', 'bad'), row('鲸选', DAYS[0], 'x-1')])
+    # 第三块最后一行撞唯一索引，跳过
+    writer.extend([row('鲸选', DAYS[1], 'x-2'), row('鲸选', DAYS[2], 'x-3'), row('维鲸', DAYS[0], f"old-{DAYS[0]}-0")])
+    writer.flush()
+    assert (writer.written, writer.failed) == (6, 4)
+    weijing.refresh_daily_facts(writer.touched); weijing.db.session.commit()
+
+    got = assert_matches_rebuild(weijing)
+    assert [r[1] for r in got if r[0] == '鲸选'] == DAYS[1:3]
+    assert [r[2] for r in got if r[0] == '维鲸'] == [3, 3, 3, 1, 0, 0]
+
+
+def test_delete_file_keeps_facts_in_sync(weijing):
+    shipment = add_upload(weijing, 'shipment', '维鲸', DAYS[:4], 'a')
+    add_upload(weijing, 'shipment', '维鲸', DAYS[2:], 'b')
+    settlement = add_upload(weijing, 'settlement', '维鲸', DAYS[1:3], 'c')
+    add_upload(weijing, 'settlement', '鲸选', DAYS, 'd')
+    weijing.rebuild_daily_facts(); weijing.db.session.commit()
+    client = weijing.app.test_client()
+
+    assert client.post(f'/files/delete/{shipment}').get_json()['status'] == 'success'
+    got = assert_matches_rebuild(weijing)
+    # 3 月 1 日没有别的数据了，整行删掉；2 日只剩 c 的结算，发货那一半清零
+    assert [r[1] for r in got if r[0] == '维鲸'] == DAYS[1:]
+    assert [r[2:] for r in got if r[:2] == ('维鲸', DAYS[1])] == [(0, None, None, None, 2, 40.0, -2.5, 1.0, -1.0)]
+    assert client.post(f'/files/delete/{settlement}').get_json()['status'] == 'success'
+    got = assert_matches_rebuild(weijing)
+    assert [r[1] for r in got if r[0] == '维鲸'] == DAYS[2:]
+
+
+def test_clear_data_empties_facts(weijing):
+    add_upload(weijing, 'shipment', '维鲸', DAYS, 'a')
+    add_upload(weijing, 'settlement', '鲸选', DAYS, 'b')
+    weijing.rebuild_daily_facts(); weijing.db.session.commit()
+    client = weijing.app.test_client()
+
+    assert client.post('/test/clear', json={'password': 'wrong'}).get_json()['status'] == 'error'
+    assert len(assert_matches_rebuild(weijing)) == 2 * len(DAYS)
+    assert client.post('/test/clear', json={'password': 'caomei521'}).get_json()['status'] == 'success'
+    assert assert_matches_rebuild(weijing) == []
@@ -0,0 +1,29 @@
+import re
+import pytest
+from sqlalchemy import event
+
+# 发货 / 结算报表的各种筛选组合：整年、整月、某月某日、每个月的同一天、年末最后一天，所有店铺和单个店铺
+REPORT_PLAN_CASES = [f"{path}?year=2025&shop_name={shop}{period}" for path in ('/shipment', '/settlement') for shop in ('所有店铺', '维鲸') for period in ('', '&month=3', '&month=3&day=8', '&day=8', '&month=12&day=31')]
+REPORT_TABLES = ('shipments', 'settlements', 'daily_stats', 'daily_facts')
+
+
+def report_plans(weijing, url):
+    """请求一个报表页，把它发出的每条 SELECT 拿去 EXPLAIN QUERY PLAN -> [(SQL, 计划里的一步)]"""
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'): statements.append((statement, parameters))
+    event.listen(weijing.db.engine, 'before_cursor_execute', record)
+    try:
+        assert weijing.app.test_client().get(url).status_code == 200
+    finally:
+        event.remove(weijing.db.engine, 'before_cursor_execute', record)
+    with weijing.db.engine.connect() as conn:
+        return [(statement, row[-1]) for statement, parameters in statements for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+@pytest.mark.parametrize('url', REPORT_PLAN_CASES)
+def test_report_queries_use_indexes(reports, url):
+    steps = [(statement, detail) for statement, detail in report_plans(reports, url) if re.match(r'(SCAN|SEARCH) (\w+)', detail) and detail.split()[1] in REPORT_TABLES]
+    assert steps, "报表页没有查到报表表"
+    full_scans = [f"{detail}\n  {' '.join(statement.split())}" for statement, detail in steps if not re.search(r'USING (COVERING )?INDEX', detail)]
+    assert not full_scans, '\n'.join(full_scans)
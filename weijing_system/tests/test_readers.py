@@ -0,0 +1,16 @@
+import pandas as pd
+import pytest
+import readers
+from readers import UploadReader
+
+
+@pytest.mark.skipif(readers.python_calamine is None, reason='没装 python-calamine')
+def test_forced_backend_ignores_calamine_size_cutoff(tmp_path, monkeypatch):
+    path = str(tmp_path / 'shipments.xlsx')
+    pd.DataFrame({'备货单': [f"WB250301{i:04d}" for i in range(50)], '件数': range(50)}).to_excel(path, index=False)
+    monkeypatch.setattr(readers, 'CALAMINE_MAX_BYTES', 1024)
+    # 自动选择时超过上限的 xlsx 不用 calamine；指定了 calamine 就按指定的读（bench_readers 测大文件用）
+    assert UploadReader(path, 'shipments.xlsx').candidates == ['openpyxl']
+    reader = UploadReader(path, 'shipments.xlsx', backends=['calamine'])
+    assert sum(len(df) for df in reader.chunks()) == 50
+    assert reader.backend == 'calamine'
@@ -0,0 +1,34 @@
+import pytest
+from flask import template_rendered
+from sqlalchemy import event
+
+# (短区间, 长区间)：月报是只有 1 个月数据的 2024 年和有 11 个月数据的 2025 年，日报是只有 3 天数据的 2 月和 31 天都有数据的 3 月
+RANGES = [('year=2024', 'year=2025'), ('year=2025&month=2', 'year=2025&month=3')]
+
+
+def render(weijing, url):
+    """请求一个报表页 -> (发出的 SELECT 条数, 表格行数)"""
+    selects, rows = [0], [0]
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'): selects[0] += 1
+    def table_rows(sender, template, context, **extra):
+        rows[0] = len(context.get('daily_data') or context.get('report_data') or [])
+    event.listen(weijing.db.engine, 'before_cursor_execute', count)
+    template_rendered.connect(table_rows, weijing.app)
+    try:
+        assert weijing.app.test_client().get(url).status_code == 200
+    finally:
+        event.remove(weijing.db.engine, 'before_cursor_execute', count)
+        template_rendered.disconnect(table_rows, weijing.app)
+    return selects[0], rows[0]
+
+
+@pytest.mark.parametrize('path', ['/shipment', '/settlement'])
+@pytest.mark.parametrize('shop', ['所有店铺', '维鲸'])
+@pytest.mark.parametrize('short, long', RANGES)
+def test_statement_count_does_not_grow_with_range(reports, path, shop, short, long):
+    # 日报本页各天的手工数据、另一侧数据都是一条分组查询取齐，查询条数不随区间里的天数 / 月数增长
+    short_selects, short_rows = render(reports, f"{path}?shop_name={shop}&{short}")
+    long_selects, long_rows = render(reports, f"{path}?shop_name={shop}&{long}")
+    assert long_rows > short_rows > 0
+    assert long_selects == short_selects
@@ -0,0 +1,21 @@
+from sku_filter import SkuBloomFilter
+
+
+def popcount(bf):
+    return sum(bin(b).count('1') for b in bf.bits)
+
+
+def test_stats_track_set_bits_without_rescanning(tmp_path):
+    bf = SkuBloomFilter(capacity=1000)
+    for i in range(800): bf.add(f"SKU{i}")
+    bf.add('SKU1')  # 已有的 SKU 再加一次不会多置位
+    assert bf.bits_set == popcount(bf)
+    assert bf.stats()['estimated_fp_rate'] == (popcount(bf) / bf.num_bits) ** bf.num_hashes
+
+    path = str(tmp_path / 'custom_sku.bloom')
+    bf.save(path)
+    loaded = SkuBloomFilter.load(path)
+    assert loaded.bits_set == bf.bits_set
+    assert loaded.stats() == bf.stats()
+    loaded.add('SKU-new')
+    assert loaded.bits_set == popcount(loaded)